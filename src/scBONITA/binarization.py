@@ -0,0 +1,208 @@
+import numpy as np
+import scipy.sparse as sparse
+
+# per-gene threshold strategies accepted by binarizeMatrix, with the default parameter of each
+BINARIZE_METHODS = {"global": None, "quantile": 0.5, "kmeans": 100, "mixture": 100}
+
+
+def parseBinarizeMethod(method, binarizeThreshold=0.001):
+    """Split a binarization spec such as "quantile:0.75" into (name, parameter)"""
+    name, _, parameter = str(method).partition(":")
+    if name not in BINARIZE_METHODS:
+        raise ValueError(
+            "Unknown binarization method "
+            + str(method)
+            + "; use one of "
+            + ", ".join(BINARIZE_METHODS)
+        )
+    if parameter != "":
+        parameter = float(parameter)
+    elif name == "global":
+        parameter = float(binarizeThreshold)
+    else:
+        parameter = BINARIZE_METHODS[name]
+    if name in ["kmeans", "mixture"]:
+        parameter = int(parameter)
+    return name, parameter
+
+
+def binarizeMethodName(method, binarizeThreshold=0.001):
+    """Canonical spec of a binarization method, for example "global:0.001" """
+    name, parameter = parseBinarizeMethod(method, binarizeThreshold)
+    return name + ":" + repr(parameter)
+
+
+def sortedRows(matrix):
+    """Sorted stored values of each row of a CSR matrix. Returns the row of each value, the values, indptr and the number of implicit zeros per row"""
+    matrix = sparse.csr_matrix(matrix, copy=True)
+    matrix.eliminate_zeros()
+    lengths = np.diff(matrix.indptr)
+    rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+    order = np.lexsort((matrix.data, rows))
+    return rows, matrix.data[order], matrix.indptr, matrix.shape[1] - lengths
+
+
+def rowQuantiles(matrix, quantile):
+    """The given quantile of each row of a sparse matrix, counting the implicit zeros, with linear interpolation as in np.quantile"""
+    rows, values, indptr, zeros = sortedRows(matrix)
+    numRows = len(zeros)
+    negatives = np.bincount(rows[values < 0], minlength=numRows)
+    position = quantile * (sparse.csr_matrix(matrix).shape[1] - 1)
+    lower = int(np.floor(position))
+    upper = int(np.ceil(position))
+
+    def valueAt(k):
+        # position k in the sorted row: negative values, then the zeros, then positive values
+        k = np.full(numRows, k)
+        stored = np.where(k < negatives, k, k - zeros)
+        isZero = (k >= negatives) & (k < negatives + zeros)
+        index = np.clip(indptr[0:numRows] + stored, 0, max(len(values) - 1, 0))
+        picked = values[index] if len(values) > 0 else np.zeros(numRows)
+        return np.where(isZero, 0.0, picked)
+
+    lowValues = valueAt(lower)
+    return lowValues + (position - lower) * (valueAt(upper) - lowValues)
+
+
+def rowExtremes(rows, values, indptr, zeros):
+    """Minimum and maximum of each row, counting the implicit zeros, from the output of sortedRows"""
+    numRows = len(zeros)
+    lengths = np.diff(indptr)
+    hasValues = lengths > 0
+    low = np.zeros(numRows)
+    high = np.zeros(numRows)
+    low[hasValues] = values[indptr[0:numRows][hasValues]]
+    high[hasValues] = values[indptr[1 : numRows + 1][hasValues] - 1]
+    low = np.where(zeros > 0, np.minimum(low, 0), low)
+    high = np.where(zeros > 0, np.maximum(high, 0), high)
+    return low, high
+
+
+def kmeansThresholds(matrix, maxIterations=100):
+    """Per-row threshold: the midpoint of the two centers of a one-dimensional k-means fit with k = 2"""
+    rows, values, indptr, zeros = sortedRows(matrix)
+    numRows = len(zeros)
+    numColumns = sparse.csr_matrix(matrix).shape[1]
+    low, high = rowExtremes(rows, values, indptr, zeros)
+    totals = np.bincount(rows, weights=values, minlength=numRows)
+    for iteration in range(0, maxIterations):
+        threshold = (low + high) / 2
+        above = values > threshold[rows]
+        zerosAbove = np.where(0 > threshold, zeros, 0)
+        highCounts = np.bincount(rows[above], minlength=numRows) + zerosAbove
+        highSums = np.bincount(rows[above], weights=values[above], minlength=numRows)
+        lowCounts = numColumns - highCounts
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newLow = np.where(lowCounts > 0, (totals - highSums) / lowCounts, low)
+            newHigh = np.where(highCounts > 0, highSums / highCounts, high)
+        if np.allclose(newLow, low) and np.allclose(newHigh, high):
+            break
+        low, high = newLow, newHigh
+    return (low + high) / 2
+
+
+def mixtureThresholds(matrix, maxIterations=100, minVariance=1e-6):
+    """Per-row threshold: the midpoint of the two means of a two-component Gaussian mixture fitted by EM"""
+    rows, values, indptr, zeros = sortedRows(matrix)
+    numRows = len(zeros)
+    numColumns = sparse.csr_matrix(matrix).shape[1]
+    split = kmeansThresholds(matrix, maxIterations)
+    totals = np.bincount(rows, weights=values, minlength=numRows)
+    squareTotals = np.bincount(rows, weights=np.square(values), minlength=numRows)
+    # initial responsibility of the high component: the k-means assignment
+    responsibility = (values > split[rows]).astype(np.float64)
+    zeroResponsibility = (0 > split).astype(np.float64)
+    means = None
+    for iteration in range(0, maxIterations):
+        # M step, with the zeros of each row entering as one weighted point
+        highWeights = (
+            np.bincount(rows, weights=responsibility, minlength=numRows)
+            + zeros * zeroResponsibility
+        )
+        highSums = np.bincount(rows, weights=responsibility * values, minlength=numRows)
+        highSquares = np.bincount(
+            rows, weights=responsibility * np.square(values), minlength=numRows
+        )
+        lowWeights = numColumns - highWeights
+        with np.errstate(divide="ignore", invalid="ignore"):
+            highMeans = np.where(highWeights > 0, highSums / highWeights, np.nan)
+            lowMeans = np.where(lowWeights > 0, (totals - highSums) / lowWeights, np.nan)
+            highVariances = highSquares / highWeights - np.square(highMeans)
+            lowVariances = (squareTotals - highSquares) / lowWeights - np.square(lowMeans)
+        # an empty component takes the mean of the other, so the threshold falls on the row's single mode
+        highMeans = np.where(np.isnan(highMeans), lowMeans, highMeans)
+        lowMeans = np.where(np.isnan(lowMeans), highMeans, lowMeans)
+        highVariances = np.maximum(np.nan_to_num(highVariances), minVariance)
+        lowVariances = np.maximum(np.nan_to_num(lowVariances), minVariance)
+        newMeans = np.stack([lowMeans, highMeans])
+        if means is not None and np.allclose(newMeans, means):
+            break
+        means = newMeans
+        # E step
+        highLogWeights = np.log(np.maximum(highWeights / numColumns, 1e-300))
+        lowLogWeights = np.log(np.maximum(lowWeights / numColumns, 1e-300))
+
+        def highPosterior(x, r):
+            highLog = (
+                highLogWeights[r]
+                - 0.5 * np.log(highVariances[r])
+                - np.square(x - highMeans[r]) / (2 * highVariances[r])
+            )
+            lowLog = (
+                lowLogWeights[r]
+                - 0.5 * np.log(lowVariances[r])
+                - np.square(x - lowMeans[r]) / (2 * lowVariances[r])
+            )
+            return 1 / (1 + np.exp(np.clip(lowLog - highLog, -700, 700)))
+
+        responsibility = highPosterior(values, rows)
+        zeroResponsibility = highPosterior(np.zeros(numRows), np.arange(numRows))
+    return np.mean(means, axis=0)
+
+
+def binarizeRows(matrix, thresholds):
+    """Binary CSR matrix with 1 where a value is above the threshold of its row"""
+    matrix = sparse.csr_matrix(matrix)
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    binMat = sparse.csr_matrix(
+        (
+            (matrix.data > np.maximum(thresholds, 0)[rows]).astype(matrix.dtype),
+            matrix.indices.copy(),
+            matrix.indptr.copy(),
+        ),
+        shape=matrix.shape,
+    )
+    binMat.eliminate_zeros()
+    return binMat
+
+
+def geneThresholds(matrix, method, binarizeThreshold=0.001):
+    """Threshold of each row (gene) of a genes * cells sparse matrix for a binarization method (see parseBinarizeMethod)"""
+    name, parameter = parseBinarizeMethod(method, binarizeThreshold)
+    if name == "global":
+        return np.full(matrix.shape[0], parameter)
+    if name == "quantile":
+        return rowQuantiles(matrix, parameter)
+    if name == "kmeans":
+        return kmeansThresholds(matrix, parameter)
+    return mixtureThresholds(matrix, parameter)
+
+
+def binarizeMatrix(matrix, method="global", binarizeThreshold=0.001):
+    """Binarize a genes * cells sparse matrix with per-gene thresholds.
+
+    Parameters
+    ----------
+
+    matrix: scipy sparse matrix
+        Expression values, genes * cells
+    method: str
+        "global" (or "global:cutoff"), "quantile:q", "kmeans" or "mixture"
+    binarizeThreshold: float
+        Cutoff for "global"
+
+    Returns
+    -------
+        binary CSR matrix of genes * cells
+    """
+    return binarizeRows(matrix, geneThresholds(matrix, method, binarizeThreshold))
@@ -0,0 +1,151 @@
+import numpy as np
+import scipy.sparse as sparse
+
+# number of set bits in each possible byte
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(0, 256)], dtype=np.uint8)
+
+
+def phiCoefficients(n, both, sumsA, sumsB):
+    """Phi coefficient of pairs of binary vectors of length n; nan for a constant vector"""
+    n = float(n)
+    both = np.asarray(both, dtype=np.float64)
+    sumsA = np.asarray(sumsA, dtype=np.float64)
+    sumsB = np.asarray(sumsB, dtype=np.float64)
+    numerator = n * both - sumsA * sumsB
+    denominator = np.sqrt(sumsA * (n - sumsA) * sumsB * (n - sumsB))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+class bitMatrix:
+
+    """Binary genes * cells matrix stored with one bit per entry, each row packed with np.packbits"""
+
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    @property
+    def rowBytes(self):
+        return self.packed.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    @classmethod
+    def fromDense(cls, matrix):
+        """Pack a dense array; entries that are not 0 are set"""
+        matrix = np.asarray(matrix) != 0
+        return cls(np.packbits(matrix, axis=1), matrix.shape)
+
+    @classmethod
+    def fromSparse(cls, matrix, chunkSize=4096):
+        """Pack a scipy sparse matrix without densifying it; stored entries that are not 0 are set"""
+        matrix = sparse.csr_matrix(matrix)
+        numRows, numColumns = matrix.shape
+        rowBytes = (numColumns + 7) // 8
+        packed = np.zeros((numRows, rowBytes), dtype=np.uint8)
+        for start in range(0, numRows, chunkSize):
+            end = min(start + chunkSize, numRows)
+            block = matrix[start:end, :]
+            nonZero = block.data != 0
+            rows = np.repeat(np.arange(end - start), np.diff(block.indptr))[nonZero]
+            columns = block.indices[nonZero]
+            # the bits of one byte are distinct, so summing them is the same as or-ing them
+            packed[start:end, :] = np.bincount(
+                rows * rowBytes + (columns >> 3),
+                weights=np.right_shift(0x80, columns & 7),
+                minlength=(end - start) * rowBytes,
+            ).reshape(end - start, rowBytes)
+        return cls(packed, matrix.shape)
+
+    @classmethod
+    def fromMatrix(cls, matrix):
+        """Convert a sparse or dense binary matrix, or return matrix if it is already a bitMatrix"""
+        if isinstance(matrix, cls):
+            return matrix
+        if sparse.issparse(matrix):
+            return cls.fromSparse(matrix)
+        return cls.fromDense(matrix)
+
+    def getRow(self, row):
+        """Row as a uint8 array of 0s and 1s"""
+        return np.unpackbits(self.packed[row, :], count=self.shape[1])
+
+    def getRows(self, rows, columns=None):
+        """Rows as a len(rows) * (columns or all columns) uint8 array of 0s and 1s"""
+        count = self.shape[1] if columns is None else columns
+        return np.unpackbits(self.packed[rows, :], axis=1, count=count)
+
+    def selectRows(self, rows):
+        """New bitMatrix with the given rows"""
+        return bitMatrix(self.packed[rows, :], (len(rows), self.shape[1]))
+
+    def rowSums(self):
+        """Number of set bits in each row"""
+        return POPCOUNT[self.packed].sum(axis=1, dtype=np.int64)
+
+    def andCounts(self, rowsA, rowsB, chunkSize=1024):
+        """Number of columns set in both rowsA[i] and rowsB[i], for each pair i, from the packed rows"""
+        rowsA = np.asarray(rowsA, dtype=np.int64)
+        rowsB = np.asarray(rowsB, dtype=np.int64)
+        counts = np.zeros(len(rowsA), dtype=np.int64)
+        for start in range(0, len(rowsA), chunkSize):
+            end = min(start + chunkSize, len(rowsA))
+            both = np.bitwise_and(
+                self.packed[rowsA[start:end], :], self.packed[rowsB[start:end], :]
+            )
+            counts[start:end] = POPCOUNT[both].sum(axis=1, dtype=np.int64)
+        return counts
+
+    def pairCorrelations(self, rowsA, rowsB):
+        """Correlation of rowsA[i] with rowsB[i], for each pair i, in float32 as in correlationMatrix"""
+        rowsA = np.asarray(rowsA, dtype=np.int64)
+        rowsB = np.asarray(rowsB, dtype=np.int64)
+        uniqueRows, inverse = np.unique(
+            np.concatenate([rowsA, rowsB]), return_inverse=True
+        )
+        sums = self.selectRows(uniqueRows).rowSums()[np.ravel(inverse)]
+        return phiCoefficients(
+            self.shape[1],
+            self.andCounts(rowsA, rowsB),
+            sums[0 : len(rowsA)],
+            sums[len(rowsA) :],
+        ).astype(np.float32)
+
+    def coOccurrences(self, chunkColumns=4096):
+        """rows * rows matrix of the number of columns set in both rows"""
+        numRows = self.shape[0]
+        counts = np.zeros((numRows, numRows), dtype=np.float64)
+        # chunkColumns is a multiple of 8, so each block starts on a byte boundary
+        chunkColumns = max(8, chunkColumns - chunkColumns % 8)
+        for start in range(0, self.shape[1], chunkColumns):
+            end = min(start + chunkColumns, self.shape[1])
+            block = np.unpackbits(
+                self.packed[:, start // 8 : (end + 7) // 8], axis=1, count=end - start
+            ).astype(np.float32)
+            # products of 0/1 entries summed over one block are exact in float32
+            counts += block.dot(block.T)
+        return counts.astype(np.int64)
+
+    def correlationMatrix(self, chunkColumns=4096, chunkRows=1024):
+        """rows * rows float32 matrix of the correlations between all pairs of rows (see pairCorrelations)"""
+        sums = self.rowSums()
+        counts = self.coOccurrences(chunkColumns)
+        correlations = np.empty(counts.shape, dtype=np.float32)
+        for start in range(0, self.shape[0], chunkRows):
+            end = min(start + chunkRows, self.shape[0])
+            correlations[start:end, :] = phiCoefficients(
+                self.shape[1],
+                counts[start:end, :],
+                sums[start:end, np.newaxis],
+                sums[np.newaxis, :],
+            )
+        return correlations
+
+    def toarray(self):
+        return self.getRows(np.arange(self.shape[0]))
+
+    def tocsr(self):
+        return sparse.csr_matrix(self.toarray())
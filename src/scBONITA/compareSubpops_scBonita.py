@@ -104,15 +104,21 @@ def compareSubpops(graphNames):
 
             dataPickle = glob.glob(dataName)[0]
             allscData = pickle.load(open(dataPickle, "rb"))
-            graph = nx.read_graphml(graphName)
+            # the processed network the rules were inferred on
+            graph = nx.read_graphml(graphName + "_processed.graphml")
 
             errorsName = glob.glob(str(graphName) + "*_localErrors1.pickle")[0]
             localErrors = pickle.load(open(errorsName, "rb"))
 
-            allscData.inherit(
-                allscData.pathwayGraphs[graphName],
+            # the rule structure saved during rule inference, so that the equivalent rules line up
+            allscData._singleCell__inherit(
+                graph,
                 removeSelfEdges=False,
-                restrictIncomingEdges=False,
+                restrictIncomingEdges=True,
+                maxIncomingEdges=allscData.maxIncomingEdges,
+                maxTermInputs=allscData.maxTermInputs,
+                modelFile=graphName + "_processed.graphml_model.pickle",
+                requireStructure=True,
             )
             equivs = pickle.load(
                 open(graphName + "_processed.graphml_equivs1.pickle", "rb")
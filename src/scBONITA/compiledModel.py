@@ -0,0 +1,90 @@
+import numpy as np
+import ctypes as ctypes
+import networkx as nx
+
+
+class compiledModel:
+
+    """Flat int32 encoding of the rules of a ruleMaker model, in the layout used by the simulator"""
+
+    def __init__(self, andNodeList, andNodeInvertList):
+        self.nodeNum = len(andNodeList)
+        termLengths = [len(terms) for terms in andNodeList]
+        inputLengths = [len(term) for terms in andNodeList for term in terms]
+        self.termOffsets = self.__offsets(termLengths)
+        self.inputOffsets = self.__offsets(inputLengths)
+        self.inputs = self.__freeze(
+            [node for terms in andNodeList for term in terms for node in term]
+        )
+        self.inverts = self.__freeze(
+            [int(bool(invert)) for terms in andNodeInvertList for term in terms for invert in term]
+        )
+        self.settleOrder = self.__settleOrder()
+        self.__setPointers()
+
+    def __settleOrder(self):
+        # topological order of the strongly connected components of the input graph
+        termNodes = np.repeat(np.arange(self.nodeNum), np.diff(self.termOffsets))
+        inputGraph = nx.DiGraph()
+        inputGraph.add_nodes_from(range(self.nodeNum))
+        inputGraph.add_edges_from(
+            zip(
+                self.inputs.tolist(),
+                np.repeat(termNodes, np.diff(self.inputOffsets)).tolist(),
+            )
+        )
+        condensed = nx.condensation(inputGraph)
+        return self.__freeze(
+            [
+                node
+                for component in nx.topological_sort(condensed)
+                for node in sorted(condensed.nodes[component]["members"])
+            ]
+        )
+
+    def __offsets(self, lengths):
+        offsets = np.zeros(len(lengths) + 1, dtype=np.intc)
+        offsets[1:] = np.cumsum(lengths)
+        offsets.flags.writeable = False
+        return offsets
+
+    def __freeze(self, values):
+        array = np.array(values, dtype=np.intc, order="C")
+        array.flags.writeable = False
+        return array
+
+    def __setPointers(self):
+        # built once; the arrays never move while the object is alive
+        self.pointers = tuple(
+            ctypes.c_void_p(array.ctypes.data)
+            for array in (
+                self.termOffsets,
+                self.inputOffsets,
+                self.inputs,
+                self.inverts,
+                self.settleOrder,
+            )
+        )
+
+    @property
+    def size(self):
+        """Number of AND terms, which is the length of an individual"""
+        return int(self.termOffsets[-1])
+
+    def __deepcopy__(self, memo):
+        # immutable, so copies of a ruleMaker made by the GA share it
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["pointers"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "settleOrder" not in state:
+            # saved before the simulator reduced the network
+            self.settleOrder = self.__settleOrder()
+        for name in ["termOffsets", "inputOffsets", "inputs", "inverts", "settleOrder"]:
+            getattr(self, name).flags.writeable = False
+        self.__setPointers()
@@ -0,0 +1,903 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+import scipy.io
+import itertools
+import gzip
+import bz2
+import io
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from os import path
+from functools import partial
+from multiprocessing import Pool
+from bitMatrix import *
+from hdf5Store import *
+from binarization import *
+
+
+# leading bytes of each supported compressed format
+COMPRESSION_MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+
+# external decompressors that run in their own process (and threads), in order of preference
+DECOMPRESSORS = {
+    "gzip": [["pigz", "-dc", "-p", "{threads}"], ["gzip", "-dc"]],
+    "bz2": [["lbzip2", "-dc", "-n", "{threads}"], ["pbzip2", "-dc", "-p{threads}"]],
+    "zstd": [["zstd", "-dcq", "-T{threads}"]],
+}
+
+
+def compressionFormat(dataName):
+    """Compression format of a file ("gzip", "bz2" or "zstd"), or None if it is not compressed"""
+    with open(dataName, "rb") as dataFile:
+        start = dataFile.read(4)
+    for magic, codec in COMPRESSION_MAGIC:
+        if start.startswith(magic):
+            return codec
+    return None
+
+
+def decompressorCommand(codec, threads):
+    """Command line of the first installed external decompressor for codec, or None"""
+    for command in DECOMPRESSORS[codec]:
+        if shutil.which(command[0]) is not None:
+            return [part.format(threads=threads) for part in command]
+    return None
+
+
+@contextmanager
+def decompressorPipe(command, dataName):
+    """Binary stream of the output of an external decompressor"""
+    process = subprocess.Popen(
+        command + [dataName], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        yield process.stdout
+    finally:
+        # peek returns b"" only once the decompressor has written everything and closed its end of the pipe
+        finished = process.stdout.closed or process.stdout.peek(1) == b""
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        error = process.stderr.read()
+        process.stderr.close()
+        process.wait()
+    if finished and process.returncode != 0:
+        raise IOError(
+            "Could not decompress "
+            + str(dataName)
+            + " with "
+            + command[0]
+            + ": "
+            + error.decode("utf-8", "replace").strip()
+        )
+
+
+@contextmanager
+def openData(dataName, binary=False, threads=1):
+    """Open a plain, gzip, bzip2 or zstandard compressed input file for streaming
+
+    Parameters
+    ----------
+
+    dataName: str
+        Path to the file
+    binary: bool
+        Yield a binary stream instead of a text stream
+    threads: int
+        Number of threads of an external decompressor (pigz, lbzip2/pbzip2 or zstd), if more than 1 and one is installed
+    """
+    codec = compressionFormat(dataName)
+    if codec is None:
+        with open(dataName, "rb" if binary else "r") as dataFile:
+            yield dataFile
+        return
+    command = decompressorCommand(codec, threads) if threads > 1 else None
+    if command is not None:
+        with decompressorPipe(command, dataName) as stream:
+            yield stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+        return
+    if codec == "gzip":
+        stream = gzip.open(dataName, "rb")
+    elif codec == "bz2":
+        stream = bz2.open(dataName, "rb")
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            command = decompressorCommand(codec, threads)
+            if command is None:
+                raise ImportError(
+                    "Reading zstandard compressed files requires the zstandard package (pip install zstandard) or the zstd program"
+                )
+            with decompressorPipe(command, dataName) as stream:
+                yield stream if binary else io.TextIOWrapper(
+                    stream, encoding="utf-8"
+                )
+            return
+        stream = zstandard.ZstdDecompressor().stream_reader(
+            open(dataName, "rb"), closefd=True
+        )
+    with stream:
+        yield stream if binary else io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def readHeader(dataName, sep):
+    """Read the cell IDs from the first line of a matrix-style expression file"""
+    with openData(dataName) as dataFile:
+        sampleList = dataFile.readline().rstrip("\r\n").split(sep)
+    return sampleList[1 : len(sampleList)]
+
+
+def rowName(line, sep):
+    """The first field of a line"""
+    end = line.find(sep)
+    if end < 0:
+        return line.rstrip("\r\n")
+    return line[0:end]
+
+
+def readGeneColumn(dataName, sep, threads=1):
+    """Read the gene names from the first column of a matrix-style expression file"""
+    geneList = []
+    with openData(dataName, threads=threads) as dataFile:
+        dataFile.readline()
+        for line in dataFile:
+            if line.strip() == "":
+                continue
+            geneList.append(rowName(line, sep))
+    return geneList
+
+
+def iterChunks(dataFile, chunkSize, sep=None, geneSubset=None):
+    """Yield blocks of at most chunkSize non-empty lines from an open file, optionally only those of the genes in geneSubset"""
+    chunk = []
+    for line in dataFile:
+        if line.strip() == "":
+            continue
+        if geneSubset is not None and rowName(line, sep) not in geneSubset:
+            continue
+        chunk.append(line)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def parseExpressionChunk(lines, sep, columnIndices=None):
+    """Tokenise a block of rows into row names, row lengths and CSR column indices and values"""
+    genes = []
+    rowLengths = np.zeros(len(lines), dtype=np.int64)
+    indices = []
+    data = []
+    for row in range(0, len(lines)):
+        fields = lines[row].rstrip("\r\n").split(sep)
+        genes.append(fields[0])
+        values = np.array(fields[1 : len(fields)], dtype=np.float64)
+        if columnIndices is not None:
+            values = values[columnIndices]
+        nonZero = np.flatnonzero(values)
+        rowLengths[row] = len(nonZero)
+        indices.append(nonZero.astype(np.int32))
+        data.append(values[nonZero])
+    return (
+        genes,
+        rowLengths,
+        np.concatenate(indices),
+        np.concatenate(data),
+    )
+
+
+def parseChunks(chunks, parser, numColumns, processes=1):
+    """Parse blocks of rows with parser and stack them into a CSR matrix. Returns the row names and the matrix"""
+    rowNames = []
+    rowLengths = []
+    indices = []
+    data = []
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        while True:
+            # only hand a bounded number of chunks to the workers at a time so that the file is not read into memory ahead of parsing
+            batch = list(itertools.islice(chunks, max(1, 4 * processes)))
+            if len(batch) == 0:
+                break
+            if pool is not None:
+                results = pool.map(parser, batch)
+            else:
+                results = [parser(chunk) for chunk in batch]
+            for chunkNames, chunkLengths, chunkIndices, chunkData in results:
+                rowNames.extend(chunkNames)
+                rowLengths.append(chunkLengths)
+                indices.append(chunkIndices)
+                data.append(chunkData)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    indptr = np.zeros(len(rowNames) + 1, dtype=np.int64)
+    if len(rowLengths) > 0:
+        np.cumsum(np.concatenate(rowLengths), out=indptr[1 : len(indptr)])
+        indices = np.concatenate(indices)
+        data = np.concatenate(data)
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+        data = np.zeros(0, dtype=np.float64)
+    matrix = sparse.csr_matrix(
+        (data, indices, indptr), shape=(len(rowNames), numColumns)
+    )
+    return rowNames, matrix
+
+
+def readExpressionMatrix(
+    dataName, sep, cellIndices=None, chunkSize=1000, processes=1, geneSubset=None
+):
+    """Stream a genes * cells expression file into a CSR matrix
+
+    Parameters
+    ----------
+
+    dataName: str
+        Path to the expression file, optionally compressed, with cell IDs in the first row and gene names in the first column
+    sep: str
+        Delimiting character in dataName
+    cellIndices: array of int
+        Zero-based positions of the cells to keep. All cells are kept if None.
+    chunkSize: int
+        Number of gene rows tokenised at a time
+    processes: int
+        Number of worker processes used to tokenise chunks
+    geneSubset: set of str
+        Names of the genes to keep. All genes are kept if None.
+
+    Returns
+    -------
+        geneList, sampleList, expMat (scipy CSR matrix of genes * cells)
+    """
+    sampleList = readHeader(dataName, sep)
+    if cellIndices is not None:
+        cellIndices = np.asarray(cellIndices, dtype=np.int64)
+        sampleList = [sampleList[i] for i in cellIndices]
+    parser = partial(parseExpressionChunk, sep=sep, columnIndices=cellIndices)
+    with openData(dataName, threads=processes) as dataFile:
+        dataFile.readline()
+        chunks = iterChunks(dataFile, chunkSize, sep=sep, geneSubset=geneSubset)
+        geneList, expMat = parseChunks(chunks, parser, len(sampleList), processes)
+    return geneList, sampleList, expMat
+
+
+def reservoirSample(lines, size, seed=None):
+    """Select size items uniformly at random from an iterator in one pass. Returns (position, item) pairs in input order"""
+    randomState = np.random.RandomState(seed)
+    reservoir = list(zip(range(0, size), itertools.islice(lines, size)))
+    if len(reservoir) < size:
+        return reservoir
+    weight = np.exp(np.log(randomState.random_sample()) / size)
+    position = size
+    while True:
+        skip = int(np.floor(np.log(randomState.random_sample()) / np.log(1 - weight)))
+        position = position + skip
+        item = next(itertools.islice(lines, skip, skip + 1), None)
+        if item is None:
+            break
+        reservoir[randomState.randint(size)] = (position, item)
+        position = position + 1
+        weight = weight * np.exp(np.log(randomState.random_sample()) / size)
+    reservoir.sort(key=lambda pair: pair[0])
+    return reservoir
+
+
+def readConditionStrata(conditionsFile, sep, sampleList):
+    """Label each cell in sampleList by its combination of conditions in a conditions table"""
+    conditions = pd.read_csv(conditionsFile, sep=sep, index_col=0)
+    conditions.index = conditions.index.astype(str)
+    conditions = conditions.reindex(sampleList).fillna(0).astype(int)
+    combinations, strata = np.unique(conditions.values, axis=0, return_inverse=True)
+    labels = np.array(
+        [
+            "|".join(conditions.columns[combination == 1])
+            for combination in combinations
+        ],
+        dtype=object,
+    )
+    return labels[np.ravel(strata)]
+
+
+def stratumQuotas(counts, size, minPerStratum=1):
+    """Number of cells to draw from each stratum, proportional to its size and at least minPerStratum"""
+    counts = np.asarray(counts, dtype=np.int64)
+    if size >= counts.sum():
+        return counts.copy()
+    quotas = np.minimum(counts, minPerStratum)
+    if quotas.sum() > size:
+        # more strata than draws: one cell from each of the largest strata
+        quotas = np.zeros(len(counts), dtype=np.int64)
+        quotas[np.argsort(-counts, kind="stable")[0:size]] = 1
+        return quotas
+    remaining = size - quotas.sum()
+    capacity = counts - quotas
+    share = remaining * capacity / capacity.sum()
+    extra = np.minimum(np.floor(share).astype(np.int64), capacity)
+    leftover = remaining - extra.sum()
+    # hand out the rounding remainder by largest fractional share
+    order = np.argsort(-(share - np.floor(share)), kind="stable")
+    while leftover > 0:
+        for stratum in order:
+            if leftover == 0:
+                break
+            if extra[stratum] < capacity[stratum]:
+                extra[stratum] = extra[stratum] + 1
+                leftover = leftover - 1
+    return quotas + extra
+
+
+def stratifiedSample(strata, size, seed=None, minPerStratum=1):
+    """Sample size cells, stratified by strata. Returns sorted zero-based cell positions"""
+    labels, inverse, counts = np.unique(
+        np.asarray(strata).astype(str), return_inverse=True, return_counts=True
+    )
+    inverse = np.ravel(inverse)
+    quotas = stratumQuotas(counts, size, minPerStratum)
+    # group the cells by stratum in random order and keep the first quota cells of each group
+    order = np.lexsort(
+        (np.random.RandomState(seed).random_sample(len(inverse)), inverse)
+    )
+    starts = np.concatenate([[0], np.cumsum(counts)[0 : len(counts) - 1]])
+    ranks = np.arange(len(order)) - starts[inverse[order]]
+    return np.sort(order[ranks < quotas[inverse[order]]])
+
+
+def readCellMajorMatrix(
+    dataName,
+    sep,
+    maxSamples=None,
+    seed=None,
+    chunkSize=1000,
+    processes=1,
+    geneSubset=None,
+    cellIndices=None,
+):
+    """Read a cells * genes expression file into a genes * cells CSR matrix, keeping at most maxSamples cells
+
+    Parameters
+    ----------
+
+    dataName: str
+        Path to the expression file, optionally compressed, with gene names in the first row and cell IDs in the first column
+    sep: str
+        Delimiting character in dataName
+    maxSamples: int
+        Maximum number of cells to keep, chosen by reservoir sampling. All cells are kept if None.
+    seed: int
+        Seed for the choice of cells
+    chunkSize: int
+        Number of cell rows tokenised at a time
+    processes: int
+        Number of worker processes used to tokenise chunks, and decompression threads for compressed input
+    geneSubset: set of str
+        Names of the genes to keep. All genes are kept if None.
+    cellIndices: array of int
+        Zero-based positions (among the non-empty rows) of the cells to keep. maxSamples is ignored if this is given.
+
+    Returns
+    -------
+        geneList, sampleList, expMat (scipy CSR matrix of genes * cells)
+    """
+    geneList = readHeader(dataName, sep)
+    geneIndices = None
+    if geneSubset is not None:
+        geneIndices = np.array(
+            [i for i in range(0, len(geneList)) if geneList[i] in geneSubset],
+            dtype=np.int64,
+        )
+        geneList = [geneList[i] for i in geneIndices]
+    with openData(dataName, binary=True, threads=processes) as dataFile:
+        dataFile.readline()
+        rows = (line for line in dataFile if line.strip() != b"")
+        if cellIndices is not None:
+            cellIndices = [int(i) for i in cellIndices]
+            keep = set(cellIndices)
+            kept = {position: line for position, line in enumerate(rows) if position in keep}
+            # in the order of cellIndices, as the other readers return them
+            lines = [kept[i] for i in cellIndices]
+        elif maxSamples is None:
+            lines = list(rows)
+        else:
+            lines = [line for position, line in reservoirSample(rows, maxSamples, seed)]
+    lines = [line.decode("utf-8") for line in lines]
+    chunks = (
+        lines[i : i + chunkSize] for i in range(0, len(lines), chunkSize)
+    )
+    parser = partial(parseExpressionChunk, sep=sep, columnIndices=geneIndices)
+    sampleList, expMat = parseChunks(chunks, parser, len(geneList), processes)
+    return geneList, sampleList, expMat.T.tocsr()
+
+
+def find10xFile(directory, names):
+    """Path of the first of names (plain or gzipped) found in a 10x Genomics output directory"""
+    for name in names:
+        for candidate in [name, name + ".gz"]:
+            if path.isfile(path.join(directory, candidate)):
+                return path.join(directory, candidate)
+    raise FileNotFoundError(
+        "None of " + str(names) + " were found in " + str(directory)
+    )
+
+
+def readTSVColumn(fileName, column):
+    """Read one column of a (possibly gzipped) tab-separated file"""
+    values = []
+    with openData(fileName) as tsvFile:
+        for line in tsvFile:
+            if line.strip() == "":
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            values.append(fields[min(column, len(fields) - 1)])
+    return values
+
+
+def read10xBarcodes(directory):
+    """Read the cell barcodes of a 10x Genomics output directory"""
+    return readTSVColumn(find10xFile(directory, ["barcodes.tsv"]), 0)
+
+
+def read10xGenes(directory):
+    """Read the gene symbols of a 10x Genomics output directory"""
+    return readTSVColumn(find10xFile(directory, ["genes.tsv", "features.tsv"]), 1)
+
+
+def readGeneNames(dataName, sep, cellMajor=False):
+    """Read the gene names of an input file or directory, or the union of those of a list of inputs"""
+    if isinstance(dataName, (list, tuple)):
+        geneList = {}
+        for name in dataName:
+            geneList.update(dict.fromkeys(readGeneNames(name, sep, cellMajor)))
+        return list(geneList)
+    if path.isdir(dataName):
+        return read10xGenes(dataName)
+    if isHDF5(dataName):
+        return readH5adNames(dataName)[0]
+    if cellMajor:
+        return readHeader(dataName, sep)
+    return readGeneColumn(dataName, sep)
+
+
+def read10x(directory, cellIndices=None, geneSubset=None):
+    """Read a 10x Genomics output directory (matrix.mtx, barcodes.tsv and genes.tsv or features.tsv) into a CSR matrix
+
+    Parameters
+    ----------
+
+    directory: str
+        Path to the 10x Genomics output directory
+    cellIndices: array of int
+        Zero-based positions (in barcodes.tsv) of the cells to keep. All cells are kept if None.
+    geneSubset: set of str
+        Names of the genes to keep. All genes are kept if None.
+
+    Returns
+    -------
+        geneList, sampleList, expMat (scipy CSR matrix of genes * cells)
+    """
+    geneList = read10xGenes(directory)
+    sampleList = read10xBarcodes(directory)
+    expMat = sparse.csr_matrix(
+        scipy.io.mmread(find10xFile(directory, ["matrix.mtx"])), dtype=np.float64
+    )
+    if expMat.shape != (len(geneList), len(sampleList)):
+        raise ValueError(
+            "matrix.mtx has shape "
+            + str(expMat.shape)
+            + " but "
+            + str(len(geneList))
+            + " genes and "
+            + str(len(sampleList))
+            + " barcodes were found in "
+            + str(directory)
+        )
+    if cellIndices is not None:
+        cellIndices = np.asarray(cellIndices, dtype=np.int64)
+        expMat = expMat[:, cellIndices]
+        sampleList = [sampleList[i] for i in cellIndices]
+    if geneSubset is not None:
+        geneIndices = [i for i in range(0, len(geneList)) if geneList[i] in geneSubset]
+        expMat = expMat[geneIndices, :]
+        geneList = [geneList[i] for i in geneIndices]
+    return geneList, sampleList, expMat
+
+
+def readCellNames(dataName, sep, cellMajor=False, threads=1):
+    """Read the cell IDs of an input file or directory"""
+    if path.isdir(dataName):
+        return read10xBarcodes(dataName)
+    if isHDF5(dataName):
+        return readH5adNames(dataName)[1]
+    if cellMajor:
+        return readGeneColumn(dataName, sep, threads=threads)
+    return readHeader(dataName, sep)
+
+
+def readMatrix(
+    dataName,
+    sep,
+    cellMajor=False,
+    cellIndices=None,
+    maxSamples=None,
+    seed=None,
+    chunkSize=1000,
+    processes=1,
+    geneSubset=None,
+):
+    """Read an input file or directory into a genes * cells CSR matrix. Returns geneList, sampleList, expMat"""
+    if path.isdir(dataName):
+        return read10x(dataName, cellIndices=cellIndices, geneSubset=geneSubset)
+    if isHDF5(dataName):
+        return readH5ad(dataName, cellIndices=cellIndices, geneSubset=geneSubset)
+    if cellMajor:
+        return readCellMajorMatrix(
+            dataName,
+            sep,
+            maxSamples=maxSamples,
+            seed=seed,
+            chunkSize=chunkSize,
+            processes=processes,
+            geneSubset=geneSubset,
+            cellIndices=cellIndices,
+        )
+    return readExpressionMatrix(
+        dataName,
+        sep,
+        cellIndices=cellIndices,
+        chunkSize=chunkSize,
+        processes=processes,
+        geneSubset=geneSubset,
+    )
+
+
+def sampleName(dataName):
+    """Base name of an input file or directory without its extensions"""
+    name = path.basename(path.normpath(dataName))
+    for extension in [".gz", ".bz2", ".zst", ".h5ad", ".h5", ".csv", ".tsv", ".txt"]:
+        if name.endswith(extension) and len(name) > len(extension):
+            name = name[0 : len(name) - len(extension)]
+    return name
+
+
+def readSample(arguments, sep, cellMajor=False, chunkSize=1000, geneSubset=None):
+    """Read one sample for readSamples. arguments is (dataName, sampleID, cellIndices)"""
+    dataName, sampleID, cellIndices = arguments
+    geneList, sampleList, expMat = readMatrix(
+        dataName,
+        sep,
+        cellMajor=cellMajor,
+        cellIndices=cellIndices,
+        chunkSize=chunkSize,
+        geneSubset=geneSubset,
+    )
+    expMat.eliminate_zeros()
+    return geneList, [sampleID + "_" + cell for cell in sampleList], expMat
+
+
+def mergeSamples(samples, geneJoin="union"):
+    """Concatenate the cells of several genes * cells CSR matrices, aligning their rows by gene name
+
+    samples is a list of (geneList, sampleList, expMat). geneJoin is "union" or "intersection". Returns geneList, sampleList, expMat"""
+    if geneJoin not in ["union", "intersection"]:
+        raise ValueError("geneJoin must be 'union' or 'intersection', not " + str(geneJoin))
+    geneIndex = {}
+    for geneList, sampleList, expMat in samples:
+        for gene in geneList:
+            geneIndex.setdefault(gene, len(geneIndex))
+    if geneJoin == "intersection":
+        shared = set(geneIndex)
+        for geneList, sampleList, expMat in samples:
+            shared.intersection_update(geneList)
+        genes = [gene for gene in geneIndex if gene in shared]
+        geneIndex = {genes[i]: i for i in range(0, len(genes))}
+    mergedGenes = list(geneIndex)
+    blocks = []
+    mergedSamples = []
+    for geneList, sampleList, expMat in samples:
+        # sparse selection matrix that moves each kept row of expMat to its merged position
+        sourceRows = []
+        targetRows = []
+        seen = set()
+        for i in range(0, len(geneList)):
+            if geneList[i] in geneIndex and geneList[i] not in seen:
+                seen.add(geneList[i])
+                sourceRows.append(i)
+                targetRows.append(geneIndex[geneList[i]])
+        selection = sparse.csr_matrix(
+            (np.ones(len(sourceRows)), (targetRows, sourceRows)),
+            shape=(len(mergedGenes), len(geneList)),
+        )
+        blocks.append(sparse.csr_matrix(selection.dot(expMat)))
+        mergedSamples.extend(sampleList)
+    expMat = sparse.hstack(blocks, format="csr")
+    return mergedGenes, mergedSamples, expMat
+
+
+def readSamples(
+    dataNames,
+    sep,
+    sampleIDs=None,
+    cellIndices=None,
+    cellMajor=False,
+    chunkSize=1000,
+    processes=1,
+    geneSubset=None,
+    geneJoin="union",
+):
+    """Read several samples in worker processes and merge them into one genes * cells CSR matrix
+
+    Parameters
+    ----------
+
+    dataNames: list of str
+        Paths to the samples, in any format accepted by readMatrix
+    sep: str
+        Delimiting character in matrix-style files
+    sampleIDs: list of str
+        ID of each sample, prefixed to its cell IDs. The base names of dataNames are used if None.
+    cellIndices: list of arrays of int
+        Zero-based positions of the cells to keep in each sample. All cells are kept if None.
+    cellMajor: bool
+        True if matrix-style files have cells as rows
+    chunkSize: int
+        Number of rows tokenised at a time
+    processes: int
+        Number of samples read at the same time
+    geneSubset: set of str
+        Names of the genes to keep. All genes are kept if None.
+    geneJoin: str
+        "union" or "intersection" of the genes of the samples (see mergeSamples)
+
+    Returns
+    -------
+        geneList, sampleList, expMat (scipy CSR matrix of genes * cells), and the sample ID of each cell
+    """
+    if sampleIDs is None:
+        sampleIDs = [sampleName(dataName) for dataName in dataNames]
+    if len(set(sampleIDs)) != len(sampleIDs):
+        raise ValueError("Sample IDs must be unique: " + str(sampleIDs))
+    if cellIndices is None:
+        cellIndices = [None] * len(dataNames)
+    reader = partial(
+        readSample,
+        sep=sep,
+        cellMajor=cellMajor,
+        chunkSize=chunkSize,
+        geneSubset=geneSubset,
+    )
+    arguments = list(zip(dataNames, sampleIDs, cellIndices))
+    if processes > 1 and len(arguments) > 1:
+        with Pool(min(processes, len(arguments))) as pool:
+            samples = pool.map(reader, arguments)
+    else:
+        samples = [reader(argument) for argument in arguments]
+    labels = []
+    for sampleID, sample in zip(sampleIDs, samples):
+        labels.extend([sampleID] * len(sample[1]))
+    geneList, sampleList, expMat = mergeSamples(samples, geneJoin=geneJoin)
+    return geneList, sampleList, expMat, labels
+
+
+def writeSampleTables(subpopFile, conditionsFile, sampleList, labels, conditionsSep="\t"):
+    """Write the sample of each cell as a subpopulation file and as a conditions table"""
+    with open(subpopFile, "w") as tableFile:
+        for cell, label in zip(sampleList, labels):
+            tableFile.write(cell + "," + label + "\n")
+    sampleIDs = list(dict.fromkeys(labels))
+    conditions = pd.DataFrame(
+        (np.asarray(labels, dtype=object)[:, None] == np.asarray(sampleIDs, dtype=object)[None, :]).astype(int),
+        index=sampleList,
+        columns=sampleIDs,
+    )
+    conditions.to_csv(conditionsFile, sep=conditionsSep)
+
+
+def rowCV(matrix):
+    """Coefficient of variation of each row of a sparse matrix, counting the implicit zeros"""
+    matrix = sparse.csr_matrix(matrix)
+    numColumns = matrix.shape[1]
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    sums = np.bincount(rows, weights=matrix.data, minlength=matrix.shape[0])
+    squareSums = np.bincount(
+        rows, weights=np.square(matrix.data), minlength=matrix.shape[0]
+    )
+    means = sums / numColumns
+    variances = np.maximum(squareSums / numColumns - np.square(means), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(means != 0, np.sqrt(variances) / means, np.nan)
+
+
+def fileDigest(dataName, blockSize=1 << 20):
+    """SHA-256 digest of an input file, directory or list of inputs"""
+    digest = hashlib.sha256()
+    if isinstance(dataName, (list, tuple)):
+        for name in dataName:
+            digest.update(sampleName(name).encode("utf-8"))
+            digest.update(fileDigest(name, blockSize).encode("utf-8"))
+        return digest.hexdigest()
+    if path.isdir(dataName):
+        fileNames = sorted(
+            path.join(dataName, name)
+            for name in os.listdir(dataName)
+            if path.isfile(path.join(dataName, name))
+        )
+    else:
+        fileNames = [dataName]
+    for fileName in fileNames:
+        if len(fileNames) > 1:
+            digest.update(path.basename(fileName).encode("utf-8"))
+        with open(fileName, "rb") as dataFile:
+            block = dataFile.read(blockSize)
+            while len(block) > 0:
+                digest.update(block)
+                block = dataFile.read(blockSize)
+    return digest.hexdigest()
+
+
+def matrixCacheKey(
+    dataName,
+    binarizeThreshold,
+    seed=None,
+    maxSamples=None,
+    geneSubset=None,
+    cellMajor=False,
+    cellIndices=None,
+    binarizeMethod=None,
+):
+    """Cache key of a binarized (and optionally sampled) matrix"""
+    if geneSubset is None:
+        genes = "all"
+    else:
+        genes = hashlib.sha256(
+            "\n".join(sorted(geneSubset)).encode("utf-8")
+        ).hexdigest()
+    if cellIndices is None:
+        cells = "all"
+    else:
+        cells = hashlib.sha256(
+            np.asarray(cellIndices, dtype=np.int64).tobytes()
+        ).hexdigest()
+    binarization = repr(float(binarizeThreshold))
+    if binarizeMethod is not None:
+        name, parameter = parseBinarizeMethod(binarizeMethod, binarizeThreshold)
+        # a global cutoff keys the same entry as before per-gene methods were added
+        if name == "global":
+            binarization = repr(float(parameter))
+        else:
+            binarization = binarizeMethodName(binarizeMethod, binarizeThreshold)
+    key = "|".join(
+        [
+            fileDigest(dataName),
+            binarization,
+            repr(seed),
+            repr(maxSamples),
+            genes,
+            "cells*genes" if cellMajor else "genes*cells",
+            cells,
+        ]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def saveSparseMatrix(directory, matrix):
+    """Save the arrays of a CSR matrix as .npy files"""
+    matrix = sparse.csr_matrix(matrix)
+    if not path.isdir(directory):
+        os.makedirs(directory)
+    np.save(path.join(directory, "indptr.npy"), matrix.indptr)
+    np.save(path.join(directory, "indices.npy"), matrix.indices)
+    np.save(path.join(directory, "data.npy"), matrix.data)
+    np.save(path.join(directory, "shape.npy"), np.array(matrix.shape, dtype=np.int64))
+
+
+def loadSparseMatrix(directory, mmap=True):
+    """Load a CSR matrix saved by saveSparseMatrix, memory-mapped read-only"""
+    mmapMode = "r" if mmap else None
+    shape = tuple(int(i) for i in np.load(path.join(directory, "shape.npy")))
+    return sparse.csr_matrix(
+        (
+            np.load(path.join(directory, "data.npy"), mmap_mode=mmapMode),
+            np.load(path.join(directory, "indices.npy"), mmap_mode=mmapMode),
+            np.load(path.join(directory, "indptr.npy"), mmap_mode=mmapMode),
+        ),
+        shape=shape,
+        copy=False,
+    )
+
+
+def saveBitMatrix(directory, matrix):
+    """Save the packed bits of a bitMatrix as .npy files"""
+    if not path.isdir(directory):
+        os.makedirs(directory)
+    np.save(path.join(directory, "packed.npy"), matrix.packed)
+    np.save(path.join(directory, "shape.npy"), np.array(matrix.shape, dtype=np.int64))
+
+
+def loadBitMatrix(directory, mmap=True):
+    """Load a bitMatrix saved by saveBitMatrix, memory-mapped read-only"""
+    mmapMode = "r" if mmap else None
+    shape = tuple(int(i) for i in np.load(path.join(directory, "shape.npy")))
+    return bitMatrix(np.load(path.join(directory, "packed.npy"), mmap_mode=mmapMode), shape)
+
+
+def saveMatrix(directory, matrix):
+    """Save a bitMatrix, a dense numpy array or a sparse matrix"""
+    if isinstance(matrix, bitMatrix):
+        saveBitMatrix(directory, matrix)
+    elif isinstance(matrix, np.ndarray):
+        if not path.isdir(directory):
+            os.makedirs(directory)
+        np.save(path.join(directory, "dense.npy"), matrix)
+    else:
+        saveSparseMatrix(directory, matrix)
+
+
+def loadMatrix(directory, mmap=True):
+    """Load a matrix saved by saveMatrix"""
+    if path.isfile(path.join(directory, "packed.npy")):
+        return loadBitMatrix(directory, mmap)
+    if path.isfile(path.join(directory, "dense.npy")):
+        return np.load(path.join(directory, "dense.npy"), mmap_mode="r" if mmap else None)
+    return loadSparseMatrix(directory, mmap)
+
+
+def writeList(fileName, values):
+    with open(fileName, "w") as listFile:
+        listFile.write("\n".join(str(value) for value in values))
+
+
+def readList(fileName):
+    with open(fileName) as listFile:
+        return listFile.read().split("\n")
+
+
+def atomicWrite(directory, writer):
+    """Call writer on a temporary directory and rename it to directory"""
+    if path.isdir(directory):
+        return directory
+    parent = path.dirname(path.abspath(directory))
+    if not path.isdir(parent):
+        os.makedirs(parent, exist_ok=True)
+    tempDir = tempfile.mkdtemp(dir=parent)
+    writer(tempDir)
+    try:
+        os.rename(tempDir, directory)
+    except OSError:
+        # another job wrote the same entry first
+        shutil.rmtree(tempDir, ignore_errors=True)
+    return directory
+
+
+def saveMatrixCache(cacheDir, key, geneList, sampleList, matrix):
+    """Write a matrix and its gene and cell names to cacheDir/key"""
+
+    def writer(directory):
+        saveSparseMatrix(directory, matrix)
+        writeList(path.join(directory, "genes.txt"), geneList)
+        writeList(path.join(directory, "samples.txt"), sampleList)
+
+    return atomicWrite(path.join(cacheDir, key), writer)
+
+
+def loadMatrixCache(cacheDir, key):
+    """(geneList, sampleList, memory-mapped matrix) of a cache entry, or None"""
+    entry = path.join(cacheDir, key)
+    if not path.isfile(path.join(entry, "shape.npy")):
+        return None
+    return (
+        readList(path.join(entry, "genes.txt")),
+        readList(path.join(entry, "samples.txt")),
+        loadSparseMatrix(entry),
+    )
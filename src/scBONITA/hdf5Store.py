@@ -0,0 +1,312 @@
+import numpy as np
+import scipy.sparse as sparse
+import os
+from collections import OrderedDict
+from bitMatrix import *
+
+# signature at the start of every HDF5 (and so every h5ad) file
+HDF5_MAGIC = b"\x89HDF\r\n\x1a\n"
+
+
+def requireH5py():
+    """Import h5py, which is only needed for HDF5 and h5ad files"""
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError(
+            "Reading or writing HDF5/h5ad files requires the h5py package (pip install h5py)"
+        )
+    return h5py
+
+
+def isHDF5(dataName):
+    """True if dataName is an HDF5 file, such as an AnnData .h5ad file"""
+    if not os.path.isfile(dataName):
+        return False
+    with open(dataName, "rb") as dataFile:
+        return dataFile.read(len(HDF5_MAGIC)) == HDF5_MAGIC
+
+
+def decodeNames(values):
+    """Convert an array of HDF5 strings (bytes or str) to a list of str"""
+    return [
+        value.decode("utf-8") if isinstance(value, bytes) else str(value)
+        for value in values
+    ]
+
+
+def h5adIndex(group):
+    """Names in the index of an AnnData obs or var group"""
+    return decodeNames(group[group.attrs.get("_index", "_index")][:])
+
+
+def readH5adNames(dataName):
+    """Read the gene names (var) and cell IDs (obs) of an h5ad file without reading the expression values"""
+    h5py = requireH5py()
+    with h5py.File(dataName, "r") as h5File:
+        return h5adIndex(h5File["var"]), h5adIndex(h5File["obs"])
+
+
+def sparseEncoding(node):
+    """"csr_matrix" or "csc_matrix" for an AnnData sparse group, or None for a dense dataset"""
+    encoding = node.attrs.get("encoding-type", node.attrs.get("h5sparse_format", None))
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode("utf-8")
+    if encoding is None:
+        return None
+    if encoding.startswith("csr"):
+        return "csr_matrix"
+    return "csc_matrix"
+
+
+def readCompressedSlices(group, pointers, positions):
+    """Read the given rows of a CSR group (or columns of a CSC group) as (lengths, indices, data), one contiguous HDF5 read per run of consecutive positions"""
+    lengths = pointers[positions + 1] - pointers[positions]
+    indices = []
+    data = []
+    runStart = 0
+    for i in range(1, len(positions) + 1):
+        if i == len(positions) or positions[i] != positions[i - 1] + 1:
+            start = pointers[positions[runStart]]
+            end = pointers[positions[i - 1] + 1]
+            indices.append(group["indices"][start:end])
+            data.append(group["data"][start:end])
+            runStart = i
+    if len(positions) == 0:
+        return lengths, np.zeros(0, dtype=np.int64), np.zeros(0)
+    return lengths, np.concatenate(indices), np.concatenate(data)
+
+
+def readH5ad(dataName, cellIndices=None, geneSubset=None):
+    """Read the expression matrix (X) of an AnnData .h5ad file into a genes * cells CSR matrix
+
+    Parameters
+    ----------
+
+    dataName: str
+        Path to the h5ad file
+    cellIndices: array of int
+        Zero-based positions (in obs) of the cells to keep. All cells are kept if None.
+    geneSubset: set of str
+        Names of the genes (var index) to keep. All genes are kept if None.
+
+    Returns
+    -------
+        geneList, sampleList, expMat (scipy CSR matrix of genes * cells)
+    """
+    h5py = requireH5py()
+    with h5py.File(dataName, "r") as h5File:
+        geneList = h5adIndex(h5File["var"])
+        sampleList = h5adIndex(h5File["obs"])
+        geneIndices = np.arange(len(geneList))
+        if geneSubset is not None:
+            geneIndices = np.array(
+                [i for i in range(0, len(geneList)) if geneList[i] in geneSubset],
+                dtype=np.int64,
+            )
+        cells = np.arange(len(sampleList))
+        if cellIndices is not None:
+            cells = np.asarray(cellIndices, dtype=np.int64)
+        # h5py needs increasing indices; the rows read are put back in the order of cells
+        readCells, cellOrder = np.unique(cells, return_inverse=True)
+        cellOrder = np.ravel(cellOrder)
+        X = h5File["X"]
+        encoding = sparseEncoding(X)
+        if encoding is None:
+            # h5py reads one axis at a time
+            block = X[readCells, :][cellOrder] if cellIndices is not None else X[:, :]
+            expMat = sparse.csr_matrix(block[:, geneIndices].T, dtype=np.float64)
+        elif encoding == "csc_matrix":
+            pointers = X["indptr"][:]
+            lengths, indices, data = readCompressedSlices(X, pointers, geneIndices)
+            expMat = sparse.csr_matrix(
+                (data, indices, np.concatenate([[0], np.cumsum(lengths)])),
+                shape=(len(geneIndices), len(sampleList)),
+                dtype=np.float64,
+            )
+            if cellIndices is not None:
+                expMat = expMat[:, cells]
+        else:
+            pointers = X["indptr"][:]
+            lengths, indices, data = readCompressedSlices(X, pointers, readCells)
+            expMat = sparse.csr_matrix(
+                (data, indices, np.concatenate([[0], np.cumsum(lengths)])),
+                shape=(len(readCells), len(geneList)),
+                dtype=np.float64,
+            )
+            expMat = expMat[cellOrder, :][:, geneIndices].T.tocsr()
+    geneList = [geneList[i] for i in geneIndices]
+    sampleList = [sampleList[i] for i in cells]
+    return geneList, sampleList, expMat
+
+
+class hdf5Chunks:
+
+    """Least-recently-used cache of blocks of chunkRows rows read from an HDF5 file"""
+
+    def __init__(self, fileName, name, chunkRows=64, cacheChunks=256):
+        self.fileName = os.path.abspath(fileName)
+        self.name = name
+        self.chunkRows = chunkRows
+        self.cacheChunks = cacheChunks
+        self.h5File = None
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["h5File"] = None
+        state["cache"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def node(self):
+        """The HDF5 dataset or group holding the matrix"""
+        if self.h5File is None:
+            self.h5File = requireH5py().File(self.fileName, "r")
+        return self.h5File[self.name]
+
+    def chunk(self, number):
+        """Rows number * chunkRows to (number + 1) * chunkRows, from the cache if possible"""
+        if number in self.cache:
+            self.cache.move_to_end(number)
+            return self.cache[number]
+        block = self.readChunk(number)
+        self.cache[number] = block
+        if len(self.cache) > self.cacheChunks:
+            self.cache.popitem(last=False)
+        return block
+
+    def rowPositions(self, rows, numRows):
+        """Row selection (int, slice or array of int) as an array of positions, and whether a single row was asked for"""
+        if isinstance(rows, slice):
+            return np.arange(numRows)[rows], False
+        if np.ndim(rows) == 0:
+            return np.array([int(rows)]), True
+        return np.asarray(rows, dtype=np.int64), False
+
+
+class hdf5Rows(hdf5Chunks):
+
+    """Read-only 2-D HDF5 dataset that reads rows on demand"""
+
+    def __init__(self, fileName, name, chunkRows=64, cacheChunks=256):
+        hdf5Chunks.__init__(self, fileName, name, chunkRows, cacheChunks)
+        dataset = self.node()
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def readChunk(self, number):
+        return self.node()[number * self.chunkRows : (number + 1) * self.chunkRows, :]
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        positions, single = self.rowPositions(rows, self.shape[0])
+        out = np.empty((len(positions), self.shape[1]), dtype=self.dtype)
+        numbers = positions // self.chunkRows
+        for number in np.unique(numbers):
+            selected = numbers == number
+            out[selected, :] = self.chunk(number)[positions[selected] % self.chunkRows, :]
+        out = out[:, columns]
+        return out[0] if single else out
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+
+class hdf5SparseRows(hdf5Chunks):
+
+    """Read-only CSR matrix in an HDF5 group that reads rows on demand"""
+
+    def __init__(self, fileName, name, chunkRows=64, cacheChunks=256):
+        hdf5Chunks.__init__(self, fileName, name, chunkRows, cacheChunks)
+        group = self.node()
+        self.shape = tuple(int(size) for size in group.attrs["shape"])
+        self.indptr = group["indptr"][:]
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    def readChunk(self, number):
+        start = number * self.chunkRows
+        end = min(start + self.chunkRows, self.shape[0])
+        group = self.node()
+        return sparse.csr_matrix(
+            (
+                group["data"][self.indptr[start] : self.indptr[end]],
+                group["indices"][self.indptr[start] : self.indptr[end]],
+                self.indptr[start : end + 1] - self.indptr[start],
+            ),
+            shape=(end - start, self.shape[1]),
+        )
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        positions, single = self.rowPositions(rows, self.shape[0])
+        numbers = positions // self.chunkRows
+        blocks = [
+            self.chunk(number)[positions[i] % self.chunkRows, :]
+            for i, number in enumerate(numbers)
+        ]
+        if len(blocks) == 0:
+            out = sparse.csr_matrix((0, self.shape[1]))
+        else:
+            out = sparse.vstack(blocks, format="csr")
+        return out[:, columns]
+
+    def tocsr(self):
+        return self[:, :]
+
+    def toarray(self):
+        return self.tocsr().toarray()
+
+    @property
+    def A(self):
+        return self.toarray()
+
+
+def saveHDF5(fileName, matrices, chunkRows=64):
+    """Write bitMatrix and sparse matrices to an HDF5 file, one group per name in the dict matrices"""
+    h5py = requireH5py()
+    tempName = fileName + ".tmp" + str(os.getpid())
+    with h5py.File(tempName, "w") as h5File:
+        for name, matrix in matrices.items():
+            group = h5File.create_group(name)
+            if isinstance(matrix, bitMatrix):
+                packed = np.asarray(matrix.packed)
+                group.create_dataset(
+                    "packed",
+                    data=packed,
+                    chunks=(max(1, min(chunkRows, packed.shape[0])), max(1, packed.shape[1])),
+                )
+                group.attrs["encoding-type"] = "bitMatrix"
+            else:
+                matrix = sparse.csr_matrix(matrix)
+                group.create_dataset("data", data=matrix.data)
+                group.create_dataset("indices", data=matrix.indices)
+                group.create_dataset("indptr", data=matrix.indptr)
+                group.attrs["encoding-type"] = "csr_matrix"
+                group.attrs["encoding-version"] = "0.1.0"
+            group.attrs["shape"] = np.asarray(matrix.shape, dtype=np.int64)
+    os.replace(tempName, fileName)
+
+
+def loadHDF5(fileName, name, chunkRows=64, cacheChunks=256):
+    """Open a matrix written by saveHDF5 without reading it"""
+    h5py = requireH5py()
+    with h5py.File(fileName, "r") as h5File:
+        encoding = h5File[name].attrs["encoding-type"]
+        shape = tuple(int(size) for size in h5File[name].attrs["shape"])
+    if isinstance(encoding, bytes):
+        encoding = encoding.decode("utf-8")
+    if encoding == "bitMatrix":
+        return bitMatrix(
+            hdf5Rows(fileName, name + "/packed", chunkRows, cacheChunks), shape
+        )
+    return hdf5SparseRows(fileName, name, chunkRows, cacheChunks)
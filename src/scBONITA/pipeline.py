@@ -4,6 +4,7 @@ from singleCell import *
 
 # from pathwayAnalysis import *
 import glob
+import os
 import pickle
 import argparse
 import subprocess
@@ -79,7 +80,7 @@ def pipeline(
     dataName="",
     sep=",",
     maxNodes=20000,
-    #maxSamples=50000,
+    maxSamples=15000,
     getKEGGPathways=True,
     listOfKEGGPathways=[],
     pathwayList=[],
@@ -95,7 +96,21 @@ def pipeline(
     condaEnv="scBonita",
     pythonVersion="python3",
     sampleCells=True,
-    parallelSearch = True
+    parallelSearch = True,
+    processes=1,
+    cacheDir=None,
+    seed=None,
+    pathwayFirst=False,
+    cellMajor=False,
+    subpopFile=None,
+    conditionsFile=None,
+    conditionsSep="\t",
+    minPerStratum=1,
+    backend="memory",
+    samples=None,
+    binarizeMethod="global",
+    maxIncomingEdges=3,
+    maxTermInputs=3
 ):
     if sampleCells == "True" or sampleCells == True:
         sampleCells = True
@@ -115,27 +130,62 @@ def pipeline(
         getKEGGPathways = False
     else:
         getKEGGPathways = False
+    if pathwayFirst == "True" or pathwayFirst == True:
+        pathwayFirst = True
+    else:
+        pathwayFirst = False
+    if cellMajor == "True" or cellMajor == True:
+        cellMajor = True
+    else:
+        cellMajor = False
     print(["getKEGGPathways", str(getKEGGPathways)])
     if listOfKEGGPathways is None:
         listOfKEGGPathways = []
+    if pathwayList is None:
+        pathwayList = []
+    if isinstance(pathwayList, str):
+        pathwayList = [pathwayList]
+    pathwayGraphs = None
+    geneSubset = None
+    # with several samples, dataName is only the prefix of the output files
+    dataSource = dataName if samples is None else list(samples)
+    if pathwayFirst:
+        # resolve the pathway genes against the gene column first, so that only the rows of those genes are parsed
+        geneList = readGeneNames(dataSource, sep, cellMajor=cellMajor)
+        if getKEGGPathways:
+            pathwayGraphs = find_pathways_kegg(
+                geneList=geneList,
+                preDefList=listOfKEGGPathways,
+                writeGraphml=writeGraphml,
+                organism=organism,
+            )
+            graphs = list(pathwayGraphs.values())
+        else:
+            graphs = [nx.read_graphml(x) for x in pathwayList]
+        geneSubset = set()
+        for graph in graphs:
+            geneSubset.update(graph.nodes())
+        geneSubset = geneSubset.intersection(geneList)
+        print("Pathway genes found in dataset: " + str(len(geneSubset)) + " of " + str(len(geneList)))
     scTest = singleCell(
-        dataName=dataName, sep=sep, maxNodes=maxNodes, binarizeThreshold=binarizeThreshold, sampleCells=sampleCells 
+        dataName=dataSource, sep=sep, maxNodes=maxNodes, binarizeThreshold=binarizeThreshold, sampleCells=sampleCells, processes=processes, cacheDir=cacheDir, seed=seed, geneSubset=geneSubset, cellMajor=cellMajor, maxSamples=maxSamples, subpopFile=subpopFile, subpopSep=sep, conditionsFile=conditionsFile, conditionsSep=conditionsSep, minPerStratum=minPerStratum, binarizeMethod=binarizeMethod
     )
+    if samples is not None:
+        scTest._singleCell__writeSampleTables(dataName + "_subpops.csv", dataName + "_conditions.txt")
+        print("Sample of each cell written to " + dataName + "_subpops.csv and " + dataName + "_conditions.txt")
     scTest._singleCell__filterData(threshold=cvThreshold)
     if getKEGGPathways:
-        pathwayGraphs = find_pathways_kegg(
-            geneList=scTest.geneList,
-            preDefList=listOfKEGGPathways,
-            writeGraphml=writeGraphml,
-            organism=organism,
-        )
+        if pathwayGraphs is None:
+            pathwayGraphs = find_pathways_kegg(
+                geneList=scTest.geneList,
+                preDefList=listOfKEGGPathways,
+                writeGraphml=writeGraphml,
+                organism=organism,
+            )
         scTest._singleCell__add_pathways(pathwayGraphs, minOverlap=1)
     else:
-        if isinstance(pathwayList, str):
-            scTest._singleCell__add_pathways([pathwayList], minOverlap=1)
-        else:
-            if isinstance(pathwayList, list):
-                scTest._singleCell__add_pathways(pathwayList, minOverlap=1)
+        if isinstance(pathwayList, list):
+            scTest._singleCell__add_pathways(pathwayList, minOverlap=1)
     # cut down data size
     nodeIndices = []
     for graph in scTest.pathwayGraphs.keys():
@@ -143,21 +193,35 @@ def pipeline(
         # collect list of genes from pathways found above
         # find indices of these genes in scObject.geneList
         for node in graph.nodes():
-            nodeIndices.append(scTest.geneList.index(node))
+            nodeIndices.append(scTest.geneIndex[node])
 
     nodeIndices = set(nodeIndices)
     nodeIndices = list(nodeIndices)
     # retain only rows of those genes from binMat
     scTest.expMat = scTest.expMat[nodeIndices, :]
-    scTest.binMat = preprocessing.binarize(
-        scTest.expMat, threshold=binarizeThreshold, copy=True
-    )  # if data >=0: binMat = 1
+    # expMat was binarized by singleCell (per gene, if binarizeMethod is not global), so any non-zero entry is 1
+    binMat = preprocessing.binarize(
+        scTest.expMat, threshold=0, copy=True
+    )
     scTest.maxNodes = maxNodes
-    scTest.maxSamples = 15000 #maxSamples
-    scTest.binMat.resize((scTest.maxNodes, scTest.maxSamples))
+    scTest.maxIncomingEdges = maxIncomingEdges
+    scTest.maxTermInputs = maxTermInputs
+    # binMat holds only the pathway genes and the sampled cells, with one bit per gene per cell; the simulator is given its dimensions, so no padding is needed
+    scTest.binMat = bitMatrix.fromSparse(binMat)
     scTest.geneList = [scTest.geneList[node] for node in nodeIndices]
+    scTest._singleCell__indexLists()
+    # the other binarizations are only kept for sensitivity analyses on the object itself (and in cacheDir, if given)
+    scTest.binarizations = {}
     scTest.nodeList = scTest.geneList
-    scTest.nodePositions = [scTest.geneList.index(node) for node in scTest.nodeList]
+    scTest.nodePositions = [scTest.geneIndex[node] for node in scTest.nodeList]
+    if backend == "hdf5":
+        # rule inference jobs read only the rows of the genes in their network from the HDF5 file
+        scTest._singleCell__storeHDF5(["expMat", "binMat"], dataName + "scTest.h5")
+    else:
+        # keep the matrices in the on-disk cache so that rule inference jobs memory-map them instead of unpickling them
+        scTest._singleCell__cacheMatrices(["expMat", "binMat"])
+    # node-predecessor correlations for every network are read from one gene * gene matrix
+    scTest._singleCell__cacheCorrelations(dataName + "scTest_correlations")
     pickle.dump(scTest, open(dataName + "scTest.pickle", "wb"))
     runAllNetworks(
         dataFile=dataName,
@@ -180,7 +244,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--dataFile",
-        help="Specify the name of the file containing processed scRNA-seq data",
+        help="Specify the name of the file containing processed scRNA-seq data, a 10x Genomics output directory (matrix.mtx, barcodes.tsv and genes.tsv) or an AnnData .h5ad file",
         default="",
         type=str,
     )
@@ -197,9 +261,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--maxNodes", help="Number of genes in the dataset", default=20000, type=int
     )
-    #parser.add_argument(
-    #    "--maxSamples", help="Number of cells in the dataset", default=15000, type=int
-    #)
+    parser.add_argument(
+        "--maxSamples",
+        help="Maximum number of cells used for rule inference. Simulation time grows linearly with the number of distinct cell states among them.",
+        default=15000,
+        type=int,
+    )
     parser.add_argument(
         "--separator",
         help="Delimiting character in dataFile. Must be one of , (comma), \s (space) or \t (tab) ",
@@ -239,9 +306,10 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--cvThreshold",
-        help="Minimum coefficient of variation to retain genes for scBONITA analysis",
+        help="Minimum coefficient of variation to retain genes for scBONITA analysis. If several values are given, the number of genes passing each is reported and the first is used.",
         default=None,
         type=float,
+        nargs="+",
         required=False,
     )
     parser.add_argument(
@@ -259,6 +327,14 @@ if __name__ == "__main__":
         type=float,
         required=False,
     )
+    parser.add_argument(
+        "--binarizeMethod",
+        help="How each gene is binarized: 'global' uses --binarizeThreshold for every gene; 'quantile:q' (for example quantile:0.75), 'kmeans' and 'mixture' compute a threshold per gene from its own expression. If several methods are given, the data file is parsed once and all binarizations are computed; the first is used, and with --cacheDir each is cached so that later runs with any of them skip parsing.",
+        default=["global"],
+        nargs="+",
+        type=str,
+        required=False,
+    )
     parser.add_argument(
         "--partition",
         help="SLURM parameter for generated sbatch scripts, if generateSbatch is True. For more information on SLURM parameters, visit https://slurm.schedmd.com/sbatch.html",
@@ -305,7 +381,7 @@ if __name__ == "__main__":
         "--sampleCells",
         type=str,
         #choices=[False, True],
-        help="If True, scBonita will use a representative set of samples to infer rules. This is automatically done if the number of cells in the training dataset exceeds 15000, in order to reduce memory usage.",
+        help="If True, scBonita will use a representative set of samples to infer rules. This is automatically done if the number of cells in the training dataset exceeds --maxSamples, in order to reduce memory usage.",
         default="False",
         required=False,
     )
@@ -317,11 +393,111 @@ if __name__ == "__main__":
         default="False",
         required=False,
     )
+    parser.add_argument(
+        "--processes",
+        help="Number of worker processes used to parse the training dataset. Values above 1 are only useful for multi-GB input files.",
+        default=1,
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--cacheDir",
+        help="Directory in which to cache the binarized training dataset. Later runs with the same data file, binarization threshold and seed memory-map the cached matrix instead of re-reading the data file.",
+        default=None,
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for sampling cells. Sampled data is only cached if a seed is given.",
+        default=None,
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--cellMajor",
+        type=str,
+        help="If True, dataFile has cells as rows and genes as columns. Up to --maxSamples cells are then chosen by reservoir sampling in a single pass over the file, and the rows of the other cells are skipped without being parsed. Recommended for atlases with 100k+ cells.",
+        default="False",
+        required=False,
+    )
+    parser.add_argument(
+        "--subpopFile",
+        help="File with one cell ID and its subpopulation per line, delimited as dataFile. If given, cells are sampled per subpopulation, in proportion to its size, so that rare subpopulations are kept.",
+        default=None,
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--conditionsFile",
+        help="Conditions table (cells * conditions, entries 1 or 0) as used for pathway analysis. If given (and subpopFile is not), cells are sampled per combination of conditions.",
+        default=None,
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--conditions_separator",
+        help="Delimiting character in conditionsFile",
+        default="\t",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--minPerStratum",
+        help="Minimum number of cells sampled from each subpopulation or combination of conditions",
+        default=1,
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--pathwayFirst",
+        type=str,
+        help="If True, scBonita first matches the KEGG or GRAPHML networks against the gene names in dataFile and then only parses the rows of genes that are in those networks. This cuts loading time and memory when the networks cover a small fraction of the genes.",
+        default="False",
+        required=False,
+    )
+    parser.add_argument(
+        "--backend",
+        help="Where the training data used by rule inference jobs is kept. With hdf5, the matrices are written to dataFile + 'scTest.h5' and each job reads only the rows of the genes in its network, instead of unpickling or memory-mapping the whole dataset. Requires h5py.",
+        default="memory",
+        choices=["memory", "hdf5"],
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--samples",
+        help="Files or 10x Genomics output directories, one per sample (for example one per participant), to be merged into the training dataset. They are read in parallel (see --processes), cell IDs are prefixed with the base name of each path, and the sample of each cell is written to <dataFile>_subpops.csv and <dataFile>_conditions.txt. --dataFile is then only the prefix of the output files.",
+        default=None,
+        nargs="+",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--maxIncomingEdges",
+        help="Number of regulators kept for each node, chosen by their correlation with it. The rule of a node is an OR of AND terms over its regulators.",
+        default=3,
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--maxTermInputs",
+        help="Maximum number of regulators in one AND term. With --maxIncomingEdges 3 every combination of regulators is a term; for larger values this keeps the number of terms of hub nodes manageable. Nodes with more than 7 terms are refined by a greedy local search instead of trying every rule.",
+        default=3,
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--threads",
+        help="Number of threads the simulator uses to evaluate each rule set during rule inference (--fullPipeline 0). Defaults to the CPUs allocated to the SLURM job (the -c of the generated sbatch scripts), or 1 outside SLURM.",
+        default=None,
+        type=int,
+        required=False,
+    )
     results = parser.parse_args()
     fullPipeline = results.fullPipeline
     net = results.network
     maxNodes = results.maxNodes
-    #maxSamples = results.maxSamples
+    maxSamples = results.maxSamples
     dataFile = results.dataFile
     sep = results.separator
     getKEGGPathways = results.getKEGGPathways
@@ -340,15 +516,34 @@ if __name__ == "__main__":
     binarizeThreshold = results.binarizeThreshold
     binarizeThreshold = float(binarizeThreshold)
     parallelSearch = results.parallelSearch
+    processes = results.processes
+    cacheDir = results.cacheDir
+    seed = results.seed
+    pathwayFirst = results.pathwayFirst
+    cellMajor = results.cellMajor
+    subpopFile = results.subpopFile
+    conditionsFile = results.conditionsFile
+    conditionsSep = results.conditions_separator
+    minPerStratum = results.minPerStratum
+    backend = results.backend
+    samples = results.samples
+    binarizeMethod = results.binarizeMethod
+    maxIncomingEdges = results.maxIncomingEdges
+    maxTermInputs = results.maxTermInputs
+    threads = results.threads
+    if threads is None:
+        threads = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
     if fullPipeline == 1:
-        if dataFile == "":
+        if dataFile == "" and samples is not None:
+            dataFile = "merged"
+        elif dataFile == "":
             dataFile = glob.glob("*.bin")[0]
         else:
             dataFile = str(dataFile)
         pipeline(
             dataName=dataFile,
             maxNodes=maxNodes,
-            #maxSamples=maxSamples,
+            maxSamples=maxSamples,
             sep=sep,
             getKEGGPathways=getKEGGPathways,
             listOfKEGGPathways=listOfKEGGPathways,
@@ -364,7 +559,21 @@ if __name__ == "__main__":
             generateSbatch=generateSbatch,
             binarizeThreshold=binarizeThreshold,
             sampleCells=sampleCells,
-            parallelSearch = parallelSearch
+            parallelSearch = parallelSearch,
+            processes=processes,
+            cacheDir=cacheDir,
+            seed=seed,
+            pathwayFirst=pathwayFirst,
+            cellMajor=cellMajor,
+            subpopFile=subpopFile,
+            conditionsFile=conditionsFile,
+            conditionsSep=conditionsSep,
+            minPerStratum=minPerStratum,
+            backend=backend,
+            samples=samples,
+            binarizeMethod=binarizeMethod,
+            maxIncomingEdges=maxIncomingEdges,
+            maxTermInputs=maxTermInputs
         )
 
     else:
@@ -375,6 +584,7 @@ if __name__ == "__main__":
                 dataFile = str(dataFile)
             print(dataFile)
             scTest = pickle.load(open(dataFile + "scTest.pickle", "rb"))
+            scTest.threads = threads
             scTest._singleCell__scoreNodes(graph=str(net), parallelSearch = parallelSearch)
 
 """
@@ -15,6 +15,32 @@ from itertools import chain
 from operator import attrgetter
 import gc
 import pandas as pd
+from bitMatrix import *
+from compiledModel import *
+import hashlib
+import os
+
+# attributes that make up the rule structure of a network, saved once per network and dataset by ruleMaker.__saveStructure
+STRUCTURE_ATTRIBUTES = [
+    "nodeList",
+    "nodePositions",
+    "permList",
+    "rvalues",
+    "individualParse",
+    "andNodeList",
+    "andNodeInvertList",
+    "andLenList",
+    "possibilityList",
+    "possibilityInverter",
+    "size",
+    "nodeNum",
+    "ruleGraph",
+    "nodeDict",
+    "successorNums",
+    "inputLimit",
+    "maxTermInputs",
+    "compiledModel",
+]
 
 
 class ruleMaker:
@@ -71,12 +97,18 @@ class ruleMaker:
         maxIncomingEdges=3,
         groundTruth=False,
         graphName="",
+        maxTermInputs=3,
+        modelFile=None,
+        requireStructure=False,
     ):
-        """Initialize a ruleMaker object for rule inference with scBONITA - RD"""
+        """Initialize a ruleMaker object for rule inference with scBONITA - RD. If modelFile is given, the rule structure is saved there or loaded from it; with requireStructure, a saved structure built for another network, dataset or settings is an error"""
         if maxIncomingEdges < 3:
             print(
                 "The maximum number of incoming edges has been set to less than 3. Meaningless results await you."
             )
+        # number of predecessors kept per node, None for all
+        self.inputLimit = maxIncomingEdges if restrictIncomingEdges else None
+        self.maxTermInputs = maxTermInputs
 
         nodeList = list(
             graph.nodes
@@ -93,8 +125,15 @@ class ruleMaker:
                         graph.remove_edge(node, node)
                         repeat = True
 
+        # objects pickled before binMat was bit-packed still hold a sparse matrix
+        self.binMat = bitMatrix.fromMatrix(self.binMat)
+        if modelFile is not None:
+            structureKey = self.__structureKey(graph, nodeList)
+            if self.__loadStructure(modelFile, structureKey, requireStructure):
+                self.__finishInit(graph)
+                return
         self.nodePositions = [
-            self.geneList.index(node) for node in nodeList if node in self.geneList
+            self.geneIndex[node] for node in nodeList if node in self.geneIndex
         ]  # node positions in geneList
         self.nodeList = nodeList
         print("Nodelist: " + str(self.nodeList))
@@ -125,6 +164,21 @@ class ruleMaker:
                 nodeList[i]
             ] = i  # constructs the node dict so we can easily look up nodes
 
+        # correlations between each node and its predecessors, computed for all edges at once from the packed binary rows
+        edgeNodes = []
+        edgePredecessors = []
+        for i in range(0, len(nodeList)):
+            for k in graph.predecessors(nodeList[i]):
+                edgeNodes.append(self.nodePositions[i])
+                edgePredecessors.append(self.geneIndex[k])
+        correlations = getattr(self, "correlations", None)
+        if correlations is not None and correlations.shape == (self.binMat.shape[0],) * 2:
+            # read from the gene * gene correlations computed once for the dataset and shared by all networks
+            edgeCorrelations = np.asarray(correlations[edgeNodes, edgePredecessors])
+        else:
+            edgeCorrelations = self.binMat.pairCorrelations(edgeNodes, edgePredecessors)
+        edgeCorrelations = iter(np.abs(edgeCorrelations).tolist())
+
         counter = int(0)  # keeps track of where we are in the generic individual
         for i in range(0, len(nodeList)):
             predecessors_temp = list(
@@ -137,21 +191,11 @@ class ruleMaker:
             possibilitytemp = [nodeDict[predder] for predder in predecessors_temp]
             possibilityLister.append(list(possibilitytemp))
             # Find correlation between the predecessors and the node
-            nodeData = (
-                self.binMat[self.nodePositions[i], :].todense().tolist()[0]
-            )  # find binarized expression data for node "i"
             predCorr_temp = (
                 []
             )  # temporarily store correlations between node "i" and all its predecessors
             for k in predecessors_temp:
-                predIndex = self.geneList.index(
-                    k
-                )  # find index of predecessor in the geneList from the data
-                predData = (
-                    self.binMat[predIndex, :].todense().tolist()[0]
-                )  # find binarized expression data for predecessor "k"
-                mi, pvalue = spearmanr(nodeData, predData)
-                mi = abs(mi)
+                mi = next(edgeCorrelations)
                 if np.isnan(mi):
                     predCorr_temp.append(0)
                 else:
@@ -161,10 +205,10 @@ class ruleMaker:
                 reverse=True,
                 key=lambda corrs: corrs[1],
             )[
-                :3
+                : self.inputLimit
             ]  # find the top predecessors of the node "i"
             self.rvalues.append(
-                sorted(predCorr_temp, reverse=True)[:3]
+                sorted(predCorr_temp, reverse=True)[: self.inputLimit]
             )  # stores the correlations
             self.permList.append([pred[0] for pred in predecessors_final])
             for parent in predecessors_final:
@@ -184,20 +228,9 @@ class ruleMaker:
                     )
             # the following section constructs a list of possible node orders
             # this is accomplished by finding all possible subsets of the list of predecessor nodes
-
-            withNones = zip(
-                [nodeList.index(corr_tuple[0]) for corr_tuple in predecessors_final],
-                itertool.repeat("empty"),
+            possibilities = self.__andTerms(
+                [nodeDict[corr_tuple[0]] for corr_tuple in predecessors_final]
             )
-            possibilities = list(itertool.product(*withNones))
-            for j in range(0, len(possibilities)):
-                possibilities[j] = list(possibilities[j])
-                while "empty" in possibilities[j]:
-                    possibilities[j].remove("empty")
-                while [] in possibilities[j]:
-                    possibilities[j].remove([])
-            while [] in possibilities:
-                possibilities.remove([])
 
             # create a list of the activities of each node and store alongside the contributors to each and node for easy reference later
             activities = []  # list to store activities of nodes (a vs i)
@@ -295,29 +328,102 @@ class ruleMaker:
         self.possibilityList = possibilityLister
         self.possibilityInverter = possibilityInverter
         self.nodeNum = len(nodeList)
-        self.params = self.Params()
-        self.params._Params__simParams()
-        self.__makeToolBox(graph)
         self.ruleGraph = ruleGraph
         self.nodeDict = nodeDict  # identifies names of nodes with their index in the node list.. provide name, get index
         self.successorNums = succnum
+        self.__updateCpointers()
+        if modelFile is not None:
+            self.__saveStructure(modelFile, structureKey)
         # nx.write_graphml(ruleGraph, graphName+"_ruleGraph.graphml")
+        self.__finishInit(graph)
+
+    def __finishInit(self, graph):
+        """Set up the parts of a ruleMaker that do not depend on how its rule structure was obtained"""
+        self.params = self.Params()
+        self.params._Params__simParams()
+        self.__makeToolBox(graph)
+        self.__dedupCellStates()
         print("\nIndividual parse: " + str(self.individualParse))
         print("\nNodelist: " + str(self.nodeList))
         print("\nNode positions: " + str(self.nodePositions))
         print("\nPossibilityList: " + str(self.possibilityList))
 
+    def __structureKey(self, graph, nodeList):
+        """Digest of the network, structure settings and network gene data the rule structure depends on"""
+        digest = hashlib.sha256()
+        digest.update(repr(nodeList).encode("utf-8"))
+        for edge in sorted(graph.edges(data=True), key=lambda edge: edge[0:2]):
+            digest.update(repr((edge[0], edge[1], sorted(edge[2].items()))).encode("utf-8"))
+        digest.update(repr((self.inputLimit, self.maxTermInputs)).encode("utf-8"))
+        positions = [self.geneIndex[node] for node in nodeList if node in self.geneIndex]
+        digest.update(repr((positions, self.binMat.shape[1])).encode("utf-8"))
+        digest.update(np.asarray(self.binMat.selectRows(positions).packed).tobytes())
+        return digest.hexdigest()
+
+    def __loadStructure(self, modelFile, structureKey, requireStructure=False):
+        """Set the rule structure saved in modelFile if it was built for structureKey; returns whether it was"""
+        if not os.path.isfile(modelFile):
+            return False
+        with open(modelFile, "rb") as structureFile:
+            saved = pickle.load(structureFile)
+        if saved.get("key") != structureKey:
+            if requireStructure:
+                raise ValueError(
+                    "Rule structure in "
+                    + modelFile
+                    + " was built for another network, dataset or settings than the rules being read"
+                )
+            print("Rule structure in " + modelFile + " was built for another network, dataset or settings; rebuilding it")
+            return False
+        for attribute in STRUCTURE_ATTRIBUTES:
+            setattr(self, attribute, saved[attribute])
+        print("Loaded rule structure from " + modelFile)
+        return True
+
+    def __saveStructure(self, modelFile, structureKey):
+        """Write the rule structure to modelFile, under a temporary name first so that concurrent jobs never read a partial file"""
+        saved = {attribute: getattr(self, attribute) for attribute in STRUCTURE_ATTRIBUTES}
+        saved["key"] = structureKey
+        tempName = modelFile + ".tmp" + str(os.getpid())
+        with open(tempName, "wb") as structureFile:
+            pickle.dump(saved, structureFile)
+        os.replace(tempName, modelFile)
+
+    def __dedupCellStates(self):
+        """Collapse cells with identical binarized states over the nodes of the network, weighted by their counts"""
+        states = self.binMat.getRows(self.nodePositions, len(self.sampleList)).T  # cells * nodes
+        # cells are compared by their packed bit strings
+        packed = np.packbits(states, axis=1)
+        unique, first, inverse, counts = np.unique(
+            packed, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+        self.cellStates = np.array(states[first, :], dtype=np.intc)  # unique states * nodes
+        self.cellWeights = np.array(counts, dtype=np.intc, order="C")
+        self.cellStateIndex = np.ravel(inverse)  # cell -> row of cellStates
+        # nodes * states, packed once for every simulation; rows of nodes without data stay 0
+        stateMatrix = np.zeros((len(self.nodeList), self.cellStates.shape[0]), dtype=np.intc)
+        stateMatrix[0 : self.cellStates.shape[1], :] = self.cellStates.T
+        self.cellStateBits = bitMatrix.fromDense(stateMatrix)
+        print(
+            "Unique cell states: "
+            + str(len(self.cellWeights))
+            + " of "
+            + str(len(self.sampleList))
+            + " cells"
+        )
+
+    def __andTerms(self, inputs):
+        """Possible shadow and nodes (AND terms) over the given inputs, with at most maxTermInputs inputs each"""
+        limit = getattr(self, "maxTermInputs", None)
+        terms = [[]]
+        for node in reversed(inputs):
+            terms = [
+                [node] + term for term in terms if limit is None or len(term) < limit
+            ] + terms
+        return terms[:-1]  # without the empty term
+
     def __update_upstream(self, node, newUpstreams):
-        withNones = zip(newUpstreams, itertool.repeat("empty"))
-        possibilities = list(itertool.product(*withNones))
-        for j in range(0, len(possibilities)):
-            possibilities[j] = list(possibilities[j])
-            while "empty" in possibilities[j]:
-                possibilities[j].remove("empty")
-            while [] in possibilities[j]:
-                possibilities[j].remove([])
-        while [] in possibilities:
-            possibilities.remove([])
+        possibilities = self.__andTerms(list(newUpstreams))
         # create a list of the activities of each node and store alongside the contributors to each and node for easy reference later
         activities = []  # list to store activities of nodes (a vs i)
         for sequence in possibilities:
@@ -335,29 +441,8 @@ class ruleMaker:
         self.andNodeInvertList[node] = activities
 
     def __updateCpointers(self):
-        """set up C pointers with correct lengths to pass to simulation software in C"""
-        tempandnoder = []
-        tempandinverter = []
-        for currentNode in range(len(self.nodeList)):
-            tempAndNodes = []
-            tempandNodeInvertList = []
-            if currentNode < len(self.nodeList):
-                tempAndNodes = [
-                    xi + [-1] * (3 - len(xi)) for xi in self.andNodeList[currentNode]
-                ]
-                tempandNodeInvertList = [
-                    xi + [-1] * (3 - len(xi))
-                    for xi in self.andNodeInvertList[currentNode]
-                ]
-            while len(tempAndNodes) < 7:
-                tempAndNodes.append([0, 0, 0])
-                tempandNodeInvertList.append([0, 0, 0])
-            tempandnoder.append(tempAndNodes)
-            tempandinverter.append(tempandNodeInvertList)
-        # self.andNodeInvert = np.array(tempandinverter, dtype=np.intc, order="C")
-        self.andNodeInvert = np.array(tempandinverter, dtype=object, order="C")
-        # self.andNodes = np.array(tempandnoder, dtype=np.intc, order="C")
-        self.andNodes = np.array(tempandnoder, dtype=object, order="C")
+        """compile andNodeList and andNodeInvertList into the flat arrays passed to the simulation software in C. Must be called whenever the rule structure changes"""
+        self.compiledModel = compiledModel(self.andNodeList, self.andNodeInvertList)
 
     def __genRandBits(self):
         """generates a random bitstring"""
@@ -396,6 +481,14 @@ class ruleMaker:
             ind2[1][cxpoint1:cxpoint2],
             ind1[1][cxpoint1:cxpoint2],
         )
+        if (
+            ind1[0].andNodeList[cxpointer1:cxpointer2]
+            == ind2[0].andNodeList[cxpointer1:cxpointer2]
+            and ind1[0].andNodeInvertList[cxpointer1:cxpointer2]
+            == ind2[0].andNodeInvertList[cxpointer1:cxpointer2]
+        ):
+            # same rule structure, so both keep their compiled models
+            return ind1, ind2
         (
             ind1[0].andNodeList[cxpointer1:cxpointer2],
             ind2[0].andNodeList[cxpointer1:cxpointer2],
@@ -427,82 +520,6 @@ class ruleMaker:
         minvals = population[saveVal].fitness.values
         return minvals, ultimate[1], ultimate[0]
 
-    def __NP(self, individual, model, cells, params, KOs, KIs, scSyncBoolC):
-        """NP simulation code for synchronous simulation"""
-        cellArray = []
-
-        # set up knockin and knockout lists
-        knockins = np.zeros(len(model.nodeList), dtype=np.intc, order="C")
-        knockouts = np.zeros(len(model.nodeList), dtype=np.intc, order="C")
-
-        for knocker in KOs:
-            knockouts[knocker] = 1
-        for knocker in KIs:
-            knockins[knocker] = 1
-
-        # put objects in correct format for passing to C
-        nodeIndividual = np.array(individual, dtype=np.intc, order="C")
-        indLen = len(nodeIndividual)
-        andNodes = np.array(model.andNodes, dtype=np.intc, order="C")
-        nodeNum = len(model.nodeList)
-        andNodeInvert = np.array(model.andNodeInvert, dtype=np.intc, order="C")
-        individualParse = np.array(model.individualParse, dtype=np.intc, order="C")
-        andLenList = np.array(model.andLenList, dtype=np.intc, order="C")
-        nodePositions1 = model.nodePositions
-        nodePositionsC = np.array(nodePositions1, dtype=np.intc, order="C")
-        simSteps = self.params.simSteps
-        lenSamples1 = len(model.sampleList)
-        binMatC1 = self.binMat.toarray(order="C")
-        binMatC3 = np.transpose(
-            np.array(copy.deepcopy(binMatC1), order="C", dtype=np.intc)
-        )
-        binMatCPointer = ctypes.c_void_p(
-            binMatC3.ctypes.data
-        )  # put input array as C pointer
-
-        # convert objects into C pointers
-        nodeIndividual1 = ctypes.c_void_p(nodeIndividual.ctypes.data)
-        indLen1 = ctypes.c_void_p(indLen)
-        andNodes1 = ctypes.c_void_p(andNodes.ctypes.data)
-        individualParse1 = ctypes.c_void_p(individualParse.ctypes.data)
-        andLenList1 = ctypes.c_void_p(andLenList.ctypes.data)
-        andNodeInvertList1 = ctypes.c_void_p(andNodeInvert.ctypes.data)
-        nodeNum1 = ctypes.c_void_p(nodeNum)
-
-        simSteps1 = ctypes.c_void_p(simSteps)
-        knockouts1 = ctypes.c_void_p(knockouts.ctypes.data)
-        knockins1 = ctypes.c_void_p(knockins.ctypes.data)
-
-        nodePositionsCPointer = ctypes.c_void_p(nodePositionsC.ctypes.data)
-
-        vals = np.full(
-            shape=(self.maxNodes, self.params.simSteps, self.maxSamples),
-            fill_value=2,
-            dtype=np.intc,
-            order="C",
-        )  # initiate output array - sim data is nodes * sim steps * cells. Max sim steps hard coded to 200
-        valsubmit = ctypes.c_void_p(vals.ctypes.data)  # put output array into C pointer
-        lenSamples = ctypes.c_void_p(lenSamples1)
-
-        scSyncBoolC(
-            valsubmit,
-            nodeIndividual1,
-            indLen1,
-            nodeNum1,
-            andLenList1,
-            individualParse1,
-            andNodes1,
-            andNodeInvertList1,
-            simSteps1,
-            knockouts1,
-            knockins1,
-            lenSamples,
-            binMatCPointer,
-            nodePositionsCPointer,
-        )
-
-        return vals
-
     def __varOrAdaptive(
         self, population, toolbox, lambda_, cxpb, mutpb, genfrac, mutModel
     ):
@@ -585,11 +602,15 @@ class ruleMaker:
             start = model.individualParse[focusNode]
             end = model._ruleMaker__findEnd(focusNode)
             # mutate the inputs some of the time
-            if len(model.possibilityList[focusNode]) > 3 and random() < mutModel:
+            if (
+                model.inputLimit is not None
+                and len(model.possibilityList[focusNode]) > model.inputLimit
+                and random() < mutModel
+            ):
                 temppermup = []  # temporary upstream nodes
                 upstreamAdders = list(model.possibilityList[focusNode])
                 rvals = list(model.rvalues[focusNode])
-                while len(temppermup) < 3:
+                while len(temppermup) < model.inputLimit:
                     randy = random()  # randomly select a node to mutate
                     tempsum = sum(rvals)
                     if tempsum == 0:
@@ -1094,32 +1115,24 @@ class ruleMaker:
         for knocker in KOlist:
             knockins[knocker] = 1
 
-        # put objects in correct format for passing to C
+        # put objects in correct format for passing to C; the rules are passed as the arrays of the compiled model
         nodeIndividual = np.array(individual, dtype=np.intc, order="C")
-        indLen = len(nodeIndividual)
-        andNodes = np.array(model.andNodes, dtype=np.intc, order="C")
         nodeNum = len(model.nodeList)
-        andNodeInvert = np.array(model.andNodeInvert, dtype=object, order="C")
-        individualParse = np.array(model.individualParse, dtype=np.intc, order="C")
-        andLenList = np.array(model.andLenList, dtype=np.intc, order="C")
-        nodePositions1 = model.nodePositions
-        nodePositionsC = np.array(nodePositions1, dtype=np.intc, order="C")
-        simSteps = self.params.simSteps
-        lenSamples1 = len(model.sampleList)
-        binMatC3 = np.array(
-            copy.deepcopy(self.binMat.toarray(order="C")), order="C", dtype=np.intc
+        termOffsets1, inputOffsets1, inputs1, inverts1, settleOrder1 = (
+            model.compiledModel.pointers
         )
+        # simulate each unique cell state once; rows of binMatC3 are the nodes in nodeList order
+        nodePositionsC = np.arange(nodeNum, dtype=np.intc)
+        simSteps = self.params.simSteps
+        lenSamples1 = len(model.cellWeights)
         binMatCPointer = ctypes.c_void_p(
-            binMatC3.ctypes.data
+            model.cellStateBits.packed.ctypes.data
         )  # put input array as C pointer
+        binMatRowBytes = ctypes.c_void_p(model.cellStateBits.rowBytes)
+        cellWeightsC = ctypes.c_void_p(model.cellWeights.ctypes.data)
 
         # convert objects into C pointers
         nodeIndividual1 = ctypes.c_void_p(nodeIndividual.ctypes.data)
-        indLen1 = ctypes.c_void_p(indLen)
-        andNodes1 = ctypes.c_void_p(andNodes.ctypes.data)
-        individualParse1 = ctypes.c_void_p(individualParse.ctypes.data)
-        andLenList1 = ctypes.c_void_p(andLenList.ctypes.data)
-        andNodeInvertList1 = ctypes.c_void_p(andNodeInvert.ctypes.data)
         nodeNum1 = ctypes.c_void_p(nodeNum)
 
         simSteps1 = ctypes.c_void_p(simSteps)
@@ -1129,13 +1142,15 @@ class ruleMaker:
         nodePositionsCPointer = ctypes.c_void_p(nodePositionsC.ctypes.data)
 
         vals = np.full(
-            shape=(100, self.maxNodes), fill_value=0, dtype=np.intc, order="C"
-        )  # simData[STEP][NODE]
+            shape=(100, nodeNum), fill_value=0, dtype=np.intc, order="C"
+        )  # simData: STEP rows of nodeNum values
         valsubmit = ctypes.c_void_p(vals.ctypes.data)
         lenSamples = ctypes.c_void_p(lenSamples1)
 
         localSearchC = ctypes.c_void_p(int(localSearch))
         importanceScoresC = ctypes.c_void_p(int(importanceScores))
+        # OpenMP threads used by the simulator; set by singleCell
+        threadsC = ctypes.c_void_p(int(getattr(model, "threads", 1)))
 
         # errors = np.array(np.full(10000, fill_value=0, dtype=np.intc, order='C'))
         # errorsSubmit=ctypes.c_void_p(errors.ctypes.data)
@@ -1143,27 +1158,30 @@ class ruleMaker:
         if localSearch:
             # look at errors node wise
             errors = np.array(
-                np.full(self.maxNodes, fill_value=0, dtype=np.intc, order="C")
+                np.full(nodeNum, fill_value=0, dtype=np.intc, order="C")
             )
             errorsSubmit = ctypes.c_void_p(errors.ctypes.data)
             cFunction(
                 valsubmit,
                 nodeIndividual1,
-                indLen1,
                 nodeNum1,
-                andLenList1,
-                individualParse1,
-                andNodes1,
-                andNodeInvertList1,
+                termOffsets1,
+                inputOffsets1,
+                inputs1,
+                inverts1,
+                settleOrder1,
                 simSteps1,
                 knockouts1,
                 knockins1,
                 lenSamples,
                 binMatCPointer,
+                binMatRowBytes,
                 nodePositionsCPointer,
                 errorsSubmit,
                 localSearchC,
                 importanceScoresC,
+                cellWeightsC,
+                threadsC,
             )  # in this case scSyncBoolC
             errors = errors.tolist()
             errors = errors[:nodeNum]
@@ -1177,45 +1195,51 @@ class ruleMaker:
                 cFunction(
                     valsubmit,
                     nodeIndividual1,
-                    indLen1,
                     nodeNum1,
-                    andLenList1,
-                    individualParse1,
-                    andNodes1,
-                    andNodeInvertList1,
+                    termOffsets1,
+                    inputOffsets1,
+                    inputs1,
+                    inverts1,
+                    settleOrder1,
                     simSteps1,
                     knockouts1,
                     knockins1,
                     lenSamples,
                     binMatCPointer,
+                    binMatRowBytes,
                     nodePositionsCPointer,
                     importanceScoresC,
+                    cellWeightsC,
+                    threadsC,
                 )  # in this case importanceScore
                 return importanceScores.tolist()
             else:
                 # look at errors by sample
                 errors = np.array(
-                    np.full(self.maxSamples, fill_value=0, dtype=np.intc, order="C")
+                    np.full(lenSamples1, fill_value=0, dtype=np.intc, order="C")
                 )
                 errorsSubmit = ctypes.c_void_p(errors.ctypes.data)
                 cFunction(
                     valsubmit,
                     nodeIndividual1,
-                    indLen1,
                     nodeNum1,
-                    andLenList1,
-                    individualParse1,
-                    andNodes1,
-                    andNodeInvertList1,
+                    termOffsets1,
+                    inputOffsets1,
+                    inputs1,
+                    inverts1,
+                    settleOrder1,
                     simSteps1,
                     knockouts1,
                     knockins1,
                     lenSamples,
                     binMatCPointer,
+                    binMatRowBytes,
                     nodePositionsCPointer,
                     errorsSubmit,
                     localSearchC,
                     importanceScoresC,
+                    cellWeightsC,
+                    threadsC,
                 )  # in this case scSyncBoolC
                 errors = errors.tolist()
                 return [sum(errors)]
@@ -1241,6 +1265,11 @@ class ruleMaker:
         equivs = [truth]
         if (end - start) == 0:
             return truth, equivs, equivs, 0.0
+        if (end - start) > 7:
+            # more than 3 inputs: too many rules to try them all
+            return self.__climbNodePossibilities(
+                node, indy, KOlist, KIlist, scSyncBoolC, start, end
+            )
         indOptions = []
         indErrors = []
         # iterate over possibilities for this node
@@ -1265,6 +1294,47 @@ class ruleMaker:
         truth = equivs[0]
         return (truth, equivs, minny, indErrors)
 
+    def __climbNodePossibilities(
+        self, node, indy, KOlist, KIlist, scSyncBoolC, start, end
+    ):
+        """Local search over single shadow and node flips for a node with too many rules to try every one"""
+        tol = 0.0
+        tried = {}
+
+        def nodeError(rule):
+            if tuple(rule) not in tried:
+                tempultimate = list(indy)
+                tempultimate[start:end] = rule
+                tried[tuple(rule)] = self._ruleMaker__evaluateByNode(
+                    tempultimate, KOlist, KIlist, scSyncBoolC, localSearch=True
+                )[node]
+            return tried[tuple(rule)]
+
+        current = list(indy[start:end])
+        if sum(current) == 0:
+            current[0] = 1
+        currentError = nodeError(current)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(len(current)):
+                candidate = list(current)
+                candidate[i] = 1 - candidate[i]
+                if sum(candidate) > 0 and nodeError(candidate) < currentError:
+                    best, currentError = candidate, nodeError(candidate)
+                    improved = True
+            if improved:
+                current = best
+        indOptions = [list(rule) for rule in tried]
+        indErrors = list(tried.values())
+        minny = min(indErrors)
+        equivs = [
+            indOptions[i]
+            for i in range(len(indOptions))
+            if indErrors[i] <= minny + tol
+        ]
+        return (equivs[0], equivs, minny, indErrors)
+
     def __calcImportance(self, equivs, model, importanceScore, graphName):
         # Create holder for importance scores
         importanceScoresDict = {}
@@ -1387,15 +1457,14 @@ class ruleMaker:
         nx.set_node_attributes(net, values=obsERS, name="obsERS")
 
         # add abundance as attribute to graph
-        binMat2 = self.binMat.A
         abundance = {}
         abundance_sd = {}
         numZeros = {}
         numOnes = {}
 
         for node in list(importanceScoresDict.keys()):
-            node_index = self.geneList.index(node)
-            expression = binMat2[node_index, :].tolist()
+            node_index = self.geneIndex[node]
+            expression = self.binMat.getRow(node_index).tolist()
             abundance[node] = np.mean(expression)
             abundance_sd[node] = np.std(expression)
             expression = np.array(expression)
@@ -3,7 +3,9 @@
 #include <string.h>
 #include <stdbool.h>
 #include <stdlib.h>
+#include <stdint.h>
 #define STEP 100 //simsteps ROW
+// NODE and CELL only size the legacy functions below; scSyncBool, cluster and importanceScore take simData as STEP rows of nodeNum values and size their buffers from nodeNum and lenSamples
 #define NODE 20000 // 50000 //nodes COL
 #define CELL 15000 
 
@@ -303,7 +305,8 @@ void transpose(int vals[NODE][STEP], int valsT[STEP][NODE])
 
 }
 
-struct Tuple getAttractCycle2(int valsT[STEP][NODE], int *nodePositions, int nodeNum){
+// valsT is the trajectory of one cell: STEP rows of nodeNum values, in the order of the nodes in the model
+struct Tuple getAttractCycle2(int *valsT, int nodeNum){
     struct Tuple res = {0,0};
     int i;
     int j;
@@ -313,10 +316,8 @@ struct Tuple getAttractCycle2(int valsT[STEP][NODE], int *nodePositions, int nod
         int flag=0;
         for(j=i-1; j>=0; j--) {
             flag=1;
-            //for(k=0; k<=NODE;k++) {
             for(k=0; k < nodeNum; k++) {
-                //if(valsT[i][k]!=valsT[j][k]){
-                if(valsT[i][nodePositions[k]]!=valsT[j][nodePositions[k]]){
+                if(valsT[(long) i*nodeNum + k]!=valsT[(long) j*nodeNum + k]){
                     flag=0;
                 }
             }
@@ -331,426 +332,783 @@ struct Tuple getAttractCycle2(int valsT[STEP][NODE], int *nodePositions, int nod
 }
 
 // Driver program to test above functions
-void getAttract(int vals[STEP][NODE], int resSubmit[2], int *nodePositions, int nodeNum)
+void getAttract(int *vals, int resSubmit[2], int nodeNum)
 {
-    struct Tuple res = getAttractCycle2(vals, nodePositions, nodeNum); //getAttractCycle(vals);
+    struct Tuple res = getAttractCycle2(vals, nodeNum); //getAttractCycle(vals);
     resSubmit[0] = res.first;
     resSubmit[1] = res.second;
-    int i;
-    int j;
-    //for(i=resSubmit[0]; i<=resSubmit[1]; i++){
-    //  for (j = 0; j< nodeNum; j++){
-    //      printf("%d\t", vals[i][j]);
-    //  }
-    //  printf("\n");
-    //}
 }
 
 
-void scSyncBool(int simData[STEP][NODE], int *individual,int indLen, int nodeNum, int *andLenList, int *individualParse, int andNodes[NODE][7][3], int andNodeInvertList[NODE][7][3], int simSteps, int *knockouts, int *knockins, int lenSamples, int binMat[NODE][CELL], int *nodePositions, int errors[CELL], int localSearch, int importanceScores){
+// binMat is bit-packed with numpy.packbits: one row of binMatRowBytes bytes per node, most significant bit first
+static inline int getBit(unsigned char *binMat, int binMatRowBytes, int row, int col){
+    return (binMat[(long) row*binMatRowBytes + (col >> 3)] >> (7 - (col & 7))) & 1;
+}
 
-    int step;
-    int i;
-    int nodeEnd;
-    int temp;
-    int nodeStart;
-    int oldValue[NODE];
-    int newValue[NODE];
-    int cell;
-    int nodePos;
-    int error[CELL];
-    int totalError;
-    int minError;
-
-    //iteration over samples
-    //#pragma omp parallel 
-    //{
-    //    #pragma omp for
-        for(cell=0; cell<lenSamples; cell++){
-            for(i=0; i<nodeNum; i++){
-                nodePos = nodePositions[i];
-                newValue[i]=binMat[nodePos][cell];
-                simData[0][nodePos]=newValue[i];
-            }
-            for(step=1; step < simSteps; step++){
+// rules are passed as a compiled model (see compiledModel.py): the AND terms of node i are termOffsets[i] to termOffsets[i+1], which are also the positions of their bits in individual, and the inputs of term t are inputs[inputOffsets[t]] to inputs[inputOffsets[t+1]-1], negated where inverts is set
+// a node without inputs, or whose individual selects none of its terms, keeps its value; a node with a single term always uses it
+static inline int updateNode(int node, int *oldValue, int *individual, int *termOffsets, int *inputOffsets, int *inputs, int *inverts){
+    int termStart = termOffsets[node];
+    int termEnd = termOffsets[node+1];
+    int term;
+    int k;
+    int selected = 0;
+    if (termEnd == termStart){return oldValue[node];}
+    for(term=termStart; term<termEnd; term++){
+        if (termEnd - termStart > 1 && !individual[term]){continue;}
+        selected = 1;
+        // AND of the inputs of the term; the OR over terms stops at the first term that is true
+        for(k=inputOffsets[term]; k<inputOffsets[term+1]; k++){
+            if (oldValue[inputs[k]] == inverts[k]){break;}
+        }
+        if (k == inputOffsets[term+1]){return 1;}
+    }
+    return selected ? 0 : oldValue[node];
+}
 
-                for(i=0; i < nodeNum; i++){
-                    oldValue[i]=newValue[i];
-                }
+#define LUT_INPUTS 3 //rules with at most this many inputs are evaluated from an 8-bit truth table
+
+// the rule of each node compiled for one individual: lut holds the value of the node for each combination of lutInputs (input k is bit k of the index). Nodes with more than LUT_INPUTS inputs keep the term-by-term evaluation of updateNode
+struct RuleTable {
+    unsigned char *lut;
+    int *lutInputs; // LUT_INPUTS per node, padded by repeating an input
+    int *fallback;
+    int *individual;
+    int *termOffsets;
+    int *inputOffsets;
+    int *inputs;
+    int *inverts;
+};
 
-                for(i=0; i< nodeNum; i++){
-
-                    if(knockouts[i]==1){
-                        temp=0;
-                        newValue[i]=temp;
-                        nodePos = nodePositions[i];
-                        simData[step][nodePos]=temp;
-                        continue;} else if(knockins[i]==1){
-                        temp=1;
-                        newValue[i]=temp;
-                        nodePos = nodePositions[i];
-                        simData[step][nodePos]=temp;
-                        continue;
-                    }
-                    if (andLenList[i]==1){
-                        temp=(oldValue[andNodes[i][0][0]]!=andNodeInvertList[i][0][0]);
-                        newValue[i]=temp;
-                        nodePos = nodePositions[i];
-                        simData[step][nodePos]=temp;
-                        continue;}
-                    else if (andLenList[i]==0){
-                        temp=oldValue[andNodes[i][0][0]];
-                        newValue[i]=temp;
-                        nodePos = nodePositions[i];
-                        simData[step][nodePos]=temp;
-                        continue;}
-                    else{
-                        if (i==(nodeNum-1)){nodeEnd=indLen;}
-                        else{nodeEnd=individualParse[i+1];}
-                        nodeStart=individualParse[i];
-                        temp=updateBool(i, oldValue, individual, andNodes[i], andNodeInvertList[i], nodeStart, nodeEnd);
-                        newValue[i]=temp;
-                        nodePos = nodePositions[i];
-                        simData[step][nodePos]=temp;
-                        continue;
-                    }
-                    //if (simData[step][nodePos] > 1){
-                    //  printf("%d %d\n",simData[step][nodePos], binMat[nodePos][cell]);
-                    //}
-                }
-                importanceScores=importanceScores+temp;
+// tables are built once per simulation, when the individual is known: knocked out nodes (forcedZero) are always 0 and knocked in nodes (forcedOne, may be NULL) always 1. With firstInputOnly, a node follows the first input of its first term, as in importanceScore
+void buildRuleTable(struct RuleTable *table, int nodeNum, int *individual, int *termOffsets, int *inputOffsets, int *inputs, int *inverts, int *forcedZero, int *forcedOne, int firstInputOnly){
+    int *scratch = calloc(nodeNum, sizeof(int));
+    int nodeInputs[LUT_INPUTS];
+    int inputNum;
+    int i;
+    int term;
+    int k;
+    int j;
+    int combination;
+    int termStart;
+    int termEnd;
+    int values;
+    table->lut = calloc(nodeNum, sizeof(unsigned char));
+    table->lutInputs = malloc((long) nodeNum * LUT_INPUTS * sizeof(int));
+    table->fallback = calloc(nodeNum, sizeof(int));
+    table->individual = individual;
+    table->termOffsets = termOffsets;
+    table->inputOffsets = inputOffsets;
+    table->inputs = inputs;
+    table->inverts = inverts;
+    for(i=0; i<nodeNum; i++){
+        termStart = termOffsets[i];
+        termEnd = termOffsets[i+1];
+        for(k=0; k<LUT_INPUTS; k++){table->lutInputs[(long) i*LUT_INPUTS + k]=i;}
+        if (forcedZero[i]){table->lut[i]=0x00; continue;}
+        if (forcedOne != NULL && forcedOne[i]){table->lut[i]=0xFF; continue;}
+        if (firstInputOnly){
+            if (termEnd > termStart){
+                table->lutInputs[(long) i*LUT_INPUTS]=inputs[inputOffsets[termStart]];
+                table->lut[i] = inverts[inputOffsets[termStart]] ? 0x55 : 0xAA;
+            } else {
+                table->lut[i] = 0xAA; // keeps its own value
+            }
+            continue;
+        }
+        // distinct inputs of the terms used by the individual; a node without any keeps its own value, so it is its own input
+        inputNum = 0;
+        for(term=termStart; term<termEnd && !table->fallback[i]; term++){
+            if (termEnd - termStart > 1 && !individual[term]){continue;}
+            for(k=inputOffsets[term]; k<inputOffsets[term+1]; k++){
+                for(j=0; j<inputNum && nodeInputs[j]!=inputs[k]; j++){}
+                if (j < inputNum){continue;}
+                if (inputNum == LUT_INPUTS){table->fallback[i]=1; break;}
+                nodeInputs[inputNum++]=inputs[k];
             }
+        }
+        if (table->fallback[i]){continue;}
+        if (inputNum == 0){nodeInputs[inputNum++]=i;}
+        values = 0;
+        for(combination=0; combination < (1 << inputNum); combination++){
+            for(k=0; k<inputNum; k++){scratch[nodeInputs[k]]=(combination >> k) & 1;}
+            values |= updateNode(i, scratch, individual, termOffsets, inputOffsets, inputs, inverts) << combination;
+        }
+        for(k=0; k<inputNum; k++){table->lutInputs[(long) i*LUT_INPUTS + k]=nodeInputs[k];}
+        // the unused high bits of the index repeat the first input, so every entry follows the low bits
+        for(k=inputNum; k<LUT_INPUTS; k++){table->lutInputs[(long) i*LUT_INPUTS + k]=nodeInputs[0];}
+        for(combination=0; combination < (1 << LUT_INPUTS); combination++){
+            table->lut[i] |= ((values >> (combination & ((1 << inputNum) - 1))) & 1) << combination;
+        }
+    }
+    free(scratch);
+}
 
-            //add error calculation function
-            int resSubmit[2]; //positions of attractor in trajectory
-            getAttract(simData, resSubmit, nodePositions, nodeNum); //get positions of attractor in trajectory
+void freeRuleTable(struct RuleTable *table){
+    free(table->lut);
+    free(table->lutInputs);
+    free(table->fallback);
+}
 
-            minError=100000;
-            //printf("%d %d \n",resSubmit[0], resSubmit[1]);
-            //iterate over attractors
-            for(temp=resSubmit[0]; temp<resSubmit[1]; temp++){
-                //printf("Temp: %d\n", temp);
-                //prepare attractor
-                for(i=0; i<nodeNum; i++){
-                    nodePos = nodePositions[i];
-                    //if (simData[step][nodePos] > 0){
-                    //  printf("%d %d %d %d %d\n",temp, nodePos, nodeNum, simData[step][nodePos], binMat[nodePos][cell]);
-                    //}
-                    newValue[i] = simData[temp][nodePos]; //this is the attractor
-                    //printf("%d ", newValue[i]);
-                }
-                //printf("\n");
+static inline int ruleValue(struct RuleTable *table, int node, int *oldValue){
+    int *lutInputs = table->lutInputs + (long) node*LUT_INPUTS;
+    if (table->fallback[node]){
+        return updateNode(node, oldValue, table->individual, table->termOffsets, table->inputOffsets, table->inputs, table->inverts);
+    }
+    return (table->lut[node] >> (oldValue[lutInputs[0]] | (oldValue[lutInputs[1]] << 1) | (oldValue[lutInputs[2]] << 2))) & 1;
+}
 
-                //calculate error
-                totalError=0;
-                for(i=0; i<nodeNum; i++){
-                    nodePos = nodePositions[i]; //prepare cellInitValue from input data
-                    //error[i] = abs(newValue[i] - binMat[nodePos][cell]); //why is this always zero?
-                    //printf("Error: %f, Node: %d, newValue: %d, binMat: %d\n", error[i], i, newValue[i], binMat[nodePos][cell]);
-                    error[i] = abs(newValue[i] - binMat[nodePos][cell]);
-                    totalError=totalError+error[i];
-                }
-                //if (totalError > 0){
-                    //printf("Total error: %d\n", totalError);
-                //}
-
-                if (totalError < minError){
-                    minError = totalError;
-                    if (totalError <= 0.001*nodeNum && minError < 10000){ //this condition should change.
-                        minError=0;
-                        if (localSearch){
-                            for(i=0; i<nodeNum; i++){
-                                errors[i] = errors[i] + error[i];
-                            }
-                        } else {
-                            errors[cell] = totalError;
-                        }
-                    continue; //I want to break out of the loop that iterates over repeating states and skip to evaluating for the next sample
-                    }
-                }  else {
-                    minError = minError;
-                }
+// the network reduced for one simulation: nodes that stop changing are no longer updated or compared when looking for the attractor
+struct Reduction {
+    int *settle; // step from which each node keeps its value, -1 if it may change at any step
+    int *core; // nodes that may change at any step
+    int coreNum;
+    int *settled; // nodes that change only before settleStep
+    int settledNum;
+    int settleStep; // every node outside core keeps its value from this step on
+};
 
+// settle steps follow from the rules for the given individual and knockouts: a node without inputs, or whose individual selects none of its terms, never changes (settle 0); a knocked out or knocked in node is constant from step 1; a node whose inputs all settle is constant one step after the last of them. order lists the nodes so that inputs outside a cycle come before the nodes they feed, so one pass suffices. With firstInputOnly, a node is taken to depend only on the first input of its first term, as in importanceScore
+void reduceNetwork(struct Reduction *reduction, int nodeNum, int *individual, int *termOffsets, int *inputOffsets, int *inputs, int *settleOrder, int *knockouts, int *knockins, int firstInputOnly, int simSteps){
+    int *settle = malloc(nodeNum * sizeof(int));
+    int index;
+    int i;
+    int term;
+    int k;
+    int termStart;
+    int termEnd;
+    int selected;
+    int nodeSettle;
+    for(i=0; i<nodeNum; i++){settle[i]=-1;}
+    reduction->settleStep = 0;
+    // rows after simSteps are not simulated, so every node is kept and compared when the trajectory is shorter than STEP
+    for(index=0; index<nodeNum && simSteps >= STEP; index++){
+        i = settleOrder[index];
+        termStart = termOffsets[i];
+        termEnd = termOffsets[i+1];
+        if (knockouts[i]==1 || (knockins != NULL && knockins[i]==1)){settle[i]=1;}
+        else if (termEnd == termStart){settle[i]=0;}
+        else if (firstInputOnly){
+            k = settle[inputs[inputOffsets[termStart]]];
+            settle[i] = (k < 0) ? -1 : k + 1;
+        }
+        else{
+            // settle[i] stays -1 until it is known, so a node that feeds itself is never settled
+            selected = 0;
+            nodeSettle = 0;
+            for(term=termStart; term<termEnd && nodeSettle >= 0; term++){
+                if (termEnd - termStart > 1 && !individual[term]){continue;}
+                selected = 1;
+                for(k=inputOffsets[term]; k<inputOffsets[term+1]; k++){
+                    if (settle[inputs[k]] < 0){nodeSettle=-1; break;}
+                    if (settle[inputs[k]] + 1 > nodeSettle){nodeSettle=settle[inputs[k]] + 1;}
                 }
-            //finally
-            if (localSearch){
-                for(i=0; i<nodeNum; i++){
-                    errors[i] = errors[i] + error[i];
-                }
-            } else {
-                errors[cell] = totalError;
             }
+            settle[i] = selected ? nodeSettle : 0;
         }
-    //}
+        if (settle[i] > reduction->settleStep){reduction->settleStep=settle[i];}
+    }
+    reduction->settle = settle;
+    reduction->core = malloc(nodeNum * sizeof(int));
+    reduction->settled = malloc(nodeNum * sizeof(int));
+    reduction->coreNum = 0;
+    reduction->settledNum = 0;
+    for(i=0; i<nodeNum; i++){
+        if (settle[i] < 0){reduction->core[reduction->coreNum++]=i;}
+        else if (settle[i] > 0){reduction->settled[reduction->settledNum++]=i;}
+    }
 }
 
-void cluster(int simData[STEP][NODE], int resSubmit[2], int sampleIndex, int *individual,int indLen, int nodeNum, int *andLenList, int *individualParse, int andNodes[NODE][7][3], int andNodeInvertList[NODE][7][3], int simSteps, int *knockouts, int *knockins, int binMat[NODE][CELL], int *nodePositions){
+void freeReduction(struct Reduction *reduction){
+    free(reduction->settle);
+    free(reduction->core);
+    free(reduction->settled);
+}
 
-    int step;
+// same result as getAttractCycle2: rows at or after settleStep can only differ in the core nodes, and nodes that never change are not compared at all
+struct Tuple getAttractCycleReduced(int *valsT, int nodeNum, struct Reduction *reduction){
+    struct Tuple res = {0,0};
     int i;
-    int nodeEnd;
-    int temp;
-    int nodeStart;
-    int oldValue[NODE];
-    int newValue[NODE];
-    int nodePos;
-
-    //simulate for only the specified sample
-    for(i=0; i<nodeNum; i++){
-
-        nodePos = nodePositions[i];
-        newValue[i]=binMat[nodePos][sampleIndex];
-        simData[0][nodePos]=newValue[i];
+    int j;
+    int k;
+    int flag;
+    for(i=STEP-1; i >= 0; i--) {
+        for(j=i-1; j>=0; j--) {
+            flag=1;
+            for(k=0; k < reduction->coreNum && flag; k++) {
+                if(valsT[(long) i*nodeNum + reduction->core[k]]!=valsT[(long) j*nodeNum + reduction->core[k]]){flag=0;}
+            }
+            if (j < reduction->settleStep){
+                for(k=0; k < reduction->settledNum && flag; k++) {
+                    if(valsT[(long) i*nodeNum + reduction->settled[k]]!=valsT[(long) j*nodeNum + reduction->settled[k]]){flag=0;}
+                }
+            }
+            if (flag == 1) {
+                res.first = j;
+                res.second = i;
+                return res;
+            }
+        }
     }
+    return res;
+}
 
-    for(step=1; step < simSteps; step++){
+void getAttractReduced(int *vals, int resSubmit[2], int nodeNum, struct Reduction *reduction)
+{
+    struct Tuple res = getAttractCycleReduced(vals, nodeNum, reduction);
+    resSubmit[0] = res.first;
+    resSubmit[1] = res.second;
+}
 
+// the attractor of one simulated cell: first and second are the rows getAttractCycle2 finds in the full trajectory. Rows after lastStep were not simulated and repeat the cycle of length period that starts at cycleStart
+struct Attractor {
+    int first;
+    int second;
+    int lastStep;
+    int cycleStart;
+    int period;
+};
 
-        for(i=0; i < nodeNum; i++){
-            oldValue[i]=newValue[i];
-        }
+static inline long attractorRow(struct Attractor *attractor, int row){
+    if (row <= attractor->lastStep){return row;}
+    return attractor->cycleStart + (row - attractor->cycleStart) % attractor->period;
+}
+
+// simulates the cell whose initial state is row 0 of trajectory. Each new state is compared with a checkpoint that moves to the current step at steps 1, 3, 7, 15, ... (Brent's algorithm). The first state equal to the checkpoint closes the cycle with its smallest period, and the rows getAttractCycle2 would find in the full trajectory follow without simulating the remaining steps. A cell whose cycle is not confirmed this way runs to the end and is searched as before, as is every cell when simSteps is below STEP
+static void simulateCell(int *trajectory, struct RuleTable *table, struct Reduction *reduction, int nodeNum, int simSteps, struct Attractor *attractor){
+    int checkpoint = 0;
+    int power = 1;
+    int equal;
+    int step;
+    int i;
+    int k;
+    int *previous;
+    int *current;
+    int *saved;
+    int resSubmit[2];
+    for(step=1; step < simSteps; step++){
+        previous = trajectory + (long) (step-1)*nodeNum;
+        current = trajectory + (long) step*nodeNum;
         for(i=0; i< nodeNum; i++){
+            if(reduction->settle[i] >= 0 && reduction->settle[i] < step){current[i]=previous[i];}
+            else{current[i]=ruleValue(table, i, previous);}
+        }
+        if (simSteps != STEP){continue;}
+        saved = trajectory + (long) checkpoint*nodeNum;
+        equal = 1;
+        for(k=0; k<reduction->coreNum && equal; k++){
+            if (current[reduction->core[k]] != saved[reduction->core[k]]){equal=0;}
+        }
+        if (checkpoint < reduction->settleStep){
+            for(k=0; k<reduction->settledNum && equal; k++){
+                if (current[reduction->settled[k]] != saved[reduction->settled[k]]){equal=0;}
+            }
+        }
+        if (equal){
+            attractor->lastStep = step;
+            attractor->cycleStart = checkpoint;
+            attractor->period = step - checkpoint;
+            attractor->first = STEP - 1 - attractor->period;
+            attractor->second = STEP - 1;
+            return;
+        }
+        if (step - checkpoint == power){
+            checkpoint = step;
+            power = power*2;
+        }
+    }
+    getAttractReduced(trajectory, resSubmit, nodeNum, reduction); //get positions of attractor in trajectory
+    attractor->first = resSubmit[0];
+    attractor->second = resSubmit[1];
+    attractor->lastStep = STEP - 1;
+    attractor->cycleStart = 0;
+    attractor->period = 1;
+}
 
-            if(knockouts[i]==1){
-                temp=0;
-                newValue[i]=temp;
-                nodePos = nodePositions[i];
-                simData[step][i]=temp;
-                continue;} else if(knockins[i]==1){
-                temp=1;
-                newValue[i]=temp;
-                nodePos = nodePositions[i];
-                simData[step][nodePos]=temp;
-                continue;
+// cells with identical initial states are simulated once; cellWeights[cell] is the number of cells sharing the state in column cell of binMat. Cells are split between threads, each with its own trajectory; rows of simData from simSteps on are not simulated and are read as the caller left them. scSyncBool gives the same errors 64 cells at a time
+void scSyncBool_cells(int *simData, int *individual, int nodeNum, int *termOffsets, int *inputOffsets, int *inputs, int *inverts, int *settleOrder, int simSteps, int *knockouts, int *knockins, int lenSamples, unsigned char *binMat, int binMatRowBytes, int *nodePositions, int *errors, int localSearch, int importanceScores, int *cellWeights, int threads){
+
+    int rowBytes = (nodeNum + 7) / 8;
+    int firstRow = (simSteps < STEP) ? simSteps : STEP;
+    int rowNum = (simSteps > STEP) ? simSteps : STEP;
+    unsigned char *lastDiff = calloc((long) lenSamples*rowBytes, sizeof(unsigned char)); // error of each node in the last attractor state, one bit per node
+    int *lastTotal = calloc(lenSamples, sizeof(int));
+    char *found = calloc(lenSamples, sizeof(char)); // cells that reach an attractor
+    int *weight = calloc(lenSamples, sizeof(int));
+    double tolerance = 0.001*nodeNum;
+    int cell;
+    int last;
+    int i;
+    struct Reduction reduction;
+    struct RuleTable table;
+    reduceNetwork(&reduction, nodeNum, individual, termOffsets, inputOffsets, inputs, settleOrder, knockouts, knockins, 0, simSteps);
+    buildRuleTable(&table, nodeNum, individual, termOffsets, inputOffsets, inputs, inverts, knockouts, knockins, 0);
+
+    #pragma omp parallel num_threads(threads)
+    {
+        int *trajectory = malloc((long) rowNum*nodeNum * sizeof(int));
+        int *tolerated = calloc(nodeNum, sizeof(int)); // errors of the attractor states within the tolerance
+        int *previous;
+        int *current;
+        int resSubmit[2]; //positions of attractor in trajectory
+        int threadCell;
+        int step;
+        int node;
+        int row;
+        int totalError;
+        int withinTolerance;
+        memcpy(trajectory + (long) firstRow*nodeNum, simData + (long) firstRow*nodeNum, (long) (STEP - firstRow)*nodeNum * sizeof(int));
+
+        #pragma omp for schedule(dynamic, 16)
+        for(threadCell=0; threadCell<lenSamples; threadCell++){
+            for(node=0; node<nodeNum; node++){
+                trajectory[node]=getBit(binMat, binMatRowBytes, nodePositions[node], threadCell);
             }
-            else if (andLenList[i]==1){
-                temp=(oldValue[andNodes[i][0][0]]!=andNodeInvertList[i][0][0]);
-                newValue[i]=temp;
-                nodePos = nodePositions[i];
-                simData[step][nodePos]=temp;
-                continue;}
-            else if (andLenList[i]==0){
-                temp=oldValue[andNodes[i][0][0]];
-                newValue[i]=temp;
-                nodePos = nodePositions[i];
-                simData[step][nodePos]=temp;
-                continue;}
-            else{
-                if (i==(nodeNum-1)){nodeEnd=indLen;}
-                else{nodeEnd=individualParse[i+1];}
-                nodeStart=individualParse[i];
-                temp=updateBool(i, oldValue, individual, andNodes[i], andNodeInvertList[i], nodeStart, nodeEnd);
-                newValue[i]=temp;
-                nodePos = nodePositions[i];
-                simData[step][nodePos]=temp;
-                continue;
+            for(step=1; step < simSteps; step++){
+                previous = trajectory + (long) (step-1)*nodeNum;
+                current = trajectory + (long) step*nodeNum;
+                for(node=0; node< nodeNum; node++){
+                    if(reduction.settle[node] >= 0 && reduction.settle[node] < step){current[node]=previous[node];}
+                    else{current[node]=ruleValue(&table, node, previous);}
+                }
+            }
+            getAttractReduced(trajectory, resSubmit, nodeNum, &reduction); //get positions of attractor in trajectory
+            if (resSubmit[1] == resSubmit[0]){continue;}
+            found[threadCell] = 1;
+
+            //iterate over attractors; the first state within the tolerance is counted once more
+            withinTolerance = 0;
+            totalError = 0;
+            for(row=resSubmit[0]; row<resSubmit[1]; row++){
+                current = trajectory + (long) row*nodeNum;
+                totalError = 0;
+                for(node=0; node<nodeNum; node++){
+                    if(reduction.settle[node]==0){continue;} //never leaves its initial value, so its error stays 0
+                    totalError = totalError + abs(current[node] - trajectory[node]);
+                }
+                if (!withinTolerance && totalError <= tolerance){
+                    withinTolerance = 1;
+                    for(node=0; node<nodeNum && localSearch; node++){
+                        if(reduction.settle[node]!=0){tolerated[node] = tolerated[node] + abs(current[node] - trajectory[node])*cellWeights[threadCell];}
+                    }
+                }
+            }
+            //error of the last attractor state
+            lastTotal[threadCell] = totalError;
+            current = trajectory + (long) (resSubmit[1]-1)*nodeNum;
+            for(node=0; node<nodeNum; node++){
+                if(reduction.settle[node]!=0 && current[node] != trajectory[node]){
+                    lastDiff[(long) threadCell*rowBytes + (node >> 3)] |= 1 << (node & 7);
+                }
             }
+        }
+        #pragma omp critical
+        {
+            for(node=0; node<nodeNum && localSearch; node++){
+                errors[node] = errors[node] + tolerated[node];
+            }
+        }
+        free(trajectory);
+        free(tolerated);
+    }
 
+    // a cell without an attractor adds the errors of the last cell before it that has one
+    last = -1;
+    for(cell=0; cell<lenSamples; cell++){
+        if (found[cell]){last = cell;}
+        if (localSearch){
+            if (last >= 0){weight[last] = weight[last] + cellWeights[cell];}
+        } else {
+            errors[cell] = (last >= 0 ? lastTotal[last] : 0)*cellWeights[cell];
         }
     }
-    getAttract(simData, resSubmit, nodePositions, nodeNum); //get positions of attractor in trajectory
+    if (localSearch){
+        #pragma omp parallel for num_threads(threads) private(cell)
+        for(i=0; i<nodeNum; i++){
+            for(cell=0; cell<lenSamples; cell++){
+                if ((lastDiff[(long) cell*rowBytes + (i >> 3)] >> (i & 7)) & 1){errors[i] = errors[i] + weight[cell];}
+            }
+        }
+    }
+    freeReduction(&reduction);
+    freeRuleTable(&table);
+    free(lastDiff);
+    free(lastTotal);
+    free(found);
+    free(weight);
 }
 
+#define CELL_WORD 64 //cells simulated together by scSyncBool, one per bit
 
-void importanceScore(int simData[STEP][NODE], int *individual,int indLen, int nodeNum, int *andLenList, int *individualParse, int andNodes[NODE][7][3], int andNodeInvertList[NODE][7][3], int simSteps, int *knockouts, int *knockins, int lenSamples, int binMat[NODE][CELL], int *nodePositions, double *importanceScores){
+// one bit per cell for 64 consecutive cells of a row of binMat, firstCell in the most significant bit as in the packed matrix
+static inline uint64_t cellWord(unsigned char *binMat, int binMatRowBytes, int row, int firstCell){
+    unsigned char *bytes = binMat + (long) row*binMatRowBytes + (firstCell >> 3);
+    int byteNum = binMatRowBytes - (firstCell >> 3);
+    uint64_t word = 0;
+    int k;
+    for(k=0; k<8; k++){word = (word << 8) | (k < byteNum ? bytes[k] : 0);}
+    return word;
+}
 
-    int step;
-    int i;
-    int nodeEnd;
-    int temp;
-    int nodeStart;
-    int oldValue[NODE];
-    int newValue[NODE];
-    int cell;
-    int nodePos;
-    int error[CELL];
-    int totalError;
-    int minError;
-    double attractorAverage_ko[nodeNum];
-    double attractorAverage_ki[nodeNum];
-    importanceScores[0] = 0.0;
+static inline uint64_t cellBit(int cell){
+    return (uint64_t) 1 << (CELL_WORD - 1 - (cell % CELL_WORD));
+}
 
-    // print out ki and ko node
-    for(i=0; i< nodeNum; i++){
-        attractorAverage_ko[i] = 0.0;
-        attractorAverage_ki[i] = 0.0;
-        //if(knockouts[i]==1){
-        //    printf("KO node: %d, nodePosition: %d\n", i, nodePositions[i]);
-        //}
-        //if(knockins[i]==1){
-        //    printf("KI node: %i, nodePosition: %i\n", i, nodePositions[i]);
-        //}
+// per-cell counters kept as bit planes: plane k holds bit k of the count of every cell in the word
+static inline void addToCounts(uint64_t *planes, int planeNum, uint64_t bits){
+    uint64_t carry;
+    int k;
+    for(k=0; k<planeNum && bits; k++){
+        carry = planes[k] & bits;
+        planes[k] ^= bits;
+        bits = carry;
     }
+}
 
-    //iteration over samples
-    for(cell=0; cell<lenSamples; cell++){
-        //KNOCK-OUT
-        //if(knockouts[0]){printf("Original data:\n");}
-        for(i=0; i<nodeNum; i++){
-            nodePos = nodePositions[i];
-            newValue[i]=binMat[nodePos][cell];
-            simData[0][nodePos]=newValue[i];
-            //if(knockouts[0]){printf("%d ", binMat[nodePos][cell]);}
+static inline int cellCount(uint64_t *planes, int planeNum, int cell){
+    int count = 0;
+    int k;
+    for(k=0; k<planeNum; k++){
+        if (planes[k] & cellBit(cell)){count |= 1 << k;}
+    }
+    return count;
+}
+
+// bit-parallel version of scSyncBool_cells, with the same errors: each uint64_t holds the value of a node in 64 cells, so a synchronous update is a few bitwise operations per node. A cell's attractor is found by comparing the last state with the earlier ones, as in getAttractCycle2, and its error is the number of nodes in which the last state of its attractor differs from its initial state, counted with popcount. A cell without an attractor repeats the errors of the previous cell that has one, as in the cell-by-cell loop. simData is not written
+void scSyncBool(int *simData, int *individual, int nodeNum, int *termOffsets, int *inputOffsets, int *inputs, int *inverts, int *settleOrder, int simSteps, int *knockouts, int *knockins, int lenSamples, unsigned char *binMat, int binMatRowBytes, int *nodePositions, int *errors, int localSearch, int importanceScores, int *cellWeights, int threads){
+    if (simSteps != STEP || lenSamples == 0 || nodeNum == 0){
+        // shorter trajectories also compare the rows of simData after simSteps, which only the cell-by-cell loop reads
+        scSyncBool_cells(simData, individual, nodeNum, termOffsets, inputOffsets, inputs, inverts, settleOrder, simSteps, knockouts, knockins, lenSamples, binMat, binMatRowBytes, nodePositions, errors, localSearch, importanceScores, cellWeights, threads);
+        return;
+    }
+    int blockNum = (lenSamples + CELL_WORD - 1) / CELL_WORD;
+    int block;
+    int i;
+    int k;
+    int term;
+    int cell;
+    int last;
+    int planeNum = 1;
+    int weightPlaneNum = 1;
+    double tolerance = 0.001*nodeNum;
+    struct Reduction reduction;
+    // rule of each node for this individual: 0 always 0, 1 always 1, 2 keeps its value, 3 the OR of its selected terms
+    int *ruleKind = malloc(nodeNum * sizeof(int));
+    int *activeOffsets = malloc((nodeNum + 1) * sizeof(int));
+    int *activeTerms = malloc((termOffsets[nodeNum] + 1) * sizeof(int));
+    uint64_t *lastDiff = malloc((long) blockNum*nodeNum * sizeof(uint64_t)); // last attractor state XOR initial state
+    uint64_t *found = calloc(blockNum, sizeof(uint64_t)); // cells that reach an attractor
+    uint64_t *weightPlanes;
+    int *lastTotal = calloc(lenSamples, sizeof(int));
+    int *weight = calloc(lenSamples, sizeof(int));
+
+    reduceNetwork(&reduction, nodeNum, individual, termOffsets, inputOffsets, inputs, settleOrder, knockouts, knockins, 0, simSteps);
+    activeOffsets[0] = 0;
+    for(i=0; i<nodeNum; i++){
+        activeOffsets[i+1] = activeOffsets[i];
+        for(term=termOffsets[i]; term<termOffsets[i+1]; term++){
+            if (termOffsets[i+1] - termOffsets[i] > 1 && !individual[term]){continue;}
+            activeTerms[activeOffsets[i+1]++] = term;
         }
-        //if(knockouts[0]){printf("\n");}
+        if (knockouts[i]==1){ruleKind[i]=0;}
+        else if (knockins[i]==1){ruleKind[i]=1;}
+        else if (activeOffsets[i+1] == activeOffsets[i]){ruleKind[i]=2;}
+        else {ruleKind[i]=3;}
+    }
+    while ((1 << planeNum) <= nodeNum){planeNum++;}
 
-        for(step=1; step < simSteps; step++){
-            //if(knockouts[0]){printf("Step: %d\n", step);}
-            for(i=0; i < nodeNum; i++){
-                oldValue[i]=newValue[i];
+    // blocks of 64 cells are split between threads; each thread has its own trajectory and counters, and writes only the entries of its blocks
+    #pragma omp parallel num_threads(threads)
+    {
+        uint64_t *states = malloc((long) STEP*nodeNum * sizeof(uint64_t));
+        uint64_t planes[32];
+        uint64_t startsAt[STEP];
+        uint64_t lastRows[STEP]; // cells whose last attractor state is in each row
+        uint64_t value;
+        uint64_t termValue;
+        uint64_t open;
+        uint64_t valid;
+        uint64_t started;
+        uint64_t resolved;
+        uint64_t *previous;
+        uint64_t *current;
+        int threadBlock;
+        int step;
+        int period;
+        int node;
+        int bit;
+        int active;
+        int blockCell;
+        int checkpoint;
+        int power;
+        int rows[STEP];
+        int rowNum;
+
+        #pragma omp for schedule(dynamic, 1)
+        for(threadBlock=0; threadBlock<blockNum; threadBlock++){
+            valid = (lenSamples - threadBlock*CELL_WORD >= CELL_WORD) ? ~(uint64_t) 0 : ~(~(uint64_t) 0 >> (lenSamples - threadBlock*CELL_WORD));
+            for(node=0; node<nodeNum; node++){
+                states[node] = cellWord(binMat, binMatRowBytes, nodePositions[node], threadBlock*CELL_WORD) & valid;
+            }
+            open = valid;
+            checkpoint = 0;
+            power = 1;
+            for(step=0; step<STEP; step++){
+                startsAt[step]=0;
+                lastRows[step]=0;
+            }
+            for(step=1; step<STEP && open; step++){
+                previous = states + (long) (step-1)*nodeNum;
+                current = states + (long) step*nodeNum;
+                for(node=0; node<nodeNum; node++){
+                    if ((reduction.settle[node] >= 0 && reduction.settle[node] < step) || ruleKind[node]==2){current[node]=previous[node]; continue;}
+                    if (ruleKind[node] < 2){current[node] = ruleKind[node] ? valid : 0; continue;}
+                    value = 0;
+                    for(active=activeOffsets[node]; active<activeOffsets[node+1]; active++){
+                        termValue = valid;
+                        for(bit=inputOffsets[activeTerms[active]]; bit<inputOffsets[activeTerms[active]+1]; bit++){
+                            termValue &= inverts[bit] ? ~previous[inputs[bit]] : previous[inputs[bit]];
+                        }
+                        value |= termValue;
+                    }
+                    current[node] = value;
+                }
+                if (localSearch && tolerance >= 1){continue;} // the tolerance below reads every row of the attractor
+
+                // cells whose state repeats the checkpoint have closed their cycle, as in simulateCell; the block stops once every cell has
+                previous = states + (long) checkpoint*nodeNum;
+                value = 0;
+                for(bit=0; bit<reduction.coreNum; bit++){value |= current[reduction.core[bit]] ^ previous[reduction.core[bit]];}
+                if (checkpoint < reduction.settleStep){
+                    for(bit=0; bit<reduction.settledNum; bit++){value |= current[reduction.settled[bit]] ^ previous[reduction.settled[bit]];}
+                }
+                if (open & ~value){
+                    // row STEP-2 of the full trajectory, the last attractor state, is this row of the cycle
+                    lastRows[checkpoint + (STEP-2-checkpoint) % (step-checkpoint)] |= open & ~value;
+                    open &= value;
+                }
+                if (step - checkpoint == power){
+                    checkpoint = step;
+                    power = power*2;
+                }
+            }
+
+            // the attractor of any other cell starts at the latest row equal to the last one
+            current = states + (long) (STEP-1)*nodeNum;
+            for(period=1; period<STEP && open; period++){
+                previous = states + (long) (STEP-1-period)*nodeNum;
+                value = 0;
+                for(bit=0; bit<reduction.coreNum; bit++){value |= current[reduction.core[bit]] ^ previous[reduction.core[bit]];}
+                if (STEP-1-period < reduction.settleStep){
+                    for(bit=0; bit<reduction.settledNum; bit++){value |= current[reduction.settled[bit]] ^ previous[reduction.settled[bit]];}
+                }
+                startsAt[STEP-1-period] = open & ~value;
+                lastRows[STEP-2] |= open & ~value;
+                open &= value;
+            }
+            found[threadBlock] = valid & ~open;
+
+            // error of the last attractor state, row STEP-2
+            rowNum = 0;
+            for(step=0; step<STEP-1; step++){
+                if (lastRows[step]){rows[rowNum++] = step;}
+            }
+            for(bit=0; bit<planeNum; bit++){planes[bit]=0;}
+            for(node=0; node<nodeNum; node++){
+                value = 0;
+                for(bit=0; bit<rowNum; bit++){value |= states[(long) rows[bit]*nodeNum + node] & lastRows[rows[bit]];}
+                lastDiff[(long) threadBlock*nodeNum + node] = (value ^ states[node]) & found[threadBlock];
+                addToCounts(planes, planeNum, lastDiff[(long) threadBlock*nodeNum + node]);
+            }
+            for(blockCell=threadBlock*CELL_WORD; blockCell<lenSamples && blockCell<(threadBlock+1)*CELL_WORD; blockCell++){
+                lastTotal[blockCell] = cellCount(planes, planeNum, blockCell);
             }
-            for(i=0; i< nodeNum; i++){
 
-                if(knockouts[i]){
-                    temp=0;
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;
+            // networks of 1000 nodes or more tolerate small errors: the first attractor state within the tolerance is also counted
+            if (localSearch && tolerance >= 1){
+                started = 0;
+                resolved = 0;
+                for(step=0; step<STEP-1; step++){
+                    started |= startsAt[step];
+                    if (!(started & ~resolved)){continue;}
+                    current = states + (long) step*nodeNum;
+                    for(bit=0; bit<planeNum; bit++){planes[bit]=0;}
+                    for(node=0; node<nodeNum; node++){addToCounts(planes, planeNum, (current[node] ^ states[node]) & started & ~resolved);}
+                    for(blockCell=threadBlock*CELL_WORD; blockCell<lenSamples && blockCell<(threadBlock+1)*CELL_WORD; blockCell++){
+                        if (!(started & ~resolved & cellBit(blockCell)) || cellCount(planes, planeNum, blockCell) > tolerance){continue;}
+                        resolved |= cellBit(blockCell);
+                        for(node=0; node<nodeNum; node++){
+                            if ((current[node] ^ states[node]) & cellBit(blockCell)){
+                                #pragma omp atomic
+                                errors[node] += cellWeights[blockCell];
+                            }
+                        }
                     }
-                    //continue;}
-                else if (andLenList[i]){
-                    temp=(oldValue[andNodes[i][0][0]]!=andNodeInvertList[i][0][0]);
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;}
-                    //continue;}
-                else if (andLenList[i]==0){
-                    temp=oldValue[andNodes[i][0][0]];
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;}
-                    //continue;}
-                else{
-                    if (i==(nodeNum-1)){nodeEnd=indLen;}
-                    else{nodeEnd=individualParse[i+1];}
-                    nodeStart=individualParse[i];
-                    temp=updateBool(i, oldValue, individual, andNodes[i], andNodeInvertList[i], nodeStart, nodeEnd);
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;
-                    //continue;
                 }
-                //if(knockouts[0]){printf("%d ", simData[step][nodePos]);}
             }
         }
-        //if(knockouts[0]){printf("\n");}
-        int ko_resSubmit[2]; //positions of attractor in trajectory
-        //printf("KNOCKOUT\n");
-        getAttract(simData, ko_resSubmit, nodePositions, nodeNum); //get positions of attractor in trajectory
-        // if (knockouts[0]==1){printf("KO attractor:\n");printf("KO attractor loc: %i, %i\n", ko_resSubmit[0], ko_resSubmit[1]);}
-        for(temp=ko_resSubmit[0]; temp<=ko_resSubmit[1]; temp++){
-            //prepare attractor
-            //if (knockouts[0]==1){printf("Temp: %d\n", temp);}
-            for(i=0; i<nodeNum; i++){
-                nodePos = nodePositions[i];
-                //if (knockouts[0]==1){printf("%d ", simData[temp][nodePos]);}
-                attractorAverage_ko[i] = attractorAverage_ko[i] + (double) (simData[temp][nodePos]/(ko_resSubmit[1] - ko_resSubmit[0])); //this is the attractor
+        free(states);
+    }
+
+    // a cell without an attractor adds the errors of the last cell before it that has one
+    last = -1;
+    for(cell=0; cell<lenSamples; cell++){
+        if (found[cell / CELL_WORD] & cellBit(cell)){last = cell;}
+        if (localSearch){
+            if (last >= 0){weight[last] = weight[last] + cellWeights[cell];}
+        } else {
+            errors[cell] = (last >= 0 ? lastTotal[last] : 0)*cellWeights[cell];
+        }
+    }
+    if (localSearch){
+        // errors of each node summed over cells with popcount, one weight bit plane at a time
+        for(cell=0; cell<lenSamples; cell++){
+            while (weightPlaneNum < 31 && (weight[cell] >> weightPlaneNum)){weightPlaneNum++;}
+        }
+        weightPlanes = calloc((long) blockNum*weightPlaneNum, sizeof(uint64_t));
+        for(cell=0; cell<lenSamples; cell++){
+            for(k=0; k<weightPlaneNum; k++){
+                if ((weight[cell] >> k) & 1){weightPlanes[(long) (cell / CELL_WORD)*weightPlaneNum + k] |= cellBit(cell);}
             }
-            //if (knockouts[0]==1){printf("\n");}
         }
-
+        #pragma omp parallel for num_threads(threads) private(block, k)
+        for(i=0; i<nodeNum; i++){
+            for(block=0; block<blockNum; block++){
+                if (!lastDiff[(long) block*nodeNum + i]){continue;}
+                for(k=0; k<weightPlaneNum; k++){
+                    errors[i] = errors[i] + (__builtin_popcountll(lastDiff[(long) block*nodeNum + i] & weightPlanes[(long) block*weightPlaneNum + k]) << k);
+                }
+            }
+        }
+        free(weightPlanes);
     }
-    //KNOCK - INS
 
-    //iteration over samples
-    for(cell=0; cell<lenSamples; cell++){
-        //KNOCK-OUT
-        //if(knockins[0]){printf("Original data:\n");}
+    freeReduction(&reduction);
+    free(ruleKind);
+    free(activeOffsets);
+    free(activeTerms);
+    free(lastDiff);
+    free(found);
+    free(lastTotal);
+    free(weight);
+}
+
+void cluster(int *simData, int resSubmit[2], int sampleIndex, int *individual, int nodeNum, int *termOffsets, int *inputOffsets, int *inputs, int *inverts, int *settleOrder, int simSteps, int *knockouts, int *knockins, unsigned char *binMat, int binMatRowBytes, int *nodePositions){
+
+    int step;
+    int i;
+    long row;
+    struct Reduction reduction;
+    struct RuleTable table;
+    struct Attractor attractor;
+    reduceNetwork(&reduction, nodeNum, individual, termOffsets, inputOffsets, inputs, settleOrder, knockouts, knockins, 0, simSteps);
+    buildRuleTable(&table, nodeNum, individual, termOffsets, inputOffsets, inputs, inverts, knockouts, knockins, 0);
+
+    //simulate for only the specified sample
+    for(i=0; i<nodeNum; i++){
+        simData[i]=getBit(binMat, binMatRowBytes, nodePositions[i], sampleIndex);
+    }
+    simulateCell(simData, &table, &reduction, nodeNum, simSteps, &attractor);
+    // the steps that were not simulated repeat the cycle, so the whole trajectory is returned
+    for(step=attractor.lastStep+1; step < simSteps; step++){
+        row = attractorRow(&attractor, step);
         for(i=0; i<nodeNum; i++){
-            nodePos = nodePositions[i];
-            newValue[i]=binMat[nodePos][cell];
-            simData[0][nodePos]=newValue[i];
-            //if(knockins[0]){printf("%d ", binMat[nodePos][cell]);}
+            simData[(long) step*nodeNum + i]=simData[row*nodeNum + i];
         }
-        //if(knockins[0]){printf("\n");}
+    }
+    resSubmit[0] = attractor.first; //positions of attractor in trajectory
+    resSubmit[1] = attractor.second;
+    freeReduction(&reduction);
+    freeRuleTable(&table);
+}
 
-        for(step=1; step < simSteps; step++){
-            //if(knockins[0]){printf("Step: %d\n", step);}
-            for(i=0; i < nodeNum; i++){
-                oldValue[i]=newValue[i];
-            }
-            for(i=0; i< nodeNum; i++){
 
-                if(knockins[i]){
-                    temp=0;
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;
-                    }
-                    //continue;}
-                else if (andLenList[i]){
-                    temp=(oldValue[andNodes[i][0][0]]!=andNodeInvertList[i][0][0]);
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;}
-                    //continue;}
-                else if (andLenList[i]==0){
-                    temp=oldValue[andNodes[i][0][0]];
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;}
-                    //continue;}
-                else{
-                    if (i==(nodeNum-1)){nodeEnd=indLen;}
-                    else{nodeEnd=individualParse[i+1];}
-                    nodeStart=individualParse[i];
-                    temp=updateBool(i, oldValue, individual, andNodes[i], andNodeInvertList[i], nodeStart, nodeEnd);
-                    newValue[i]=temp;
-                    nodePos = nodePositions[i];
-                    simData[step][nodePos]=temp;
-                    //continue;
+// cellWeights as for scSyncBool: attractor averages are weighted by the number of cells sharing each initial state
+// adds the attractor of every cell, weighted by cellWeights, to attractorAverage for one knockout or knockin pass. Cells are split between threads, each with its own trajectory and sums; the sums hold whole numbers, so the result does not depend on the number of threads. Rows of simData from simSteps on are not simulated and are read as the caller left them
+static void addAttractors(double *attractorAverage, struct RuleTable *table, struct Reduction *reduction, int *simData, int nodeNum, int simSteps, int lenSamples, unsigned char *binMat, int binMatRowBytes, int *nodePositions, int *cellWeights, int threads){
+    int firstRow = (simSteps < STEP) ? simSteps : STEP;
+    int rowNum = (simSteps > STEP) ? simSteps : STEP;
+    #pragma omp parallel num_threads(threads)
+    {
+        int *trajectory = malloc((long) rowNum*nodeNum * sizeof(int));
+        double *sums = calloc(nodeNum, sizeof(double));
+        struct Attractor attractor;
+        long row;
+        int cell;
+        int i;
+        int temp;
+        memcpy(trajectory + (long) firstRow*nodeNum, simData + (long) firstRow*nodeNum, (long) (STEP - firstRow)*nodeNum * sizeof(int));
+
+        #pragma omp for schedule(dynamic, 16)
+        for(cell=0; cell<lenSamples; cell++){
+            for(i=0; i<nodeNum; i++){
+                trajectory[i]=getBit(binMat, binMatRowBytes, nodePositions[i], cell);
+            }
+            // knocked out nodes are 0, other nodes follow the first input of their first term
+            simulateCell(trajectory, table, reduction, nodeNum, simSteps, &attractor);
+            if (attractor.second == attractor.first){continue;} // no state repeats within STEP rows, so there is no attractor to add
+            for(temp=attractor.first; temp<=attractor.second; temp++){
+                row = attractorRow(&attractor, temp);
+                for(i=0; i<nodeNum; i++){
+                    sums[i] = sums[i] + cellWeights[cell] * (double) (trajectory[row*nodeNum + i]/(attractor.second - attractor.first)); //this is the attractor
                 }
-                //if(knockins[0]){printf("%d ", simData[step][nodePos]);}
             }
         }
-        //if(knockins[0]){printf("\n");}
-        int ko_resSubmit[2]; //positions of attractor in trajectory
-        //printf("KNOCKOUT\n");
-        getAttract(simData, ko_resSubmit, nodePositions, nodeNum); //get positions of attractor in trajectory
-        //if (knockins[0]==1){printf("\nKI attractor:\n");printf("KI attractor loc: %i, %i\n", ko_resSubmit[0], ko_resSubmit[1]);}
-        for(temp=ko_resSubmit[0]; temp<=ko_resSubmit[1]; temp++){
-            //prepare attractor
-            //if (knockins[0]==1){printf("Temp: %d\n", temp);}
+        #pragma omp critical
+        {
             for(i=0; i<nodeNum; i++){
-                nodePos = nodePositions[i];
-                //if (knockins[0]==1){printf("%d ", simData[temp][nodePos]);}
-                attractorAverage_ko[i] = attractorAverage_ko[i] + (double) (simData[temp][nodePos]/(ko_resSubmit[1] - ko_resSubmit[0])); //this is the attractor
+                attractorAverage[i] = attractorAverage[i] + sums[i];
             }
-            //if (knockins[0]==1){printf("\n");}
         }
+        free(trajectory);
+        free(sums);
+    }
+}
 
+void importanceScore(int *simData, int *individual, int nodeNum, int *termOffsets, int *inputOffsets, int *inputs, int *inverts, int *settleOrder, int simSteps, int *knockouts, int *knockins, int lenSamples, unsigned char *binMat, int binMatRowBytes, int *nodePositions, double *importanceScores, int *cellWeights, int threads){
 
-        //average attractors - knock in
-        //for(i=0; i <nodeNum; i++){
-        //  temp = ki_resSubmit[1]- ki_resSubmit[0];
-        //  //if (temp > 1){
-        //  //  attractorAverage_ki[i] = attractorAverage_ki[i]/temp;
-        //  //} else {attractorAverage_ki[i] = attractorAverage_ki[i];}
-        //  attractorAverage_ki[i] = attractorAverage_ki[i]/temp;
-        //}
+    int i;
+    int cell;
+    double attractorAverage_ko[nodeNum];
+    double attractorAverage_ki[nodeNum];
+    double totalWeight = 0.0;
+    struct Reduction reduction;
+    struct RuleTable table;
+    importanceScores[0] = 0.0;
+    for(cell=0; cell<lenSamples; cell++){
+        totalWeight = totalWeight + cellWeights[cell];
+    }
+    for(i=0; i< nodeNum; i++){
+        attractorAverage_ko[i] = 0.0;
+        attractorAverage_ki[i] = 0.0;
     }
 
+    //KNOCK - OUTS
+    reduceNetwork(&reduction, nodeNum, individual, termOffsets, inputOffsets, inputs, settleOrder, knockouts, NULL, 1, simSteps);
+    buildRuleTable(&table, nodeNum, individual, termOffsets, inputOffsets, inputs, inverts, knockouts, NULL, 1);
+    addAttractors(attractorAverage_ko, &table, &reduction, simData, nodeNum, simSteps, lenSamples, binMat, binMatRowBytes, nodePositions, cellWeights, threads);
+    freeReduction(&reduction);
+    freeRuleTable(&table);
+
+    //KNOCK - INS; the knocked in nodes are set to 0 and their attractors are added to attractorAverage_ko as well
+    reduceNetwork(&reduction, nodeNum, individual, termOffsets, inputOffsets, inputs, settleOrder, knockins, NULL, 1, simSteps);
+    buildRuleTable(&table, nodeNum, individual, termOffsets, inputOffsets, inputs, inverts, knockins, NULL, 1);
+    addAttractors(attractorAverage_ko, &table, &reduction, simData, nodeNum, simSteps, lenSamples, binMat, binMatRowBytes, nodePositions, cellWeights, threads);
+    freeReduction(&reduction);
+    freeRuleTable(&table);
+
     //average attractors - knock in
     for(i=0; i <nodeNum; i++){
-        attractorAverage_ki[i] = attractorAverage_ki[i]/lenSamples;
+        attractorAverage_ki[i] = attractorAverage_ki[i]/totalWeight;
     }
 
-    //average attractors - knock in
+    //average attractors - knock out
     for(i=0; i <nodeNum; i++){
-        attractorAverage_ko[i] = attractorAverage_ko[i]/lenSamples;
+        attractorAverage_ko[i] = attractorAverage_ko[i]/totalWeight;
     }
 
     //Calculate importance score - difference between attractorAverage_ko and attractorAverage_ki
     for (i=0; i <nodeNum; i++){
-        //if (fabs(attractorAverage_ki[i] - attractorAverage_ko[i]) < lenSamples){
-        //  importanceScores[0] = importanceScores[0] + fabs(attractorAverage_ki[i] - attractorAverage_ko[i]);
-        //} else {
-        //  importanceScores[0] = importanceScores[0] + 0.0;
-        //}
         importanceScores[0] = importanceScores[0] + (fabs(attractorAverage_ki[i] - attractorAverage_ko[i]));
-        //printf("KO avg: %f, KI avg: %f, Difference: %f\n", attractorAverage_ko[i], attractorAverage_ki[i], (fabs(attractorAverage_ki[i] - attractorAverage_ko[i])));
     }
-    //average over number of cells
-    //importanceScores[0] = importanceScores[0]/lenSamples;
-    //printf("IS: %f\n########\n\n", importanceScores[0]);
 }
\ No newline at end of file
@@ -1,5 +1,7 @@
 from ruleMaker import *
 from keggParser import *
+from dataLoader import *
+from binarization import *
 import pickle
 import scipy.sparse as sparse
 from scipy.stats.stats import spearmanr
@@ -12,6 +14,7 @@ import seaborn as sns
 from ast import literal_eval
 import random
 import os
+import hashlib
 import scipy
 from statsmodels.stats.multitest import multipletests
 from pathlib import Path
@@ -27,79 +30,295 @@ class singleCell(ruleMaker):
         dataName,
         sep,
         maxNodes=15000,
-        #maxSamples=10000,
+        maxSamples=15000,
         binarizeThreshold=0.001,
         sampleCells=True,
+        chunkSize=1000,
+        processes=1,
+        cacheDir=None,
+        seed=None,
+        geneSubset=None,
+        cellMajor=False,
+        subpopFile=None,
+        subpopSep=",",
+        conditionsFile=None,
+        conditionsSep="\t",
+        minPerStratum=1,
+        binarizeMethod="global",
     ):
-        """Read in pre-processed data and binarize by threshold"""
-        self.sampleList = open(dataName).readline().rstrip()
-        self.sampleList = self.sampleList.split(sep)
-        self.sampleList = self.sampleList[1 : len(self.sampleList)]
-        if len(self.sampleList) >= 15000 or sampleCells:
-            maxSamples = 15000
+        """Read in pre-processed data and binarize by threshold. dataName is a matrix-style text file, a 10x Genomics output directory, an AnnData .h5ad file or a list of these, one per sample"""
+        if geneSubset is not None:
+            geneSubset = set(geneSubset)
+        multiSample = isinstance(dataName, (list, tuple))
+        stratified = subpopFile is not None or conditionsFile is not None or multiSample
+        if multiSample:
+            # cell IDs are prefixed with the sample ID, so barcodes that occur in several samples stay distinct
+            sampleIDs = [sampleName(name) for name in dataName]
+            self.sampleList = []
+            sampleLabels = []
+            sampleSizes = []
+            for name, sampleID in zip(dataName, sampleIDs):
+                cells = readCellNames(name, sep, cellMajor=cellMajor, threads=processes)
+                self.sampleList.extend([sampleID + "_" + cell for cell in cells])
+                sampleLabels.extend([sampleID] * len(cells))
+                sampleSizes.append(len(cells))
+            self.sampleInfo = dict(zip(self.sampleList, sampleLabels))
+        elif path.isdir(dataName):
+            cellMajor = False
+            self.sampleList = read10xBarcodes(dataName)
+        elif isHDF5(dataName):
+            cellMajor = False
+            self.sampleList = readH5adNames(dataName)[1]
+        elif cellMajor:
+            if stratified:
+                # the cell IDs are the first column; the expression values are not parsed here
+                self.sampleList = readGeneColumn(dataName, sep, threads=processes)
+        else:
+            self.sampleList = readHeader(dataName, sep)
+        strata = None
+        if subpopFile is not None:
+            self.__addSubpop(subpopFile, subpopSep)
+            strata = [self.subpopInfo.get(cell, "") for cell in self.sampleList]
+        elif conditionsFile is not None:
+            strata = readConditionStrata(conditionsFile, conditionsSep, self.sampleList)
+        elif multiSample:
+            # sample each participant in proportion to its number of cells, and use the samples as subpopulations
+            self.subpopInfo = self.sampleInfo
+            strata = sampleLabels
+        if cellMajor and not stratified:
+            # the number of cells is not known before the file is read, so the reservoir always holds maxSamples cells; smaller files are kept whole
+            print(["maxSamples: ", maxSamples])
+            sampledCellIndices = None
+        elif len(self.sampleList) >= maxSamples or sampleCells:
             print(["maxSamples: ", maxSamples])
-            sampledCellIndices = np.random.choice(
-                        range(1, len(self.sampleList) + 1),
+            if strata is None:
+                sampledCellIndices = np.sort(
+                    np.random.RandomState(seed).choice(
+                        len(self.sampleList),
                         replace=False,
                         size=min(maxSamples, len(self.sampleList)),
                     )
+                )
+            else:
+                sampledCellIndices = stratifiedSample(
+                    strata, maxSamples, seed=seed, minPerStratum=minPerStratum
+                )
+                print(
+                    "Strata: "
+                    + str(len(set(strata)))
+                    + ", smallest sampled stratum: "
+                    + str(
+                        min(np.unique(np.asarray(strata)[sampledCellIndices], return_counts=True)[1])
+                    )
+                    + " cells"
+                )
             print(["sampledCellIndices: ", len(sampledCellIndices)])
-            data = np.loadtxt(
-                dataName,
-                delimiter=sep,
-                dtype="str",
-                usecols=np.insert(sampledCellIndices,
-                    0,
-                    0.0,
-                    axis=0,
-                ),
-            )
-            self.geneList, self.sampleList, self.expMat = (
-                data[1:, 0],
-                data[0, 1:],
-                sparse.csr_matrix(data[1:, 1:].astype("float")),
-            )
-            print("Length: ", len(sampledCellIndices))
-            print("Shape: ", self.expMat.shape)
         else:
-            data = np.loadtxt(
-                dataName,
-                delimiter=sep,
-                dtype="str"
-            )
-            self.geneList, self.sampleList, self.expMat = (
-                data[1:, 0],
-                data[0, 1:],
-                sparse.csr_matrix(data[1:, 1:].astype("float")),
-            )
-        data = None
+            maxSamples = None
+            sampledCellIndices = None
+        if not isinstance(binarizeMethod, (list, tuple)):
+            binarizeMethod = [binarizeMethod]
+        binarizeMethod = [
+            binarizeMethodName(method, binarizeThreshold) for method in binarizeMethod
+        ]
+        self.cacheKey = None
+        cacheKeys = {}
+        cached = None
+        if cacheDir is not None:
+            if (cellMajor or sampledCellIndices is not None) and seed is None:
+                print("Cells are sampled without a seed, so the binarized matrix will not be cached.")
+            else:
+                for method in binarizeMethod:
+                    cacheKeys[method] = matrixCacheKey(
+                        dataName,
+                        binarizeThreshold,
+                        seed=seed,
+                        maxSamples=maxSamples,
+                        geneSubset=geneSubset,
+                        cellMajor=cellMajor,
+                        cellIndices=sampledCellIndices,
+                        binarizeMethod=method,
+                    )
+                self.cacheKey = cacheKeys[binarizeMethod[0]]
+                cached = {}
+                for method in binarizeMethod:
+                    entry = loadMatrixCache(cacheDir, cacheKeys[method])
+                    if entry is None:
+                        cached = None
+                        break
+                    cached[method] = entry
+        self.binarizations = {}
+        if cached is not None:
+            # the cached matrices are already binarized and sampled
+            print("Loading binarized matrix from cache: " + path.join(cacheDir, self.cacheKey))
+            self.geneList, self.sampleList, self.expMat = cached[binarizeMethod[0]]
+            if len(binarizeMethod) > 1:
+                self.binarizations = {method: cached[method][2] for method in binarizeMethod}
+        else:
+            # stream the file into a sparse matrix, keeping only the sampled cells
+            if multiSample:
+                sampleCellIndices = None
+                if sampledCellIndices is not None:
+                    ends = np.cumsum(sampleSizes)
+                    starts = ends - np.asarray(sampleSizes)
+                    sampleCellIndices = [
+                        sampledCellIndices[(sampledCellIndices >= start) & (sampledCellIndices < end)] - start
+                        for start, end in zip(starts, ends)
+                    ]
+                self.geneList, self.sampleList, self.expMat, sampleLabels = readSamples(
+                    dataName,
+                    sep,
+                    sampleIDs=sampleIDs,
+                    cellIndices=sampleCellIndices,
+                    cellMajor=cellMajor,
+                    chunkSize=chunkSize,
+                    processes=processes,
+                    geneSubset=geneSubset,
+                )
+            elif cellMajor:
+                self.geneList, self.sampleList, self.expMat = readCellMajorMatrix(
+                    dataName,
+                    sep,
+                    maxSamples=maxSamples,
+                    seed=seed,
+                    chunkSize=chunkSize,
+                    processes=processes,
+                    geneSubset=geneSubset,
+                    cellIndices=sampledCellIndices,
+                )
+            elif path.isdir(dataName):
+                self.geneList, self.sampleList, self.expMat = read10x(
+                    dataName, cellIndices=sampledCellIndices, geneSubset=geneSubset
+                )
+            elif isHDF5(dataName):
+                self.geneList, self.sampleList, self.expMat = readH5ad(
+                    dataName, cellIndices=sampledCellIndices, geneSubset=geneSubset
+                )
+            else:
+                self.geneList, self.sampleList, self.expMat = readExpressionMatrix(
+                    dataName,
+                    sep,
+                    cellIndices=sampledCellIndices,
+                    chunkSize=chunkSize,
+                    processes=processes,
+                    geneSubset=geneSubset,
+                )
+            self.expMat.eliminate_zeros()
+            if binarizeMethod == [binarizeMethodName("global", binarizeThreshold)]:
+                # a single global cutoff is applied in place
+                preprocessing.binarize(self.expMat, threshold=binarizeThreshold, copy=False)
+                binarized = {binarizeMethod[0]: self.expMat}
+            else:
+                binarized = {
+                    method: binarizeMatrix(self.expMat, method, binarizeThreshold)
+                    for method in binarizeMethod
+                }
+                self.expMat = binarized[binarizeMethod[0]]
+                if len(binarizeMethod) > 1:
+                    self.binarizations = binarized
+            for method in cacheKeys:
+                saveMatrixCache(
+                    cacheDir, cacheKeys[method], self.geneList, self.sampleList, binarized[method]
+                )
+        print("Shape: ", self.expMat.shape)
         self.geneList = list(self.geneList)
         self.sampleList = list(self.sampleList)
+        self.__indexLists()
         print("Genelist: " + str(len(self.geneList)) + " genes" + " First 5 genes: " + str(self.geneList[0:4]))
-        self.expMat.eliminate_zeros()
-        self.binMat = preprocessing.binarize(
-            self.expMat, threshold=binarizeThreshold, copy=False
-        )
         self.binMat = (
             None  # sparse.csr_matrix(self.binMat[1:, sampledCellIndices].astype("int"))
         )
+        self.cacheDir = cacheDir
+        self.matrixCache = {}
         self.maxNodes = maxNodes
-        self.maxSamples = 15000 #maxSamples
-        # populate binMat to a predefined size
-        # self.binMat.resize(self.maxNodes, 1000)
+        # rule structure used for every network; see ruleMaker.__init__
+        self.maxIncomingEdges = 3
+        self.maxTermInputs = 3
+        # OpenMP threads used by the simulator for each evaluation
+        self.threads = 1
+        # number of cells kept; matrices are not padded to a fixed size
+        self.maxSamples = len(self.sampleList)
         self.pathwayGraphs = {}
 
-    def __sampleCells(self, data, number_cells):
-        """Sample a representative population of cells for rule inference - reduce memory requirements"""
-        combined = np.apply_along_axis(
-            lambda x: "".join(str(x)), axis=0, arr=data[1:, 1:]
+    def __getstate__(self):
+        """Matrices backed by the on-disk cache are not pickled"""
+        state = self.__dict__.copy()
+        for attribute in getattr(self, "matrixCache", {}):
+            state[attribute] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "geneIndex" not in state:
+            # objects pickled before the index maps were added
+            self.__indexLists()
+        # objects pickled before the rule structure could be set
+        self.__dict__.setdefault("maxIncomingEdges", 3)
+        self.__dict__.setdefault("maxTermInputs", 3)
+        self.__dict__.setdefault("threads", 1)
+        for attribute, directory in getattr(self, "matrixCache", {}).items():
+            setattr(self, attribute, loadMatrix(directory))
+
+    def __indexLists(self):
+        """Build the name -> position maps geneIndex and sampleIndex"""
+        self.geneIndex = {}
+        for i in range(0, len(self.geneList)):
+            # keep the first occurrence, as list.index does
+            self.geneIndex.setdefault(self.geneList[i], i)
+        self.sampleIndex = {}
+        for i in range(0, len(self.sampleList)):
+            self.sampleIndex.setdefault(self.sampleList[i], i)
+
+    def __cacheMatrices(self, attributes):
+        """Move the given matrix attributes to the on-disk cache and memory-map them"""
+        if getattr(self, "cacheKey", None) is None:
+            return
+        subsetKey = hashlib.sha256(
+            "|".join(
+                ["\n".join(self.geneList), str(self.maxNodes), str(self.maxSamples)]
+            ).encode("utf-8")
+        ).hexdigest()
+        for attribute in attributes:
+            directory = path.abspath(
+                path.join(self.cacheDir, self.cacheKey, "subset_" + subsetKey, attribute)
+            )
+            matrix = getattr(self, attribute)
+            atomicWrite(directory, lambda tempDir: saveMatrix(tempDir, matrix))
+            self.matrixCache[attribute] = directory
+            setattr(self, attribute, loadMatrix(directory))
+
+    def __cacheCorrelations(self, directory):
+        """Compute the correlations between the rows of binMat and memory-map them"""
+        if getattr(self, "cacheKey", None) is not None:
+            self.correlations = self.binMat.correlationMatrix()
+            self.__cacheMatrices(["correlations"])
+            return
+        # entries are keyed by the binarized data, so runs on other genes or cells never reuse or remove each other's
+        digest = hashlib.sha256(np.ascontiguousarray(self.binMat.packed).tobytes())
+        digest.update(repr(self.binMat.shape).encode("utf-8"))
+        directory = path.abspath(path.join(directory, digest.hexdigest()))
+        atomicWrite(
+            directory, lambda tempDir: saveMatrix(tempDir, self.binMat.correlationMatrix())
         )
-        combined_weights = np.unique(combined, return_counts=True)[1] / len(combined)
-        sampled_cells = np.random.choice(
-            range(len(combined_weights)), size=number_cells, p=combined_weights
+        self.matrixCache["correlations"] = directory
+        self.correlations = loadMatrix(directory)
+
+    def __storeHDF5(self, attributes, fileName):
+        """Write the given matrix attributes to an HDF5 file and read them back lazily"""
+        saveHDF5(fileName, {attribute: getattr(self, attribute) for attribute in attributes})
+        self.hdf5File = path.abspath(fileName)
+        for attribute in attributes:
+            setattr(self, attribute, loadHDF5(fileName, attribute))
+
+    def __writeSampleTables(self, subpopFile, conditionsFile, conditionsSep="\t"):
+        """Write the sample of each cell as a subpopulation file and a conditions table"""
+        writeSampleTables(
+            subpopFile,
+            conditionsFile,
+            self.sampleList,
+            [self.sampleInfo[cell] for cell in self.sampleList],
+            conditionsSep=conditionsSep,
         )
-        sampled_cells = np.delete(sampled_cells, np.where(sampled_cells == 0))
-        return sampled_cells
 
     def __addSubpop(self, subpopFile, sep):
         """Add subpopulation information to object"""
@@ -130,10 +349,25 @@ class singleCell(ruleMaker):
         """Filter data based on CV cutoffs"""
         self.cvGenes = []
         if threshold is not None:
-            for i in range(0, self.expMat.get_shape()[0]):
-                rowData = list(self.expMat.getrow(i).todense())
-                if np.std(rowData) / np.mean(rowData) >= threshold:
-                    self.cvGenes.append(self.geneList[i])
+            if isinstance(threshold, (list, tuple, np.ndarray)):
+                thresholds = list(threshold)
+            else:
+                thresholds = [threshold]
+            cv = rowCV(self.expMat)
+            geneArray = np.array(self.geneList, dtype=object)
+            self.cvGenesByThreshold = {}
+            for cutoff in thresholds:
+                # genes with a mean of 0 have a cv of nan and are dropped
+                with np.errstate(invalid="ignore"):
+                    self.cvGenesByThreshold[cutoff] = list(geneArray[cv >= cutoff])
+                print(
+                    "CV >= "
+                    + str(cutoff)
+                    + ": "
+                    + str(len(self.cvGenesByThreshold[cutoff]))
+                    + " genes"
+                )
+            self.cvGenes = self.cvGenesByThreshold[thresholds[0]]
         else:
             self.cvGenes = copy.deepcopy(self.geneList)
 
@@ -419,18 +653,12 @@ class singleCell(ruleMaker):
         nodes = list(graph)
         numberNodes = len(nodes)
 
-        geneIndex = []
-        for g in self.geneList:
-            if g in nodes:
-                i = self.geneList.index(g)
-                geneIndex.append(i)
+        nodes = set(nodes)
+        geneIndex = [self.geneIndex[g] for g in self.geneList if g in nodes]
 
         # print(geneIndex)
 
-        for j in range(0, numberCells):
-            temp = self.binMat[geneIndex, j].todense().tolist()
-            temp = [y for x in temp for y in x]
-            newInitValueList.append(temp)
+        newInitValueList = self.binMat.getRows(geneIndex, numberCells).T.tolist()
 
         # print(len(newInitValueList))
 
@@ -447,7 +675,7 @@ class singleCell(ruleMaker):
 
         net = nx.read_graphml(graph)
         netGenes = [
-            self.geneList.index(gene) for gene in list(net) if gene in self.geneList
+            self.geneIndex[gene] for gene in list(net) if gene in self.geneIndex
         ]
         print(netGenes)
         updateBooler = ctypes.cdll.LoadLibrary("./simulator.so")
@@ -457,10 +685,11 @@ class singleCell(ruleMaker):
             net,
             removeSelfEdges=False,
             restrictIncomingEdges=True,
-            maxIncomingEdges=3,
+            maxIncomingEdges=self.maxIncomingEdges,
             groundTruth=False,
+            maxTermInputs=self.maxTermInputs,
+            modelFile=graph + "_model.pickle",
         )
-        self._ruleMaker__updateCpointers()
         self.__setupEmptyKOKI()
 
         # Genetic algorithm
@@ -548,11 +777,9 @@ class singleCell(ruleMaker):
             print("***Node: " + str(node) + "***")
             print("RA: " + str(RAs[node]))
             print("IS: " + str(pathImportances[node]))
-            nodeData = (
-                self.binMat[self.geneList.index(node), range(0, len(self.sampleList))]
-                .todense()
-                .tolist()
-            )
+            nodeData = self.binMat.getRow(self.geneIndex[node])[
+                0 : len(self.sampleList)
+            ]
             # score+=abs(float(RAs[node]))*math.log(float(pathImportances[node]),2) #*CVdict[node]
             # score+=abs(float(RAs[node]))*float(pathImportances[node])
             CVdict[node] = np.std(nodeData)
@@ -640,7 +867,6 @@ class singleCell(ruleMaker):
         """
         if pathwayList is None:
             pathwayList = list(self.pathwayGraphs.keys())
-        self.binMat2 = self.binMat.A
         self.expMat2 = self.expMat.A
         pvalDict = {}
         overallUpreg = {}
@@ -665,12 +891,12 @@ class singleCell(ruleMaker):
                 conditions.index[conditions.loc[:, contrasts[1]] == 1]
             )
             index_condition1 = [
-                self.sampleList.index(i)
-                for i in set(cells_condition1).intersection(set(self.sampleList))
+                self.sampleIndex[i]
+                for i in set(cells_condition1).intersection(self.sampleIndex)
             ]
             index_condition2 = [
-                self.sampleList.index(i)
-                for i in set(cells_condition2).intersection(set(self.sampleList))
+                self.sampleIndex[i]
+                for i in set(cells_condition2).intersection(self.sampleIndex)
             ]
             # make RA - in the case of single cell experiments, find the proportion of cells in which the gene is expressed
             # for pathname in list(self.pathwayGraphs.keys()):
@@ -721,7 +947,7 @@ class singleCell(ruleMaker):
                         nodeScoresDF[str(contrasts[0])] = np.nan
                         nodeScoresDF[str(contrasts[1])] = np.nan
                         for node in list(nodeScoresDF.index):
-                            node_index = self.geneList.index(node)
+                            node_index = self.geneIndex[node]
                             expression_condition1[node] = np.mean(
                                 self.expMat2[node_index, index_condition1].tolist()
                             )
@@ -842,7 +1068,7 @@ class singleCell(ruleMaker):
                 multipletests(list(pvalDF.loc[:, "P value"]), method="bonferroni")[1]
             )
             pvalDF.to_csv("pvalues_" + "_vs_".join(contrasts) + ".csv", index=False)
-        del self.binMat2
+        del self.expMat2
 
     def __inherit(
         self,
@@ -852,6 +1078,9 @@ class singleCell(ruleMaker):
         maxIncomingEdges=3,
         groundTruth=False,
         graphName="",
+        maxTermInputs=3,
+        modelFile=None,
+        requireStructure=False,
     ):
         super().__init__(
             graph,
@@ -860,6 +1089,9 @@ class singleCell(ruleMaker):
             maxIncomingEdges,
             groundTruth,
             graphName,
+            maxTermInputs,
+            modelFile,
+            requireStructure,
         )
 
     def __getPathwayName(self, hsaURL):
@@ -932,7 +1164,7 @@ class singleCell(ruleMaker):
         nodeEnd,
     ):
         indindex = nodeStart
-        orset = [np.nan for i in range(self.maxNodes)]
+        orset = [np.nan for i in range(max(self.maxNodes, nodeEnd - nodeStart))]
         counter = 0
         while indindex < nodeEnd:
             andindex = indindex - nodeStart
@@ -1113,11 +1345,12 @@ class singleCell(ruleMaker):
                     net,
                     removeSelfEdges=False,
                     restrictIncomingEdges=True,
-                    maxIncomingEdges=3,
+                    maxIncomingEdges=self.maxIncomingEdges,
                     groundTruth=False,
+                    maxTermInputs=self.maxTermInputs,
+                    modelFile=pathway + "_model.pickle",
                 )
                 self.__setupEmptyKOKI()
-                self._ruleMaker__updateCpointers()
                 KOlist = []  # knocked-out genes
                 KIlist = []  # knocked-in genes
                 attractorList = []
@@ -1154,12 +1387,9 @@ class singleCell(ruleMaker):
                 andLenList = np.array(self.andLenList, dtype=np.intc, order="C")
                 nodePositions1 = self.nodePositions
                 nodePositionsC = np.array(nodePositions1, dtype=np.intc, order="C")
-                binMatC3 = np.array(
-                    copy.deepcopy(self.binMat.toarray(order="C")),
-                    order="C",
-                    dtype=np.intc,
-                )
-                for sampleIndex in range(0, len(self.sampleList)):
+                # simulate each unique cell state once; rows of binMatC3 are the nodes in nodeList order
+                binMatC3 = self.cellStates.T
+                for sampleIndex in range(0, len(self.cellWeights)):
                     vals = np.full(
                         shape=(simSteps, nodeNum),
                         fill_value=0,
@@ -1184,7 +1414,7 @@ class singleCell(ruleMaker):
                         knockouts,
                         knockins,
                         binMatC3,
-                        self.nodePositions,
+                        list(range(nodeNum)),
                     )
                     attractor = []
                     for temp in range(res[0], res[1] + 1):
@@ -1207,26 +1437,21 @@ class singleCell(ruleMaker):
                     ]
                 attractorList = tuple(attractorList)
                 # Calculate new Distance between chosen attractors and cells
-                newdistanceDict = {}
-                for i in range(0, len(self.sampleList)):
-                    cell = str(self.sampleList[i])
-                    # get value of cell
-                    cellInitValue = self.binMat[:, i]
-                    cellInitValue = cellInitValue.toarray()
-                    cellInitValue = cellInitValue.tolist()
-                    cellInitValue = [
-                        cellInitValue[temp] for temp in list(nodePositions1)
-                    ]
-                    # set up data structure to store Hamming distance to attractors
-                    newdistanceDict[cell] = []
-                    for attr in attractorList:
-                        newdistanceDict[cell].append(
-                            sum(
-                                [abs(i1 - i2[0]) for i1, i2 in zip(attr, cellInitValue)]
-                            )
-                        )
-                # Change table to a pandas dataframe for easy readability and plotting
-                distanceDF = pd.DataFrame.from_dict(newdistanceDict, orient="index")
+                # Hamming distances are computed once per unique cell state and then expanded to the cells sharing that state
+                attractorArray = np.array(attractorList, dtype=np.intc).reshape(
+                    len(attractorList), nodeNum
+                )
+                # for 0/1 vectors, the Hamming distance counts the 1s of one that are 0 in the other, and the reverse
+                cellStates = self.cellStates.astype(np.float64)
+                attractorArray = attractorArray.astype(np.float64)
+                stateDistances = (
+                    cellStates.dot(1 - attractorArray.T)
+                    + (1 - cellStates).dot(attractorArray.T)
+                ).astype(np.intc)
+                distanceDF = pd.DataFrame(
+                    stateDistances[self.cellStateIndex, :],
+                    index=[str(cell) for cell in self.sampleList],
+                )
                 distanceDF.columns = [str(attr) for attr in attractorList]
                 enumerateDict[pathway] = str(len(attractorList))
                 # distanceDF['decider'] = [
@@ -1668,8 +1893,14 @@ class singleCell(ruleMaker):
             errorsName = glob.glob(str(graphName) + "*_localErrors1.pickle")[0]
             localErrors = pickle.load(open(errorsName, "rb"))
 
+            # the same rule structure as in rule inference, so that the equivalent rules line up
             self._singleCell__inherit(
-                graph, removeSelfEdges=False, restrictIncomingEdges=False
+                graph,
+                removeSelfEdges=False,
+                restrictIncomingEdges=True,
+                maxIncomingEdges=self.maxIncomingEdges,
+                maxTermInputs=self.maxTermInputs,
+                modelFile=graphName + "_processed.graphml_model.pickle",
             )
             equivs = pickle.load(
                 open(graphName + "_processed.graphml_equivs1.pickle", "rb")
@@ -1692,7 +1923,7 @@ class singleCell(ruleMaker):
                 for rule in ers:
                     plainRules.append(
                         self._ruleMaker__writeNode(
-                            self.nodeList.index(self.nodeList[node]), rule, self
+                            self.nodeDict[self.nodeList[node]], rule, self
                         )
                     )
                 plainEquivs[nodeList[node]] = set(plainRules)
@@ -0,0 +1,78 @@
+import bz2
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+# fixtures shared by the tests: temporary input files, random data and comparisons with dense references
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scBONITA")
+sys.path.insert(0, SOURCE)
+
+
+def randomExpression(randomState, numGenes, numCells, density=0.3):
+    """Sparse-looking genes * cells expression table with gene names as index and cell IDs as columns"""
+    values = randomState.rand(numGenes, numCells) * 10
+    values[randomState.rand(numGenes, numCells) > density] = 0
+    return pd.DataFrame(
+        values.round(3),
+        index=["gene" + str(i) for i in range(0, numGenes)],
+        columns=["cell" + str(i) for i in range(0, numCells)],
+    )
+
+
+class FileTestCase(unittest.TestCase):
+
+    """Test case with a temporary directory for input files, removed after each test"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def tempPath(self, name):
+        return os.path.join(self.directory, name)
+
+    def writeTable(self, name, table, sep=","):
+        """Write a genes * cells table as a matrix-style file"""
+        fileName = self.tempPath(name)
+        table.to_csv(fileName, sep=sep)
+        return fileName
+
+    def compress(self, fileName, codec):
+        """Compressed copy of fileName with gzip, bz2 or zstd; the test is skipped if zstd is not available"""
+        with open(fileName, "rb") as f:
+            data = f.read()
+        if codec == "gzip":
+            with gzip.open(fileName + ".gz", "wb") as f:
+                f.write(data)
+            return fileName + ".gz"
+        if codec == "bz2":
+            with bz2.open(fileName + ".bz2", "wb") as f:
+                f.write(data)
+            return fileName + ".bz2"
+        try:
+            import zstandard
+        except ImportError:
+            if shutil.which("zstd") is None:
+                self.skipTest("zstandard compression needs the zstandard package or the zstd program")
+            subprocess.check_call(["zstd", "-q", fileName, "-o", fileName + ".zst"])
+            return fileName + ".zst"
+        with open(fileName + ".zst", "wb") as f:
+            f.write(zstandard.ZstdCompressor().compress(data))
+        return fileName + ".zst"
+
+    def assertSameTable(self, result, reference):
+        """geneList, sampleList and CSR expMat of a reader equal to a genes * cells table"""
+        geneList, sampleList, expMat = result
+        self.assertEqual(geneList, list(reference.index))
+        self.assertEqual(sampleList, list(reference.columns))
+        self.assertTrue(sparse.isspmatrix_csr(expMat))
+        np.testing.assert_array_equal(expMat.toarray(), reference.values)
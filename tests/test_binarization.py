@@ -0,0 +1,94 @@
+import unittest
+
+import numpy as np
+import scipy.sparse as sparse
+
+from fixtures import randomExpression
+from binarization import *
+
+
+def randomSparse(randomState, numRows, numColumns, negative=False):
+    """Dense array and CSR copy of a random expression matrix, with an all-zero row and a constant row"""
+    dense = randomExpression(randomState, numRows, numColumns).to_numpy(copy=True)
+    if negative:
+        dense = np.where(dense != 0, dense - 3, 0)
+    dense[0, :] = 0
+    dense[1, :] = dense[1, 0]
+    return dense, sparse.csr_matrix(dense)
+
+
+def denseKmeans(row, maxIterations=100):
+    """Reference k-means threshold of one row, started from its minimum and maximum"""
+    low, high = row.min(), row.max()
+    for iteration in range(0, maxIterations):
+        above = row > (low + high) / 2
+        newLow = row[~above].mean() if (~above).any() else low
+        newHigh = row[above].mean() if above.any() else high
+        if np.allclose(newLow, low) and np.allclose(newHigh, high):
+            break
+        low, high = newLow, newHigh
+    return (low + high) / 2
+
+
+class TestBinarization(unittest.TestCase):
+    def test_rowQuantiles(self):
+        randomState = np.random.RandomState(0)
+        for negative in [False, True]:
+            for numColumns in [1, 2, 17, 50]:
+                dense, matrix = randomSparse(randomState, 12, numColumns, negative=negative)
+                for quantile in [0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.999, 1]:
+                    with self.subTest(negative=negative, numColumns=numColumns, quantile=quantile):
+                        np.testing.assert_allclose(
+                            rowQuantiles(matrix, quantile),
+                            np.quantile(dense, quantile, axis=1),
+                        )
+
+    def test_kmeansThresholds(self):
+        randomState = np.random.RandomState(1)
+        for negative in [False, True]:
+            dense, matrix = randomSparse(randomState, 20, 40, negative=negative)
+            np.testing.assert_allclose(
+                kmeansThresholds(matrix), [denseKmeans(row) for row in dense]
+            )
+
+    def test_mixtureThresholds(self):
+        randomState = np.random.RandomState(2)
+        bimodal = np.concatenate(
+            [randomState.normal(1, 0.2, 60), randomState.normal(8, 0.5, 40), np.zeros(30)]
+        )
+        dense = np.stack([bimodal, np.zeros(130), np.full(130, 2.0)])
+        thresholds = mixtureThresholds(sparse.csr_matrix(dense))
+        self.assertTrue(2 < thresholds[0] < 7)
+        # a row with a single mode gets its value as the threshold
+        np.testing.assert_allclose(thresholds[1:], [0, 2])
+
+    def test_binarizeMatrix(self):
+        randomState = np.random.RandomState(3)
+        dense, matrix = randomSparse(randomState, 15, 30)
+        for method, thresholds in [
+            ("global", np.full(15, 0.001)),
+            ("global:4.5", np.full(15, 4.5)),
+            ("quantile:0.8", np.quantile(dense, 0.8, axis=1)),
+            ("kmeans", [denseKmeans(row) for row in dense]),
+        ]:
+            with self.subTest(method=method):
+                binMat = binarizeMatrix(matrix, method)
+                self.assertTrue(sparse.isspmatrix_csr(binMat))
+                np.testing.assert_array_equal(
+                    binMat.toarray(),
+                    dense > np.maximum(np.asarray(thresholds), 0)[:, None],
+                )
+
+    def test_parseBinarizeMethod(self):
+        self.assertEqual(parseBinarizeMethod("global"), ("global", 0.001))
+        self.assertEqual(parseBinarizeMethod("global", 0.5), ("global", 0.5))
+        self.assertEqual(parseBinarizeMethod("quantile"), ("quantile", 0.5))
+        self.assertEqual(parseBinarizeMethod("quantile:0.75"), ("quantile", 0.75))
+        self.assertEqual(parseBinarizeMethod("kmeans:20"), ("kmeans", 20))
+        self.assertEqual(binarizeMethodName("mixture"), "mixture:100")
+        with self.assertRaises(ValueError):
+            parseBinarizeMethod("otsu")
+
+
+if __name__ == "__main__":
+    unittest.main()
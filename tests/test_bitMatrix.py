@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from fixtures import FileTestCase
+from bitMatrix import *
+from dataLoader import loadMatrix, saveMatrix
+
+
+def rankPredecessors(correlations, predecessors, inputLimit=3):
+    """Top predecessors by absolute correlation, ordered as in ruleMaker"""
+    values = [0 if np.isnan(value) else value for value in np.abs(correlations).tolist()]
+    return [
+        pred[0]
+        for pred in sorted(zip(predecessors, values), reverse=True, key=lambda corrs: corrs[1])[
+            :inputLimit
+        ]
+    ]
+
+
+class TestCorrelations(FileTestCase):
+    def setUp(self):
+        super().setUp()
+        randomState = np.random.RandomState(0)
+        # few cells, so many pairs of genes have equal or nearly equal correlations
+        dense = randomState.rand(60, 23) < randomState.rand(60, 1)
+        dense[0, :] = 0  # constant genes have no correlation
+        dense[1, :] = 1
+        self.dense = dense
+        self.binMat = bitMatrix.fromDense(dense)
+
+    def test_pairCorrelations(self):
+        rowsA, rowsB = np.meshgrid(np.arange(60), np.arange(60), indexing="ij")
+        pairs = self.binMat.pairCorrelations(rowsA.ravel(), rowsB.ravel())
+        matrix = self.binMat.correlationMatrix(chunkColumns=8, chunkRows=7)
+        self.assertEqual(pairs.dtype, np.float32)
+        self.assertEqual(matrix.dtype, np.float32)
+        np.testing.assert_array_equal(pairs.reshape(60, 60), matrix)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            expected = np.corrcoef(self.dense.astype(float))
+        np.testing.assert_allclose(matrix[2:, 2:], expected[2:, 2:], rtol=1e-5, atol=1e-6)
+        self.assertTrue(np.isnan(matrix[0:2, :]).all())
+
+    def test_same_predecessor_choice(self):
+        # the predecessors ruleMaker keeps do not depend on whether the correlations came from the cache. Genes 1 and 2 correlate with gene 0 equally in float32, but gene 2 by one ulp more in float64
+        dense = np.zeros((3, 200), dtype=np.uint8)
+        dense[0, 0:100] = 1
+        dense[1, 0:40] = 1
+        dense[1, 100:150] = 1
+        dense[2, 100:102] = 1
+        binMat = bitMatrix.fromDense(dense)
+        saveMatrix(self.tempPath("correlations"), binMat.correlationMatrix())
+        cached = loadMatrix(self.tempPath("correlations"))
+        predecessors = [1, 2]
+        for inputLimit in [1, 2]:
+            self.assertEqual(
+                rankPredecessors(
+                    binMat.pairCorrelations([0, 0], predecessors), predecessors, inputLimit
+                ),
+                rankPredecessors(np.asarray(cached[[0, 0], predecessors]), predecessors, inputLimit),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
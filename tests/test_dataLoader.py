@@ -0,0 +1,219 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from fixtures import FileTestCase, randomExpression
+from dataLoader import *
+
+
+class TestReaders(FileTestCase):
+    def setUp(self):
+        super().setUp()
+        self.table = randomExpression(np.random.RandomState(0), 40, 25)
+
+    def test_readExpressionMatrix(self):
+        fileName = self.writeTable("data.csv", self.table)
+        reference = pd.read_csv(fileName, index_col=0)
+        for chunkSize in [1, 7, 1000]:
+            for processes in [1, 2]:
+                self.assertSameTable(
+                    readExpressionMatrix(
+                        fileName, ",", chunkSize=chunkSize, processes=processes
+                    ),
+                    reference,
+                )
+
+    def test_readExpressionMatrix_subsets(self):
+        fileName = self.writeTable("data.tsv", self.table, sep="\t")
+        reference = pd.read_csv(fileName, sep="\t", index_col=0)
+        cellIndices = [20, 3, 4, 11]
+        geneSubset = {"gene2", "gene39", "gene17", "missing"}
+        self.assertSameTable(
+            readExpressionMatrix(
+                fileName, "\t", cellIndices=cellIndices, geneSubset=geneSubset, chunkSize=5
+            ),
+            reference.loc[
+                [gene for gene in reference.index if gene in geneSubset],
+                reference.columns[cellIndices],
+            ],
+        )
+
+    def write10x(self, name, table, compress=False, featureFile="genes.tsv"):
+        directory = self.tempPath(name)
+        os.makedirs(directory)
+        files = {
+            "matrix.mtx": lambda f: scipy.io.mmwrite(f, sparse.coo_matrix(table.values)),
+            "barcodes.tsv": lambda f: f.write(
+                "".join(cell + "\n" for cell in table.columns).encode("utf-8")
+            ),
+            featureFile: lambda f: f.write(
+                "".join(
+                    "ENSG" + str(i) + "\t" + gene + "\tGene Expression\n"
+                    for i, gene in enumerate(table.index)
+                ).encode("utf-8")
+            ),
+        }
+        for fileName, writer in files.items():
+            if compress:
+                with gzip.open(os.path.join(directory, fileName + ".gz"), "wb") as f:
+                    writer(f)
+            else:
+                with open(os.path.join(directory, fileName), "wb") as f:
+                    writer(f)
+        return directory
+
+    def test_read10x(self):
+        for compress, featureFile in [(False, "genes.tsv"), (True, "features.tsv")]:
+            directory = self.write10x(
+                "10x_" + featureFile, self.table, compress=compress, featureFile=featureFile
+            )
+            self.assertSameTable(read10x(directory), self.table)
+            self.assertSameTable(readMatrix(directory, ","), self.table)
+            self.assertEqual(readGeneNames(directory, ","), list(self.table.index))
+            self.assertEqual(readCellNames(directory, ","), list(self.table.columns))
+
+    def test_read10x_subsets(self):
+        directory = self.write10x("10x", self.table)
+        cellIndices = [9, 0, 24]
+        geneSubset = {"gene5", "gene6", "gene33"}
+        self.assertSameTable(
+            read10x(directory, cellIndices=cellIndices, geneSubset=geneSubset),
+            self.table.loc[
+                [gene for gene in self.table.index if gene in geneSubset],
+                self.table.columns[cellIndices],
+            ],
+        )
+
+    def writeCellMajor(self, name, table, blankLines=False):
+        fileName = self.tempPath(name)
+        cells = table.T
+        with open(fileName, "w") as f:
+            f.write("cell," + ",".join(cells.columns) + "\n")
+            for cell, row in cells.iterrows():
+                f.write(cell + "," + ",".join(str(value) for value in row) + "\n")
+                if blankLines:
+                    f.write("\n")
+        return fileName
+
+    def test_readCellMajorMatrix(self):
+        fileName = self.writeCellMajor("cells.csv", self.table)
+        self.assertSameTable(readCellMajorMatrix(fileName, ","), self.table)
+        cellIndices = [7, 1, 18]
+        self.assertSameTable(
+            readCellMajorMatrix(fileName, ",", cellIndices=cellIndices),
+            self.table.iloc[:, cellIndices],
+        )
+
+    def test_reservoir_sample(self):
+        for blankLines in [False, True]:
+            fileName = self.writeCellMajor(
+                "cells" + str(blankLines) + ".csv", self.table, blankLines=blankLines
+            )
+            geneList, sampleList, expMat = readCellMajorMatrix(
+                fileName, ",", maxSamples=10, seed=3
+            )
+            # blank lines are not drawn, so the sample is full
+            self.assertEqual(len(sampleList), 10)
+            self.assertEqual(len(set(sampleList)), 10)
+            self.assertSameTable((geneList, sampleList, expMat), self.table.loc[:, sampleList])
+            self.assertEqual(
+                readCellMajorMatrix(fileName, ",", maxSamples=10, seed=3)[1], sampleList
+            )
+        self.assertEqual(
+            readCellMajorMatrix(fileName, ",", maxSamples=100)[1], list(self.table.columns)
+        )
+
+    def test_compressed_input(self):
+        fileName = self.writeTable("data.csv", self.table)
+        for codec in ["gzip", "bz2", "zstd"]:
+            with self.subTest(codec=codec):
+                compressed = self.compress(fileName, codec)
+                self.assertEqual(compressionFormat(compressed), codec)
+                for processes in [1, 2]:
+                    self.assertSameTable(
+                        readExpressionMatrix(compressed, ",", chunkSize=6, processes=processes),
+                        self.table,
+                    )
+                    with openData(compressed, threads=processes) as dataFile:
+                        self.assertEqual(dataFile.read(), open(fileName).read())
+        self.assertIsNone(compressionFormat(fileName))
+
+    def test_decompressorCommand(self):
+        installed = {"pigz", "gzip", "pbzip2"}
+        with mock.patch("shutil.which", lambda name: name if name in installed else None):
+            self.assertEqual(decompressorCommand("gzip", 4), ["pigz", "-dc", "-p", "4"])
+            self.assertEqual(decompressorCommand("bz2", 3), ["pbzip2", "-dc", "-p3"])
+            self.assertIsNone(decompressorCommand("zstd", 2))
+            installed.remove("pigz")
+            self.assertEqual(decompressorCommand("gzip", 4), ["gzip", "-dc"])
+
+    def test_close_compressed_stream_early(self):
+        # the external decompressor is stopped without an error when only the header is read
+        fileName = self.writeTable(
+            "large.csv", randomExpression(np.random.RandomState(1), 3000, 60)
+        )
+        for codec in ["gzip", "zstd"]:
+            with self.subTest(codec=codec):
+                compressed = self.compress(fileName, codec)
+                with openData(compressed, threads=2) as dataFile:
+                    header = dataFile.readline()
+                self.assertEqual(header, open(fileName).readline())
+
+    def test_readSamples(self):
+        # samples with overlapping and reordered genes, one of them compressed
+        randomState = np.random.RandomState(2)
+        tables = [
+            randomExpression(randomState, 30, 8),
+            randomExpression(randomState, 40, 5).iloc[::-1],
+            randomExpression(randomState, 35, 6).iloc[5:],
+        ]
+        dataNames = [
+            self.writeTable("first.csv", tables[0]),
+            self.compress(self.writeTable("second.csv", tables[1]), "gzip"),
+            self.writeCellMajor("third.csv", tables[2]),
+        ]
+        self.assertEqual(sampleName(dataNames[1]), "second")
+        for geneJoin, join in [("union", "outer"), ("intersection", "inner")]:
+            # genes in order of first appearance, as in mergeSamples
+            reference = pd.concat(
+                [
+                    table.rename(columns=lambda cell: sampleID + "_" + cell)
+                    for sampleID, table in zip(["first", "second"], tables)
+                ],
+                axis=1,
+                join=join,
+                sort=False,
+            ).fillna(0)
+            for processes in [1, 2]:
+                with self.subTest(geneJoin=geneJoin, processes=processes):
+                    geneList, sampleList, expMat, labels = readSamples(
+                        dataNames[0:2], ",", processes=processes, geneJoin=geneJoin
+                    )
+                    self.assertSameTable((geneList, sampleList, expMat), reference)
+                    self.assertEqual(labels, ["first"] * 8 + ["second"] * 5)
+        geneList, sampleList, expMat, labels = readSamples(
+            [dataNames[2]], ",", sampleIDs=["s3"], cellMajor=True, cellIndices=[[4, 0]]
+        )
+        self.assertSameTable(
+            (geneList, sampleList, expMat),
+            tables[2].iloc[:, [4, 0]].rename(columns=lambda cell: "s3_" + cell),
+        )
+        self.assertEqual(labels, ["s3", "s3"])
+        with self.assertRaises(ValueError):
+            readSamples(dataNames[0:2], ",", sampleIDs=["a", "a"])
+        with self.assertRaises(ValueError):
+            mergeSamples([], geneJoin="outer")
+
+    def test_malformed_value(self):
+        table = self.table.astype(object)
+        table.iloc[30, 4] = "x"
+        fileName = self.writeTable("data.csv", table)
+        with self.assertRaises(ValueError):
+            readExpressionMatrix(fileName, ",", chunkSize=4, processes=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from fixtures import FileTestCase
+from dataLoader import *
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+@unittest.skipIf(h5py is None, "h5py is needed for HDF5 and h5ad files")
+class TestHDF5(FileTestCase):
+    def setUp(self):
+        super().setUp()
+        randomState = np.random.RandomState(0)
+        self.X = randomState.poisson(0.8, size=(30, 12)).astype(np.float64)  # cells * genes
+        self.genes = ["gene" + str(i) for i in range(0, 12)]
+        self.cells = ["cell" + str(i) for i in range(0, 30)]
+        self.table = pd.DataFrame(self.X.T, index=self.genes, columns=self.cells)
+
+    def writeH5ad(self, encoding):
+        """Minimal AnnData file with X stored dense, as CSR or as CSC"""
+        fileName = self.tempPath(str(encoding) + ".h5ad")
+        with h5py.File(fileName, "w") as h5File:
+            for name, index in [("obs", self.cells), ("var", self.genes)]:
+                group = h5File.create_group(name)
+                group.attrs["_index"] = "_index"
+                group.create_dataset("_index", data=np.array(index, dtype="S"))
+            if encoding is None:
+                h5File.create_dataset("X", data=self.X)
+            else:
+                matrix = sparse.csr_matrix(self.X) if encoding == "csr" else sparse.csc_matrix(self.X)
+                group = h5File.create_group("X")
+                group.attrs["encoding-type"] = encoding + "_matrix"
+                group.attrs["shape"] = self.X.shape
+                for name in ["data", "indices", "indptr"]:
+                    group.create_dataset(name, data=getattr(matrix, name))
+        return fileName
+
+    def test_readH5ad(self):
+        for encoding in [None, "csr", "csc"]:
+            with self.subTest(encoding=encoding):
+                fileName = self.writeH5ad(encoding)
+                self.assertTrue(isHDF5(fileName))
+                self.assertEqual(readH5adNames(fileName), (self.genes, self.cells))
+                self.assertSameTable(readMatrix(fileName, ","), self.table)
+
+    def test_readH5ad_subsets(self):
+        # cells come back in the order of cellIndices, as from the other readers
+        cellIndices = [5, 2, 29, 2, 0]
+        geneSubset = {"gene11", "gene3", "gene4"}
+        for encoding in [None, "csr", "csc"]:
+            with self.subTest(encoding=encoding):
+                self.assertSameTable(
+                    readH5ad(self.writeH5ad(encoding), cellIndices=cellIndices, geneSubset=geneSubset),
+                    self.table.iloc[[3, 4, 11], cellIndices],
+                )
+
+    def test_lazy_matrices(self):
+        binary = (self.X.T > 0).astype(np.uint8)
+        fileName = self.tempPath("store.h5")
+        saveHDF5(
+            fileName,
+            {"binMat": bitMatrix.fromDense(binary), "expMat": sparse.csr_matrix(self.X.T)},
+            chunkRows=5,
+        )
+        binMat = loadHDF5(fileName, "binMat", chunkRows=5, cacheChunks=2)
+        expMat = loadHDF5(fileName, "expMat", chunkRows=5, cacheChunks=2)
+        rows = [11, 0, 7, 7, 3]
+        np.testing.assert_array_equal(binMat.getRows(rows), binary[rows, :])
+        np.testing.assert_array_equal(binMat.getRow(9), binary[9, :])
+        np.testing.assert_array_equal(expMat[rows, :].toarray(), self.X.T[rows, :])
+        np.testing.assert_array_equal(expMat[2:6, [1, 4]].toarray(), self.X.T[2:6, [1, 4]])
+        np.testing.assert_array_equal(expMat.toarray(), self.X.T)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,413 @@
+import ctypes
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+
+from fixtures import SOURCE
+from compiledModel import compiledModel
+
+STEP = 100  # rows of simData, as in simulator.c
+
+
+def buildSimulator(directory):
+    """Compile simulator.c with the flags of the makefile"""
+    library = os.path.join(directory, "simulator.so")
+    subprocess.check_call(
+        ["gcc", "-fopenmp", "-o", library, "-fPIC", "-O3", "-shared", os.path.join(SOURCE, "simulator.c")]
+    )
+    return ctypes.cdll.LoadLibrary(library)
+
+
+def randomModel(randomState, nodeNum, maxTerms=4, maxInputs=3):
+    """Random rules over nodeNum nodes as a compiledModel"""
+    andNodeList = []
+    andNodeInvertList = []
+    for node in range(0, nodeNum):
+        terms = []
+        inverts = []
+        for term in range(0, randomState.randint(0, maxTerms + 1)):
+            size = randomState.randint(1, min(maxInputs, nodeNum) + 1)
+            terms.append(list(randomState.choice(nodeNum, size=size, replace=False)))
+            inverts.append(list(randomState.randint(0, 2, size=size)))
+        andNodeList.append(terms)
+        andNodeInvertList.append(inverts)
+    return compiledModel(andNodeList, andNodeInvertList)
+
+
+def randomLayeredModel(randomState, acyclicNum, cyclicNum, maxTerms=4, maxInputs=3):
+    """Random rules where each of the first acyclicNum nodes reads only nodes after it among them, and the other nodes read any node, so the settle order is reversed on the acyclic part"""
+    nodeNum = acyclicNum + cyclicNum
+    andNodeList = []
+    andNodeInvertList = []
+    for node in range(0, nodeNum):
+        sources = np.arange(node + 1, acyclicNum) if node < acyclicNum else np.arange(nodeNum)
+        terms = []
+        inverts = []
+        for term in range(0, randomState.randint(0, maxTerms + 1) if len(sources) else 0):
+            size = randomState.randint(1, min(maxInputs, len(sources)) + 1)
+            terms.append(list(randomState.choice(sources, size=size, replace=False)))
+            inverts.append(list(randomState.randint(0, 2, size=size)))
+        andNodeList.append(terms)
+        andNodeInvertList.append(inverts)
+    return compiledModel(andNodeList, andNodeInvertList)
+
+
+def ringModel(lengths):
+    """Rings of nodes that copy the previous node, the first node of each ring inverting it, so a ring of length n cycles with period 2n"""
+    andNodeList = []
+    andNodeInvertList = []
+    for length in lengths:
+        first = len(andNodeList)
+        for position in range(0, length):
+            andNodeList.append([[first + (position - 1) % length]])
+            andNodeInvertList.append([[int(position == 0)]])
+    return compiledModel(andNodeList, andNodeInvertList)
+
+
+def referenceStep(model, individual, old, forcedZero, forcedOne, firstInputOnly):
+    """Synchronous update of every node for the cells in the columns of old (nodes * cells)"""
+    new = np.empty_like(old)
+    for node in range(0, model.nodeNum):
+        terms = list(range(model.termOffsets[node], model.termOffsets[node + 1]))
+        if forcedZero[node]:
+            new[node] = 0
+        elif forcedOne is not None and forcedOne[node]:
+            new[node] = 1
+        elif not terms:
+            new[node] = old[node]
+        elif firstInputOnly:
+            k = model.inputOffsets[terms[0]]
+            new[node] = old[model.inputs[k]] != model.inverts[k]
+        else:
+            selected = terms if len(terms) == 1 else [t for t in terms if individual[t]]
+            value = old[node] if not selected else np.zeros(old.shape[1], dtype=bool)
+            for term in selected:
+                inputs = range(model.inputOffsets[term], model.inputOffsets[term + 1])
+                value = value | np.all(
+                    [old[model.inputs[k]] != model.inverts[k] for k in inputs], axis=0
+                )
+            new[node] = value
+    return new
+
+
+def referenceTrajectories(model, individual, states, simData, simSteps, forcedZero, forcedOne, firstInputOnly=False):
+    """STEP * nodes * cells trajectories; rows from simSteps on are those of simData, as the simulator leaves them"""
+    trajectories = np.repeat(simData[:, :, None], states.shape[1], axis=2)
+    trajectories[0] = states
+    for step in range(1, simSteps):
+        trajectories[step] = referenceStep(
+            model, individual, trajectories[step - 1], forcedZero, forcedOne, firstInputOnly
+        )
+    return trajectories
+
+
+def referenceAttractor(trajectory):
+    """Rows (first, second) of the attractor of one STEP * nodes trajectory, as getAttractCycle2: the latest row with an earlier copy, and the latest such copy"""
+    for second in range(STEP - 1, -1, -1):
+        copies = np.flatnonzero((trajectory[0:second] == trajectory[second]).all(axis=1))
+        if len(copies):
+            return copies[-1], second
+    return 0, 0
+
+
+def referenceErrors(model, individual, knockouts, knockins, states, cellWeights, localSearch, simSteps=STEP, simData=None):
+    """Errors of the original cell-by-cell scSyncBool, with each state repeated as many times as its weight"""
+    nodeNum = model.nodeNum
+    simData = np.zeros((STEP, nodeNum), dtype=int) if simData is None else simData
+    cells = np.repeat(np.arange(states.shape[1]), cellWeights)
+    trajectories = referenceTrajectories(
+        model, individual, states[:, cells], simData, simSteps, knockouts, knockins
+    )
+    errors = np.zeros(nodeNum if localSearch else states.shape[1], dtype=int)
+    error = np.zeros(nodeNum, dtype=int)  # a cell without an attractor repeats the previous error
+    totalError = 0
+    for position, cell in enumerate(cells):
+        trajectory = trajectories[:, :, position]
+        first, second = referenceAttractor(trajectory)
+        minError = 100000
+        for row in range(first, second):
+            error = np.abs(trajectory[row] - trajectory[0])
+            totalError = error.sum()
+            if totalError < minError:
+                minError = totalError
+                if totalError <= 0.001 * nodeNum:
+                    # the first state within the tolerance is counted once more
+                    minError = 0
+                    if localSearch:
+                        errors += error
+        if localSearch:
+            errors += error
+        else:
+            errors[cell] += totalError
+    return errors
+
+
+def referenceImportance(model, individual, knockouts, knockins, states, cellWeights, simSteps=STEP, simData=None):
+    """Importance score of the original importanceScore, with each state repeated as many times as its weight"""
+    simData = np.zeros((STEP, model.nodeNum), dtype=int) if simData is None else simData
+    cells = np.repeat(np.arange(states.shape[1]), cellWeights)
+    attractorSums = np.zeros(model.nodeNum)
+    # knocked in nodes are set to 0 as well, and both passes add to the same average
+    for forced in [knockouts, knockins]:
+        trajectories = referenceTrajectories(
+            model, individual, states[:, cells], simData, simSteps, forced, None, firstInputOnly=True
+        )
+        for position in range(0, len(cells)):
+            first, second = referenceAttractor(trajectories[:, :, position])
+            if first == second:
+                continue  # no attractor, so nothing is added
+            for row in range(first, second + 1):
+                attractorSums += trajectories[row, :, position] // (second - first)
+    return np.abs(attractorSums / len(cells)).sum()
+
+
+def pointers(states, individual, knockouts, knockins, cellWeights):
+    """Arrays in the layout of the simulator, kept alive by the caller"""
+    return (
+        np.ascontiguousarray(np.packbits(states, axis=1)),
+        np.array(individual, dtype=np.intc),
+        np.array(knockouts, dtype=np.intc),
+        np.array(knockins, dtype=np.intc),
+        np.arange(states.shape[0], dtype=np.intc),
+        np.array(cellWeights, dtype=np.intc),
+    )
+
+
+def simulate(
+    function, model, individual, knockouts, knockins, states, cellWeights,
+    localSearch, threads, simSteps=STEP, simData=None,
+):
+    """Errors from scSyncBool or scSyncBool_cells for the cells in the columns of states (nodes * cells)"""
+    nodeNum, lenSamples = states.shape
+    packed, individual, knockouts, knockins, nodePositions, cellWeights = pointers(
+        states, individual, knockouts, knockins, cellWeights
+    )
+    simData = np.zeros((STEP, nodeNum), dtype=np.intc) if simData is None else np.array(simData, dtype=np.intc)
+    errors = np.zeros(nodeNum if localSearch else lenSamples, dtype=np.intc)
+    termOffsets, inputOffsets, inputs, inverts, settleOrder = model.pointers
+    function(
+        ctypes.c_void_p(simData.ctypes.data),
+        ctypes.c_void_p(individual.ctypes.data),
+        ctypes.c_void_p(nodeNum),
+        termOffsets,
+        inputOffsets,
+        inputs,
+        inverts,
+        settleOrder,
+        ctypes.c_void_p(simSteps),
+        ctypes.c_void_p(knockouts.ctypes.data),
+        ctypes.c_void_p(knockins.ctypes.data),
+        ctypes.c_void_p(lenSamples),
+        ctypes.c_void_p(packed.ctypes.data),
+        ctypes.c_void_p(packed.shape[1]),
+        ctypes.c_void_p(nodePositions.ctypes.data),
+        ctypes.c_void_p(errors.ctypes.data),
+        ctypes.c_void_p(int(localSearch)),
+        ctypes.c_void_p(0),
+        ctypes.c_void_p(cellWeights.ctypes.data),
+        ctypes.c_void_p(threads),
+    )
+    return errors
+
+
+def importance(function, model, individual, knockouts, knockins, states, cellWeights, threads, simSteps=STEP, simData=None):
+    """Score from importanceScore for the cells in the columns of states"""
+    nodeNum, lenSamples = states.shape
+    packed, individual, knockouts, knockins, nodePositions, cellWeights = pointers(
+        states, individual, knockouts, knockins, cellWeights
+    )
+    simData = np.zeros((STEP, nodeNum), dtype=np.intc) if simData is None else np.array(simData, dtype=np.intc)
+    score = np.zeros(1, dtype=np.float64)
+    termOffsets, inputOffsets, inputs, inverts, settleOrder = model.pointers
+    function(
+        ctypes.c_void_p(simData.ctypes.data),
+        ctypes.c_void_p(individual.ctypes.data),
+        ctypes.c_void_p(nodeNum),
+        termOffsets,
+        inputOffsets,
+        inputs,
+        inverts,
+        settleOrder,
+        ctypes.c_void_p(simSteps),
+        ctypes.c_void_p(knockouts.ctypes.data),
+        ctypes.c_void_p(knockins.ctypes.data),
+        ctypes.c_void_p(lenSamples),
+        ctypes.c_void_p(packed.ctypes.data),
+        ctypes.c_void_p(packed.shape[1]),
+        ctypes.c_void_p(nodePositions.ctypes.data),
+        ctypes.c_void_p(score.ctypes.data),
+        ctypes.c_void_p(cellWeights.ctypes.data),
+        ctypes.c_void_p(threads),
+    )
+    return score[0]
+
+
+def cluster(function, model, individual, knockouts, knockins, states, sampleIndex, simSteps=STEP, simData=None):
+    """Trajectory and attractor rows from cluster for the cell in column sampleIndex of states"""
+    nodeNum = states.shape[0]
+    packed, individual, knockouts, knockins, nodePositions, cellWeights = pointers(
+        states, individual, knockouts, knockins, []
+    )
+    simData = np.zeros((STEP, nodeNum), dtype=np.intc) if simData is None else np.array(simData, dtype=np.intc)
+    resSubmit = np.zeros(2, dtype=np.intc)
+    termOffsets, inputOffsets, inputs, inverts, settleOrder = model.pointers
+    function(
+        ctypes.c_void_p(simData.ctypes.data),
+        ctypes.c_void_p(resSubmit.ctypes.data),
+        ctypes.c_void_p(sampleIndex),
+        ctypes.c_void_p(individual.ctypes.data),
+        ctypes.c_void_p(nodeNum),
+        termOffsets,
+        inputOffsets,
+        inputs,
+        inverts,
+        settleOrder,
+        ctypes.c_void_p(simSteps),
+        ctypes.c_void_p(knockouts.ctypes.data),
+        ctypes.c_void_p(knockins.ctypes.data),
+        ctypes.c_void_p(packed.ctypes.data),
+        ctypes.c_void_p(packed.shape[1]),
+        ctypes.c_void_p(nodePositions.ctypes.data),
+    )
+    return simData, tuple(resSubmit)
+
+
+@unittest.skipIf(shutil.which("gcc") is None, "gcc is needed to build simulator.so")
+class TestScSyncBool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.buildDir = tempfile.mkdtemp()
+        cls.simulator = buildSimulator(cls.buildDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.buildDir, ignore_errors=True)
+
+    def randomCase(self, randomState, model, lenSamples):
+        individual = randomState.randint(0, 2, size=model.size)
+        perturbed = randomState.rand(model.nodeNum)
+        knockouts = (perturbed < 0.1).astype(int)
+        knockins = ((perturbed >= 0.1) & (perturbed < 0.2)).astype(int)
+        states = randomState.randint(0, 2, size=(model.nodeNum, lenSamples)).astype(np.uint8)
+        cellWeights = randomState.randint(1, 6, size=lenSamples)
+        return model, individual, knockouts, knockins, states, cellWeights
+
+    def assertSameErrors(self, case, localSearch, threads, simSteps=STEP, simData=None):
+        expected = referenceErrors(*case, localSearch=localSearch, simSteps=simSteps, simData=simData)
+        for function in [self.simulator.scSyncBool, self.simulator.scSyncBool_cells]:
+            errors = simulate(
+                function, *case,
+                localSearch=localSearch, threads=threads, simSteps=simSteps, simData=simData,
+            )
+            np.testing.assert_array_equal(errors, expected)
+
+    def assertSameImportance(self, case, threads, simSteps=STEP, simData=None):
+        model, individual, knockouts, knockins, states, cellWeights = case
+        # a few nodes in turn are knocked out in the first pass and knocked in in the second
+        for node in np.unique(np.linspace(0, model.nodeNum - 1, 5).astype(int)):
+            perturbed = np.zeros(model.nodeNum, dtype=int)
+            perturbed[node] = 1
+            perturbedCase = (model, individual, perturbed, perturbed, states, cellWeights)
+            self.assertAlmostEqual(
+                importance(self.simulator.importanceScore, *perturbedCase, threads, simSteps, simData),
+                referenceImportance(*perturbedCase, simSteps, simData),
+            )
+
+    def assertSameClusters(self, case, simSteps=STEP, simData=None):
+        model, individual, knockouts, knockins, states, cellWeights = case
+        nodeNum = model.nodeNum
+        simData = np.zeros((STEP, nodeNum), dtype=int) if simData is None else simData
+        trajectories = referenceTrajectories(
+            model, individual, states, simData, simSteps, knockouts, knockins
+        )
+        for sampleIndex in range(0, min(states.shape[1], 20)):
+            trajectory, resSubmit = cluster(
+                self.simulator.cluster, model, individual, knockouts, knockins, states,
+                sampleIndex, simSteps, simData,
+            )
+            np.testing.assert_array_equal(trajectory, trajectories[:, :, sampleIndex])
+            self.assertEqual(resSubmit, referenceAttractor(trajectories[:, :, sampleIndex]))
+
+    def assertSameSimulations(self, case, threads=4, simSteps=STEP, simData=None):
+        for localSearch in [0, 1]:
+            self.assertSameErrors(case, localSearch, threads, simSteps, simData)
+        self.assertSameImportance(case, threads, simSteps, simData)
+        self.assertSameClusters(case, simSteps, simData)
+
+    def test_random_models(self):
+        randomState = np.random.RandomState(0)
+        for trial in range(0, 30):
+            # more than 64 cells, so the last word of cells is partly filled
+            model = randomModel(randomState, randomState.randint(1, 16))
+            case = self.randomCase(randomState, model, randomState.randint(1, 200))
+            for threads in [1, 4]:
+                self.assertSameSimulations(case, threads)
+
+    def test_wide_rules(self):
+        # up to 9 terms of up to 10 inputs, beyond the 8-entry truth tables of the simulator
+        randomState = np.random.RandomState(4)
+        for trial in range(0, 10):
+            model = randomModel(randomState, 14, maxTerms=9, maxInputs=10)
+            self.assertGreater(np.diff(model.inputOffsets).max(), 8)
+            self.assertSameSimulations(self.randomCase(randomState, model, 90))
+
+    def test_settle_order(self):
+        # an acyclic part whose inputs come after it settles in the reverse of node order, and feeds a part with cycles
+        randomState = np.random.RandomState(5)
+        for trial in range(0, 10):
+            model = randomLayeredModel(randomState, 10, 6)
+            self.assertNotEqual(list(model.settleOrder), sorted(model.settleOrder))
+            self.assertSameSimulations(self.randomCase(randomState, model, 100))
+
+    def test_cycles(self):
+        # rings of 3 and 5 nodes cycle with periods 6 and 10 (30 together) after a transient; rings of 7, 9 and 11 never repeat within STEP rows, even with one of them broken
+        randomState = np.random.RandomState(6)
+        for lengths in [[1], [3], [3, 5], [7, 9, 11]]:
+            model = ringModel(lengths)
+            case = self.randomCase(randomState, model, 80)
+            case = (model, case[1], np.zeros(model.nodeNum, dtype=int), np.zeros(model.nodeNum, dtype=int)) + case[4:]
+            self.assertSameSimulations(case)
+
+    def test_tolerance_of_large_networks(self):
+        # from 1000 nodes, attractor states within 0.001 * nodes of the initial state are counted again
+        randomState = np.random.RandomState(1)
+        case = self.randomCase(randomState, randomModel(randomState, 1000), 70)
+        for threads in [1, 4]:
+            self.assertSameErrors(case, 1, threads)
+
+    def test_cells_without_attractor(self):
+        # nodes 0 to 6 are a 7-bit maximal LFSR with period 127, so only cells where they are all 0 repeat a state within STEP rows. Node 7 is then set, so those cells have errors
+        andNodeList = [[[5, 6], [5, 6]]] + [[[node - 1]] for node in range(1, 7)] + [[[0]]]
+        andNodeInvertList = [[[0, 1], [1, 0]]] + [[[0]] for node in range(1, 7)] + [[[1]]]
+        model = compiledModel(andNodeList, andNodeInvertList)
+        randomState = np.random.RandomState(3)
+        states = randomState.randint(0, 2, size=(8, 150)).astype(np.uint8)
+        states[0:7, randomState.rand(150) < 0.3] = 0
+        states[0:7, 0] = 1  # the first cell has no attractor and no cell before it
+        case = (
+            model,
+            np.ones(model.size, dtype=int),
+            np.zeros(8, dtype=int),
+            np.zeros(8, dtype=int),
+            states,
+            randomState.randint(1, 6, size=150),
+        )
+        for threads in [1, 4]:
+            self.assertSameSimulations(case, threads)
+
+    def test_short_trajectories(self):
+        # rows of simData from simSteps on are compared as the caller left them
+        randomState = np.random.RandomState(2)
+        for trial in range(0, 6):
+            model = randomModel(randomState, randomState.randint(1, 16))
+            case = self.randomCase(randomState, model, 130)
+            simData = randomState.randint(0, 2, size=(STEP, model.nodeNum))
+            self.assertSameSimulations(case, simSteps=20, simData=simData)
+
+
+if __name__ == "__main__":
+    unittest.main()